@@ -6,6 +6,7 @@ import types
 import threading
 import random
 from DIRAC.Core.Base.DB import DB
+from DIRAC.Core.Utilities.MySQL import readOnlySafe
 from DIRAC import S_OK, S_ERROR, gMonitor, gConfig
 from DIRAC.Core.Utilities import List, ThreadSafe, Time, DEncode
 from DIRAC.AccountingSystem.private.TypeLoader import TypeLoader
@@ -417,6 +418,7 @@ class AccountingDB( DB ):
                       )
     return S_OK( typesList )
 
+  @readOnlySafe
   def getKeyValues( self, typeName, condDict, connObj = False ):
     """
     Get all values for a given key field in a type
@@ -926,6 +928,7 @@ class AccountingDB( DB ):
         return S_ERROR( "Order fields %s are not defined" % ", ".join( missing ) )
     return S_OK()
 
+  @readOnlySafe
   def retrieveRawRecords( self, typeName, startTime, endTime, condDict, orderFields, connObj = False ):
     """
     Get RAW data from the DB
@@ -941,6 +944,7 @@ class AccountingDB( DB ):
     return self.__queryType( typeName, startTime, endTime, selectFields,
                              condDict, False, orderFields, "type" )
 
+  @readOnlySafe
   def retrieveBucketedData( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, connObj = False ):
     """
     Get data from the DB
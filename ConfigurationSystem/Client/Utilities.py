@@ -478,7 +478,7 @@ def getDBParameters( fullname ):
   CS
 
   Returns a dictionary with the keys: 'host', 'port', 'user', 'password',
-  'db' and 'queueSize'
+  'db' and 'queueSize', and 'Replicas' with the ( host, port ) of the read replicas
   """
 
   cs_path = getDatabaseSection( fullname )
@@ -535,4 +535,14 @@ def getDBParameters( fullname ):
   dbName = result['Value']
   parameters[ 'DBName' ] = dbName
 
+  # Optional read replicas as host[:port], they use the same user and password
+  replicas = []
+  for replica in gConfig.getValue( cs_path + '/Replicas', [] ):
+    replicaHost, replicaPort = ( replica.split( ':', 1 ) + [ dbPort ] )[:2]
+    try:
+      replicas.append( ( replicaHost, int( replicaPort ) ) )
+    except ValueError:
+      return S_ERROR( 'Invalid read replica %s' % replica )
+  parameters[ 'Replicas' ] = replicas
+
   return S_OK( parameters )
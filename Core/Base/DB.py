@@ -1,5 +1,20 @@
 """ DB is a base class for multiple DIRAC databases that are based on MySQL.
     It uniforms the way the database objects are constructed
+
+    Besides the connection parameters, the DB section in the CS can have:
+
+      StatementCacheSize  number of parsed statement templates kept ( 1000 )
+      QueryProfiling      account the statements in the QueryProfiler ( True )
+      Replicas            read replicas as host[:port] for the methods marked with readOnlySafe
+      ReplicaMaxLag       replication lag in seconds above which a replica is not used ( 30 )
+      ReplicaCheckPeriod  seconds between two checks of the replication lag ( 60 )
+
+    The replicas are used with the user and password of the DB. The lag is read with
+    SHOW SLAVE STATUS, which needs the REPLICATION CLIENT privilege on the replicas:
+
+      GRANT REPLICATION CLIENT ON *.* TO 'user'@'host';
+
+    Without it the check fails and the replicas are never used.
 """
 
 __RCSID__ = "$Id$"
@@ -34,6 +49,18 @@ class DB( MySQL ):
     if not self._connected:
       raise RuntimeError( 'Can not connect to DB %s, exiting...' % self.dbName )
 
+    # Number of parsed statement templates kept for the parameterized queries
+    self.statementCacheSize = self.getCSOption( 'StatementCacheSize', self.statementCacheSize )
+    # Account the statements in the QueryProfiler served by the getDBProfile RPC
+    self.queryProfiling = self.getCSOption( 'QueryProfiling', self.queryProfiling )
+
+    # Read replicas for the methods marked with readOnlySafe
+    self.dbReplicas = dbParameters.get( 'Replicas', [] )
+    if self.dbReplicas:
+      self._setReadReplicas( self.dbReplicas,
+                             self.getCSOption( 'ReplicaMaxLag', 30 ),
+                             self.getCSOption( 'ReplicaCheckPeriod', 60 ) )
+
 
     self.log.info( "==================================================" )
     #self.log.info("SystemInstance: "+self.system)
@@ -42,6 +69,8 @@ class DB( MySQL ):
     self.log.info( "Port:           " + str( self.dbPort ) )
     #self.log.info("Password:       "+self.dbPass)
     self.log.info( "DBName:         " + self.dbName )
+    if self.dbReplicas:
+      self.log.info( "Replicas:       " + ", ".join( [ "%s:%s" % replica for replica in self.dbReplicas ] ) )
     self.log.info( "==================================================" )
 
 #############################################################################
@@ -18,6 +18,53 @@ class _MagicMethod:
   def __str__( self ):
     return "<RPCClient method %s>" % self.__remoteFuncName
 
+class RPCBatch:
+  """
+  Accumulate RPC calls and execute them in a single round trip. Calls return
+  the position of their result in the list returned by execute:
+
+    batch = rpcClient.batch()
+    batch.setJobStatus( 1, 'Running' )
+    batch.setJobStatus( 2, 'Running' )
+    result = batch.execute()
+
+  It can also be used as a context, the calls are executed when leaving it and
+  the result is left in batch.result
+  """
+
+  def __init__( self, innerRPCClient ):
+    self.__innerRPCClient = innerRPCClient
+    self.__calls = []
+    self.result = None
+
+  def __addCall( self, sFunctionName, args ):
+    self.__calls.append( ( sFunctionName, args ) )
+    return len( self.__calls ) - 1
+
+  def __getattr__( self, attrName ):
+    return _MagicMethod( self.__addCall, attrName )
+
+  def __len__( self ):
+    return len( self.__calls )
+
+  def execute( self ):
+    """
+    Execute all the accumulated calls. Returns S_OK with a list of the S_OK/S_ERROR
+    results of each call in the same order they were added
+    """
+    calls = self.__calls
+    self.__calls = []
+    self.result = self.__innerRPCClient.executeBatchRPC( calls )
+    return self.result
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, excType, excValue, traceback ):
+    if excType is None:
+      self.execute()
+    return False
+
 class RPCClient:
 
   def __init__( self, *args, **kwargs ):
@@ -33,6 +80,12 @@ class RPCClient:
     retVal = self.__innerRPCClient.executeRPC( sFunctionName, args )
     return retVal
 
+  def batch( self ):
+    """
+    Get a batch to execute several RPC calls in one round trip
+    """
+    return RPCBatch( self.__innerRPCClient )
+
   def __getattr__( self, attrName ):
     """
     Function for emulating the existance of functions
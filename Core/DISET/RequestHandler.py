@@ -10,6 +10,8 @@ from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.Core.DISET.private.MessageBroker import getGlobalMessageBroker
 from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities.QueryProfiler import gQueryProfiler
+from DIRAC.Core.Security import Properties
 import DIRAC
 
 def getServiceOption( serviceInfo, optionName, defaultValue ):
@@ -116,6 +118,8 @@ class RequestHandler( object ):
     try:
       if actionType == "RPC":
         retVal = self.__doRPC( actionTuple[1] )
+      elif actionType == "BatchRPC":
+        retVal = self.__doBatchRPC()
       elif actionType == "FileTransfer":
         retVal = self.__doFileTransfer( actionTuple[1] )
       elif actionType == "Connection":
@@ -229,6 +233,51 @@ class RequestHandler( object ):
     self.__logRemoteQuery( "RPC/%s" % method, args )
     return self.__RPCCallFunction( method, args )
 
+  def __doBatchRPC( self ):
+    """
+    Execute a list of RPC calls received in one message. Each call is authorized
+    on its own as if it had been received as a standalone RPC
+
+    @return: S_OK with the list of S_OK/S_ERROR of each call
+    """
+    retVal = self.__trPool.receive( self.__trid )
+    if not retVal[ 'OK' ]:
+      raise RequestHandler.ConnectionError( "Error while receiving batch %s %s" % ( self.srv_getFormattedRemoteCredentials(),
+                                                                         retVal[ 'Message' ] ) )
+    calls = retVal[ 'Value' ]
+    if type( calls ) not in ( types.ListType, types.TupleType ):
+      return S_ERROR( "Batch must be a list of (method, args)" )
+    maxBatchSize = self.srv_getCSOption( "MaxBatchSize", 1000 )
+    if len( calls ) > maxBatchSize:
+      return S_ERROR( "Batch too big: %s calls, max is %s" % ( len( calls ), maxBatchSize ) )
+    credDict = self.getRemoteCredentials()
+    authorizeAction = self.serviceInfoDict[ 'authorizeAction' ]
+    results = []
+    try:
+      for call in calls:
+        try:
+          method, args = call
+        except ( TypeError, ValueError ):
+          results.append( S_ERROR( "Invalid batch entry" ) )
+          continue
+        if type( method ) not in types.StringTypes or type( args ) not in ( types.ListType, types.TupleType ):
+          results.append( S_ERROR( "Invalid batch entry" ) )
+          continue
+        actionTuple = ( "RPC", method )
+        self.serviceInfoDict[ 'actionTuple' ] = actionTuple
+        result = authorizeAction( actionTuple, self.__trid, credDict )
+        if result[ 'OK' ]:
+          self.__logRemoteQuery( "BatchRPC/%s" % method, args )
+          result = self.__RPCCallFunction( method, args )
+          if not isReturnStructure( result ):
+            message = "Method %s for action RPC does not return a S_OK/S_ERROR!" % method
+            gLogger.error( message )
+            result = S_ERROR( message )
+        results.append( result )
+    finally:
+      self.serviceInfoDict[ 'actionTuple' ] = ( "BatchRPC", "batch" )
+    return S_OK( results )
+
   def __RPCCallFunction( self, method, args ):
     realMethod = "export_%s" % method
     gLogger.debug( "RPC to %s" % realMethod )
@@ -471,6 +520,34 @@ class RequestHandler( object ):
 
     return S_OK( dInfo )
 
+  types_getWaitTimeHistograms = []
+  auth_getWaitTimeHistograms = [ 'authenticated' ]
+  def export_getWaitTimeHistograms( self ):
+    """
+    Get the concurrency limit, current usage and the histogram of the time spent
+    waiting for a free slot of each limited action of the service
+    """
+    return S_OK( self.__lockManager.getWaitStats() )
+
+  types_getDBProfile = []
+  auth_getDBProfile = [ Properties.SERVICE_ADMINISTRATOR ]
+  def export_getDBProfile( self, sortBy = 'Total', limit = 0 ):
+    """
+    Get the profile of the statements executed by the databases of the service:
+    count, total, mean, median, 99th percentile and max time and rows per statement
+    fingerprint and calling component, sorted by decreasing sortBy value
+    """
+    return S_OK( gQueryProfiler.getReport( sortBy, limit ) )
+
+  types_resetDBProfile = []
+  auth_resetDBProfile = [ Properties.SERVICE_ADMINISTRATOR ]
+  def export_resetDBProfile( self ):
+    """
+    Forget the profile of the statements executed by the databases of the service
+    """
+    gQueryProfiler.reset()
+    return S_OK()
+
 ####
 #
 #  Utilities methods
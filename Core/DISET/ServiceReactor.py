@@ -12,6 +12,7 @@ except:
 from DIRAC import gLogger, S_OK, S_ERROR
 from DIRAC.Core.DISET.private.Service import Service
 from DIRAC.Core.DISET.private.GatewayService import GatewayService
+from DIRAC.Core.DISET.private.EventReactor import EventReactor
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities import Network, Time
 from DIRAC.Core.Base.private.ModuleLoader import ModuleLoader
@@ -35,6 +36,7 @@ class ServiceReactor:
     self.__maxFD = 0
     self.__listeningConnections = {}
     self.__stats = ReactorStats()
+    self.__eventReactor = False
 
   def initialize( self, servicesList ):
     try:
@@ -58,6 +60,13 @@ class ServiceReactor:
       result = self.__services[ serviceName ].initialize()
       if not result[ 'OK' ]:
         return result
+      #The GW forwards the whole connection so it can't use the event reactor
+      if serviceName != GatewayService.GATEWAY_NAME and \
+         self.__services[ serviceName ].getConfig().getEventReactorEnabled():
+        if not self.__eventReactor:
+          self.__eventReactor = EventReactor()
+        gLogger.info( "%s proposals will be received by the event reactor" % serviceName )
+        self.__services[ serviceName ].setEventReactor( self.__eventReactor )
     return S_OK()
 
   def closeListeningConnections( self ):
@@ -108,6 +117,8 @@ class ServiceReactor:
       return result
     for svcName in self.__listeningConnections:
       gLogger.always( "Listening at %s" % self.__services[ svcName ].getConfig().getURL() )
+    if self.__eventReactor:
+      self.__eventReactor.start()
     #Multiple clones not yet working. Disabled by default
     if False and multiprocessing:
       for svcName in self.__listeningConnections:
@@ -161,7 +172,12 @@ class ServiceReactor:
         continue
       #Handle connection
       self.__stats.connectionStablished()
-      self.__services[ svcName ].handleConnection( clientTransport )
+      service = self.__services[ svcName ]
+      if service.usesEventReactor():
+        self.__eventReactor.watchConnection( service, clientTransport,
+                                             timeout = service.getConfig().getHandshakeTimeout() )
+      else:
+        service.handleConnection( clientTransport )
       #Renew context?
       now = time.time()
       renewed = False
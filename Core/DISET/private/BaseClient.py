@@ -4,8 +4,13 @@ __RCSID__ = "$Id$"
 import time
 import types
 import thread
+try:
+  from hashlib import md5
+except:
+  from md5 import md5
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
+from DIRAC.Core.DISET.private import Compression
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Utilities import List, Network
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
@@ -32,6 +37,8 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_KEEP_CONNECTION = "keepConnection"
+  KW_COMPRESSION = "compression"
 
   __threadConfig = ThreadConfig()
 
@@ -49,10 +56,13 @@ class BaseClient:
     self.__retry = 0
     self.__retryDelay = 0
     self.__bannedUrls = []
+    self.__keepConnection = False
+    self.__useCompression = True
     for initFunc in ( self.__discoverSetup, self.__discoverVO, self.__discoverTimeout,
                       self.__discoverURL, self.__discoverCredentialsToUse,
                       self.__checkTransportSanity,
-                      self.__setKeepAliveLapse ):
+                      self.__setKeepAliveLapse, self.__discoverKeepConnection,
+                      self.__discoverCompression ):
       result = initFunc()
       if not result[ 'OK' ] and self.__initStatus[ 'OK' ]:
         self.__initStatus = result
@@ -251,6 +261,12 @@ and this is thread %s
       return self.__initStatus
     if self.__enableThreadCheck:
       self.__checkThreadID()
+    if self.__keepConnection:
+      trid = getGlobalTransportPool().checkOutConnection( self.__getConnectionKey() )
+      if trid:
+        transport = getGlobalTransportPool().get( trid )
+        if transport:
+          return S_OK( ( trid, transport ) )
     gLogger.debug( "Connecting to: %s" % self.serviceURL )
     try:
       transport = gProtocolDict[ self.__URLTuple[0] ][ 'transport' ]( self.__URLTuple[1:3], **self.kwargs )
@@ -273,8 +289,34 @@ and this is thread %s
     trid = getGlobalTransportPool().add( transport )
     return S_OK( ( trid, transport ) )
 
-  def _disconnect( self, trid ):
-    getGlobalTransportPool().close( trid )
+  def _disconnect( self, trid, keepConnection = False ):
+    """ Close the connection or, if the server agreed to keep it open, return it to the pool
+    """
+    if keepConnection and self.__keepConnection:
+      getGlobalTransportPool().checkInConnection( self.__getConnectionKey(), trid )
+    else:
+      getGlobalTransportPool().close( trid )
+
+  def __getConnectionKey( self ):
+    """ Connections can only be shared between clients with the same destination and credentials
+    """
+    proxyString = self.kwargs.get( self.KW_PROXY_STRING, "" )
+    if proxyString:
+      proxyString = md5( proxyString ).hexdigest()
+    return ( tuple( self.__URLTuple[:3] ),
+             self.useCertificates,
+             self.kwargs.get( self.KW_PROXY_LOCATION, "" ),
+             proxyString,
+             self.kwargs.get( self.KW_SKIP_CA_CHECK, False ),
+             str( self.__extraCredentials ) )
+
+  def _serverKeepsConnection( self, proposalResult ):
+    """ Check if the server has agreed to keep the connection open after the action
+    """
+    if not self.__keepConnection or not proposalResult[ 'OK' ]:
+      return False
+    serverValue = proposalResult.get( 'Value' )
+    return type( serverValue ) == types.DictType and serverValue.get( 'keepConnection', False )
 
   def _proposeAction( self, transport, action ):
     if not self.__initStatus[ 'OK' ]:
@@ -282,10 +324,17 @@ and this is thread %s
     stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
                          action,
                          self.__extraCredentials )
+    proposalOptions = {}
+    if self.__keepConnection:
+      proposalOptions[ 'keepConnection' ] = True
+    if self.__useCompression:
+      proposalOptions[ 'compression' ] = Compression.getAvailableCodecs()
+    if proposalOptions:
+      stConnectionInfo += ( proposalOptions, )
     retVal = transport.sendData( S_OK( stConnectionInfo ) )
     if not retVal[ 'OK' ]:
       return retVal
-    serverReturn = transport.receiveData()
+    serverReturn = transport.receiveData( allowCompression = False )
     #TODO: Check if delegation is required
     if serverReturn[ 'OK' ] and 'Value' in serverReturn and type( serverReturn[ 'Value' ] ) == types.DictType:
       gLogger.debug( "There is a server requirement" )
@@ -293,6 +342,13 @@ and this is thread %s
       if 'delegate' in serverRequirements:
         gLogger.debug( "A delegation is requested" )
         serverReturn = self.__delegateCredentials( transport, serverRequirements[ 'delegate' ] )
+    #Did the server agree on compressing the messages?
+    transport.setCompression( False )
+    if serverReturn[ 'OK' ] and type( serverReturn.get( 'Value' ) ) == types.DictType:
+      codec = serverReturn[ 'Value' ].get( 'compression', False )
+      if codec in Compression.gCompressionCodecs:
+        transport.setCompression( codec, serverReturn[ 'Value' ].get( 'compressionThreshold',
+                                                                      Compression.DEFAULT_THRESHOLD ) )
     return serverReturn
 
   def __delegateCredentials( self, transport, delegationRequest ):
@@ -302,7 +358,7 @@ and this is thread %s
     retVal = transport.sendData( retVal[ 'Value' ] )
     if not retVal[ 'OK' ]:
       return retVal
-    return transport.receiveData()
+    return transport.receiveData( allowCompression = False )
 
   def __checkTransportSanity( self ):
     if not self.__initStatus[ 'OK' ]:
@@ -327,6 +383,22 @@ and this is thread %s
     self.kwargs[ self.KW_KEEP_ALIVE_LAPSE ] = kaa
     return S_OK()
 
+  def __discoverCompression( self ):
+    #Compression is on unless explicitly disabled
+    useCompression = self.kwargs.get( self.KW_COMPRESSION, True )
+    if type( useCompression ) in types.StringTypes:
+      useCompression = useCompression.lower() not in ( "n", "no", "false", "0" )
+    self.__useCompression = bool( useCompression )
+    return S_OK()
+
+  def __discoverKeepConnection( self ):
+    #Can be set per destination in /DIRAC/ConnConf/<host>:<port>/keepConnection
+    keepConnection = self.kwargs.get( self.KW_KEEP_CONNECTION, False )
+    if type( keepConnection ) in types.StringTypes:
+      keepConnection = keepConnection.lower() in ( "y", "yes", "true", "1" )
+    self.__keepConnection = bool( keepConnection )
+    return S_OK()
+
   def _getBaseStub( self ):
     newKwargs = dict( self.kwargs )
     #Set DN
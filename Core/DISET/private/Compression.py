@@ -0,0 +1,60 @@
+# $HeadURL$
+"""
+Compression codecs that can be negotiated for a DISET connection.
+Codecs are listed in order of preference.
+"""
+__RCSID__ = "$Id$"
+
+import zlib
+import struct
+
+try:
+  import lz4.block as lz4Codec
+except:
+  try:
+    import lz4 as lz4Codec
+  except:
+    lz4Codec = False
+
+#Messages smaller than this are never compressed
+DEFAULT_THRESHOLD = 65536
+#Messages are never decompressed beyond this size, even if the receiver sets no limit
+MAX_DECOMPRESSED_SIZE = 1073741824
+
+def _zlibDecompress( data, maxSize ):
+  decompressor = zlib.decompressobj()
+  data = decompressor.decompress( data, maxSize )
+  if decompressor.unconsumed_tail:
+    raise ValueError( "Decompressed data is bigger than %s bytes" % maxSize )
+  return data
+
+def _lz4Decompress( data, maxSize ):
+  #The lz4 blocks start with the uncompressed size as a little endian 32 bit integer
+  if len( data ) < 4 or struct.unpack( "<I", data[:4] )[0] > maxSize:
+    raise ValueError( "Decompressed data is bigger than %s bytes" % maxSize )
+  return lz4Codec.decompress( data )
+
+#codec name -> ( magic prefix in the message header, compress function,
+#                decompress function( data, maxSize ) raising an exception beyond maxSize )
+gCompressionCodecs = {}
+gCodecPreference = []
+if lz4Codec:
+  gCompressionCodecs[ 'lz4' ] = ( "dl4", lz4Codec.compress, _lz4Decompress )
+  gCodecPreference.append( 'lz4' )
+gCompressionCodecs[ 'zlib' ] = ( "dzl", lambda data : zlib.compress( data, 1 ), _zlibDecompress )
+gCodecPreference.append( 'zlib' )
+
+#magic prefix -> codec name
+gCodecMagics = dict( [ ( gCompressionCodecs[ codec ][0], codec ) for codec in gCompressionCodecs ] )
+
+def getAvailableCodecs():
+  return list( gCodecPreference )
+
+def negotiateCodec( offeredCodecs ):
+  """
+  Choose the preferred codec among the ones offered by the peer
+  """
+  for codec in gCodecPreference:
+    if codec in offeredCodecs:
+      return codec
+  return False
@@ -0,0 +1,237 @@
+# $HeadURL$
+"""
+Event driven connection handling for DISET services
+
+All the connections are watched from a single I/O thread using epoll (poll if epoll is not
+available). The I/O thread does the handshake and receives the proposal without blocking.
+Only connections with a complete proposal are handed to the service worker threads, so slow
+or idle clients don't hold a thread while the network catches up.
+"""
+__RCSID__ = "$Id$"
+
+import os
+import time
+import select
+import threading
+
+from DIRAC.Core.Utilities.ReturnValues import S_OK
+from DIRAC.FrameworkSystem.Client.Logger import gLogger
+
+class Poller:
+  """
+  Thin wrapper over epoll/poll. Timeouts are always in seconds
+  """
+
+  def __init__( self ):
+    if hasattr( select, "epoll" ):
+      self.__poller = select.epoll()
+      self.__msTimeout = False
+      self.IN = select.EPOLLIN
+      self.OUT = select.EPOLLOUT
+      self.ERR = select.EPOLLERR | select.EPOLLHUP
+    else:
+      self.__poller = select.poll()
+      self.__msTimeout = True
+      self.IN = select.POLLIN
+      self.OUT = select.POLLOUT
+      self.ERR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+  def register( self, fd, events ):
+    self.__poller.register( fd, events )
+
+  def modify( self, fd, events ):
+    self.__poller.modify( fd, events )
+
+  def unregister( self, fd ):
+    try:
+      self.__poller.unregister( fd )
+    except Exception:
+      pass
+
+  def poll( self, timeout ):
+    if self.__msTimeout:
+      timeout = int( timeout * 1000 )
+    try:
+      return self.__poller.poll( timeout )
+    except ( IOError, select.error ), e:
+      #Interrupted by a signal
+      if e.args[0] == 4:
+        return []
+      raise
+
+class EventReactor:
+
+  def __init__( self, handshakeTimeout = 30, idleTimeout = 60, pollTimeout = 1 ):
+    self.__handshakeTimeout = handshakeTimeout
+    self.__idleTimeout = idleTimeout
+    self.__pollTimeout = pollTimeout
+    self.__poller = Poller()
+    #fd -> connection dict
+    self.__connections = {}
+    self.__pendingConnections = []
+    self.__pendingLock = threading.Lock()
+    self.__wakeRead, self.__wakeWrite = os.pipe()
+    self.__poller.register( self.__wakeRead, self.__poller.IN )
+    self.__alive = False
+    self.__thread = False
+    self.__lastExpiration = time.time()
+    self.__stats = { 'dispatched' : 0, 'expired' : 0, 'failed' : 0 }
+
+  def start( self ):
+    if self.__thread:
+      return S_OK()
+    self.__alive = True
+    self.__thread = threading.Thread( target = self.__loop, name = "DISETEventReactor" )
+    self.__thread.setDaemon( 1 )
+    self.__thread.start()
+    return S_OK()
+
+  def stop( self ):
+    self.__alive = False
+    self.__wakeUp()
+
+  def getWatchedConnectionsCount( self ):
+    return len( self.__connections ) + len( self.__pendingConnections )
+
+  def getStats( self ):
+    return dict( self.__stats )
+
+  def watchConnection( self, service, clientTransport, trid = False, timeout = False ):
+    """
+    Wait for the next proposal of a connection and give it to service.handleProposal once
+    it has arrived. Connections without trid haven't done the handshake yet.
+    Can be called from any thread
+    """
+    if not timeout:
+      if trid:
+        timeout = self.__idleTimeout
+      else:
+        timeout = self.__handshakeTimeout
+    connDict = { 'service' : service,
+                 'timeout' : timeout,
+                 'transport' : clientTransport,
+                 'trid' : trid,
+                 'handshaken' : bool( trid ),
+                 'since' : time.time() }
+    self.__pendingLock.acquire()
+    try:
+      self.__pendingConnections.append( connDict )
+    finally:
+      self.__pendingLock.release()
+    self.__wakeUp()
+    return S_OK()
+
+  def __wakeUp( self ):
+    try:
+      os.write( self.__wakeWrite, "w" )
+    except OSError:
+      pass
+
+  def __loop( self ):
+    while self.__alive:
+      try:
+        events = self.__poller.poll( self.__pollTimeout )
+      except Exception:
+        gLogger.exception( "Error while polling connections" )
+        time.sleep( 0.1 )
+        continue
+      for fd, eventMask in events:
+        if fd == self.__wakeRead:
+          try:
+            os.read( self.__wakeRead, 4096 )
+          except OSError:
+            pass
+          continue
+        connDict = self.__connections.get( fd )
+        if not connDict:
+          self.__poller.unregister( fd )
+          continue
+        self.__processConnection( fd, connDict )
+      self.__addPendingConnections()
+      now = time.time()
+      if now - self.__lastExpiration > 1:
+        self.__lastExpiration = now
+        self.__expireConnections( now )
+
+  def __addPendingConnections( self ):
+    self.__pendingLock.acquire()
+    try:
+      pendingConnections = self.__pendingConnections
+      self.__pendingConnections = []
+    finally:
+      self.__pendingLock.release()
+    for connDict in pendingConnections:
+      try:
+        fd = connDict[ 'transport' ].getSocket().fileno()
+      except Exception:
+        self.__dropConnection( False, connDict, "Invalid socket" )
+        continue
+      self.__connections[ fd ] = connDict
+      self.__poller.register( fd, self.__poller.IN )
+      #Plain transports don't need to wait for the handshake and data may already be buffered
+      self.__processConnection( fd, connDict )
+
+  def __processConnection( self, fd, connDict ):
+    clientTransport = connDict[ 'transport' ]
+    try:
+      if not connDict[ 'handshaken' ]:
+        result = clientTransport.handshakeStep()
+        if not result[ 'OK' ]:
+          self.__dropConnection( fd, connDict, result[ 'Message' ] )
+          return
+        if result[ 'Value' ] != True:
+          if result[ 'Value' ] == "wantWrite":
+            self.__poller.modify( fd, self.__poller.IN | self.__poller.OUT )
+          else:
+            self.__poller.modify( fd, self.__poller.IN )
+          return
+        connDict[ 'handshaken' ] = True
+        connDict[ 'since' ] = time.time()
+        self.__poller.modify( fd, self.__poller.IN )
+      if clientTransport.hasBufferedMessage():
+        self.__dispatch( fd, connDict )
+        return
+      #Reading doesn't block, so also try when the proposal may be hidden in the SSL buffers
+      result = clientTransport.readAvailable()
+      if not result[ 'OK' ]:
+        self.__dropConnection( fd, connDict, result[ 'Message' ] )
+        return
+      if result[ 'Value' ]:
+        self.__dispatch( fd, connDict )
+    except Exception, e:
+      gLogger.exception( "Error while processing connection" )
+      self.__dropConnection( fd, connDict, str( e ) )
+
+  def __dispatch( self, fd, connDict ):
+    self.__poller.unregister( fd )
+    del( self.__connections[ fd ] )
+    self.__stats[ 'dispatched' ] += 1
+    try:
+      connDict[ 'service' ].handleProposal( connDict[ 'transport' ], connDict[ 'trid' ] )
+    except Exception, e:
+      gLogger.exception( "Error while dispatching proposal" )
+      self.__dropConnection( False, connDict, str( e ) )
+
+  def __dropConnection( self, fd, connDict, reason ):
+    if fd is not False:
+      self.__poller.unregister( fd )
+      if fd in self.__connections:
+        del( self.__connections[ fd ] )
+    if connDict[ 'handshaken' ] and connDict[ 'trid' ]:
+      #Persistent connection closed by the peer
+      gLogger.debug( "Closing idle connection", reason )
+      connDict[ 'service' ].closeConnection( connDict[ 'trid' ] )
+      return
+    self.__stats[ 'failed' ] += 1
+    gLogger.verbose( "Dropping connection", reason )
+    try:
+      connDict[ 'transport' ].close()
+    except Exception:
+      pass
+
+  def __expireConnections( self, now ):
+    for fd in list( self.__connections ):
+      connDict = self.__connections[ fd ]
+      if now - connDict[ 'since' ] > connDict[ 'timeout' ]:
+        self.__stats[ 'expired' ] += 1
+        self.__dropConnection( fd, connDict, "Timeout waiting for proposal" )
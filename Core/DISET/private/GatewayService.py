@@ -1,5 +1,6 @@
 
 import os
+import types
 import cStringIO
 import DIRAC
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR
@@ -79,12 +80,16 @@ class GatewayService( Service ):
       self._transportPool.close( trid )
     return result
 
+  def _acceptKeepConnection( self, trid, proposalTuple ):
+    #Forwarded connections are always one shot
+    return False
+
   def _receiveAndCheckProposal( self, trid ):
     clientTransport = self._transportPool.get( trid )
     #Get the peer credentials
     credDict = clientTransport.getConnectingCredentials()
     #Receive the action proposal
-    retVal = clientTransport.receiveData( 1024 )
+    retVal = clientTransport.receiveData( 1024, allowCompression = False )
     if not retVal[ 'OK' ]:
       gLogger.error( "Invalid action proposal", "%s %s" % ( self._createIdentityString( credDict,
                                                                                         clientTransport ),
@@ -145,7 +150,7 @@ class GatewayService( Service ):
       return retVal
     gLogger.info( "Sending delegation request for %s" % delegationRequest.getSubjectDN()[ 'Value' ] )
     clientTransport.sendData( S_OK( { 'delegate' : retVal[ 'Value' ] } ) )
-    delegatedCertChain = clientTransport.receiveData()
+    delegatedCertChain = clientTransport.receiveData( allowCompression = False )
     delegatedChain = X509Chain( keyObj = delegationRequest.getPKey() )
     retVal = delegatedChain.loadChainFromString( delegatedCertChain )
     if not retVal[ 'OK' ]:
@@ -188,6 +193,9 @@ class GatewayService( Service ):
     elif actionType == "RPC":
       gLogger.info( "Forwarding %s/%s action to %s for %s" % ( actionType, actionMethod, targetService, idString ) )
       retVal = self.__forwardRPCCall( targetService, clientInitArgs, actionMethod, retVal[ 'Value' ] )
+    elif actionType == "BatchRPC":
+      gLogger.info( "Forwarding %s action to %s for %s" % ( actionType, targetService, idString ) )
+      retVal = self.__forwardBatchRPCCall( targetService, clientInitArgs, retVal[ 'Value' ] )
     elif actionType == "Connection" and actionMethod == "new":
       gLogger.info( "Initiating a messaging connection to %s for %s" % ( targetService, idString ) )
       retVal = self._msgForwarder.addClient( trid, targetService, clientInitArgs, retVal[ 'Value' ] )
@@ -215,6 +223,13 @@ class GatewayService( Service ):
     methodObj = getattr( rpcClient, method )
     return methodObj( *params )
 
+  def __forwardBatchRPCCall( self, targetService, clientInitArgs, calls ):
+    if type( calls ) not in ( types.ListType, types.TupleType ):
+      return S_ERROR( "Batch must be a list of (method, args)" )
+    #Forward the whole batch in one round trip, the client falls back to single RPCs if needed
+    rpcClient = RPCClient( targetService, **clientInitArgs )
+    return rpcClient.executeBatchRPC( [ tuple( call ) for call in calls ] )
+
   def __forwardFileTransferCall( self, targetService, clientInitArgs, method,
                                  params, clientTransport ):
     transferRelay = TransferRelay( targetService, **clientInitArgs )
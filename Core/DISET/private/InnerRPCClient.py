@@ -17,6 +17,7 @@ class InnerRPCClient( BaseClient ):
       retVal[ 'rpcStub' ] = stub
       return retVal
     trid, transport = retVal[ 'Value' ]
+    keepConnection = False
     try:
       retVal = self._proposeAction( transport, ( "RPC", functionName ) )
       if not retVal[ 'OK' ]:
@@ -26,6 +27,7 @@ class InnerRPCClient( BaseClient ):
         else:
           retVal[ 'rpcStub' ] = stub
           return retVal
+      serverKeepsConnection = self._serverKeepsConnection( retVal )
 
       retVal = transport.sendData( S_OK( args ) )
       if not retVal[ 'OK' ]:
@@ -33,7 +35,43 @@ class InnerRPCClient( BaseClient ):
       receivedData = transport.receiveData()
       if type( receivedData ) == types.DictType:
         receivedData[ 'rpcStub' ] = stub
+        keepConnection = serverKeepsConnection
       return receivedData
     finally:
-      self._disconnect( trid )
+      self._disconnect( trid, keepConnection )
 
+
+  def executeBatchRPC( self, calls ):
+    """ Execute a list of ( functionName, args ) in one round trip. Servers that don't
+        know about batches get the calls one by one
+    """
+    if not calls:
+      return S_OK( [] )
+    retVal = self._connect()
+    if not retVal[ 'OK' ]:
+      return retVal
+    trid, transport = retVal[ 'Value' ]
+    keepConnection = False
+    try:
+      retVal = self._proposeAction( transport, ( "BatchRPC", "batch" ) )
+      if not retVal[ 'OK' ]:
+        if retVal[ 'Message' ].find( "is not a known action type" ) > -1:
+          return S_OK( [ self.executeRPC( functionName, args ) for functionName, args in calls ] )
+        return retVal
+      serverKeepsConnection = self._serverKeepsConnection( retVal )
+
+      retVal = transport.sendData( S_OK( [ ( functionName, tuple( args ) ) for functionName, args in calls ] ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      receivedData = transport.receiveData()
+      if type( receivedData ) == types.DictType:
+        keepConnection = serverKeepsConnection
+        if receivedData[ 'OK' ]:
+          baseStub = self._getBaseStub()
+          for iPos in range( len( receivedData[ 'Value' ] ) ):
+            result = receivedData[ 'Value' ][ iPos ]
+            if type( result ) == types.DictType:
+              result[ 'rpcStub' ] = ( baseStub, calls[ iPos ][0], tuple( calls[ iPos ][1] ) )
+      return receivedData
+    finally:
+      self._disconnect( trid, keepConnection )
@@ -1,14 +1,88 @@
 # $HeadURL$
 __RCSID__ = "$Id$"
 
+import time
 import threading
 
+#Upper bounds in secs of the wait time histogram buckets. Last bucket takes the rest
+WAIT_TIME_BUCKETS = ( 0.001, 0.01, 0.1, 1, 10 )
+
+class FairSemaphore:
+  """
+  Semaphore that hands free slots to the waiting threads in arrival order
+  and keeps a histogram of the time spent waiting for a slot
+  """
+
+  def __init__( self, iMaxThreads ):
+    self.iMaxThreads = iMaxThreads
+    self.__mutex = threading.Lock()
+    self.__active = 0
+    #List of ( event, queued time )
+    self.__waiting = []
+    self.__acquired = 0
+    self.__totalWait = 0.0
+    self.__maxWait = 0.0
+    self.__histogram = [ 0 ] * ( len( WAIT_TIME_BUCKETS ) + 1 )
+
+  def __recordWait( self, waitTime ):
+    self.__acquired += 1
+    self.__totalWait += waitTime
+    self.__maxWait = max( self.__maxWait, waitTime )
+    for iPos in range( len( WAIT_TIME_BUCKETS ) ):
+      if waitTime < WAIT_TIME_BUCKETS[ iPos ]:
+        self.__histogram[ iPos ] += 1
+        return
+    self.__histogram[ -1 ] += 1
+
+  def acquire( self ):
+    self.__mutex.acquire()
+    try:
+      if self.__active < self.iMaxThreads and not self.__waiting:
+        self.__active += 1
+        self.__recordWait( 0 )
+        return
+      oEvent = threading.Event()
+      self.__waiting.append( ( oEvent, time.time() ) )
+    finally:
+      self.__mutex.release()
+    #The releasing thread gives its slot straight to us
+    oEvent.wait()
+
+  def release( self ):
+    self.__mutex.acquire()
+    try:
+      if self.__waiting:
+        oEvent, queuedTime = self.__waiting.pop( 0 )
+        self.__recordWait( time.time() - queuedTime )
+        oEvent.set()
+      elif self.__active > 0:
+        self.__active -= 1
+    finally:
+      self.__mutex.release()
+
+  def getStats( self ):
+    self.__mutex.acquire()
+    try:
+      return { 'limit' : self.iMaxThreads,
+               'active' : self.__active,
+               'waiting' : len( self.__waiting ),
+               'acquired' : self.__acquired,
+               'totalWait' : self.__totalWait,
+               'maxWait' : self.__maxWait,
+               'buckets' : list( WAIT_TIME_BUCKETS ),
+               'histogram' : list( self.__histogram ) }
+    finally:
+      self.__mutex.release()
+
 class LockManager:
+  """
+  Concurrency limits for the service actions. Actions without a limit don't take any lock
+  """
 
   def __init__( self, iMaxThreads = None ):
     self.iMaxThreads = iMaxThreads
     if iMaxThreads:
-      self.oGlobalLock = threading.Semaphore( iMaxThreads )
+      self.oGlobalLock = FairSemaphore( iMaxThreads )
     else:
       self.oGlobalLock = False
     self.dLocks = {}
@@ -19,8 +93,7 @@ class LockManager:
       raise RuntimeError( "%s lock already exists" % sLockName )
     if iMaxThreads < 1:
       return
-    self.dLocks[ sLockName ] = threading.Semaphore( iMaxThreads )
-    self.dLocks[ sLockName ].release()
+    self.dLocks[ sLockName ] = FairSemaphore( iMaxThreads )
 
   def lockGlobal( self ):
     if self.oGlobalLock:
@@ -31,9 +104,17 @@ class LockManager:
       self.oGlobalLock.release()
 
   def lock( self, sLockName ):
-    if sLockName in self.dLocks:
-      self.dLocks[ sLockName ].acquire()
+    oLock = self.dLocks.get( sLockName )
+    if oLock:
+      oLock.acquire()
 
   def unlock( self, sLockName ):
-    if sLockName in self.dLocks:
-      self.dLocks[ sLockName ].release()
+    oLock = self.dLocks.get( sLockName )
+    if oLock:
+      oLock.release()
+
+  def getWaitStats( self ):
+    """
+    Get limit, usage and wait time histogram for each limited action
+    """
+    return dict( [ ( sLockName, self.dLocks[ sLockName ].getStats() ) for sLockName in self.dLocks ] )
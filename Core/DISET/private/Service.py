@@ -1,6 +1,7 @@
 
 import os
 import time
+import types
 import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR, gMonitor
@@ -9,6 +10,7 @@ from DIRAC.Core.DISET.private.LockManager import LockManager
 from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.DISET.private import Compression
 from DIRAC.Core.DISET.private.MessageBroker import MessageBroker, MessageSender
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
@@ -24,7 +26,8 @@ class Service:
   SVC_VALID_ACTIONS = { 'RPC' : 'export',
                         'FileTransfer': 'transfer',
                         'Message' : 'msg',
-                        'Connection' : 'Message' }
+                        'Connection' : 'Message',
+                        'BatchRPC' : 'RPC' }
   SVC_SECLOG_CLIENT = SecurityLogClient()
 
   def __init__( self, serviceData ):
@@ -40,11 +43,14 @@ class Service:
     else:
       self._monitor = MonitoringClient()
     self.__monitorLastStatsUpdate = time.time()
-    self._stats = { 'queries' : 0, 'connections' : 0 }
+    self._stats = { 'queries' : 0, 'connections' : 0, 'compressionSavedBytes' : 0 }
     self._authMgr = AuthManager( "%s/Authorization" % PathFinder.getServiceSection( serviceData[ 'loadName' ] ) )
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    self.__persistentConnections = set()
+    self.__persistentLock = threading.Lock()
+    self.__eventReactor = False
 
   def setCloneProcessId( self, cloneId ):
     self.__cloneId = cloneId
@@ -67,8 +73,8 @@ class Service:
     if not result[ 'OK' ]:
       return result
     self._handler = result[ 'Value' ]
-    #Initialize lock manager
-    self._lockManager = LockManager( self._cfg.getMaxWaitingPetitions() )
+    #Initialize lock manager. The thread pool already bounds the requests served at once
+    self._lockManager = LockManager()
     self._initMonitoring()
     self._threadPool = ThreadPool( max( 1, self._cfg.getMinThreads() ),
                                    max( 0, self._cfg.getMaxThreads() ),
@@ -81,7 +87,8 @@ class Service:
                               'URL' : self._cfg.getURL(),
                               'messageSender' : MessageSender( self._name, self._msgBroker ),
                               'validNames' : self._validNames,
-                              'csPaths' : [ PathFinder.getServiceSection( svcName ) for svcName in self._validNames ]
+                              'csPaths' : [ PathFinder.getServiceSection( svcName ) for svcName in self._validNames ],
+                              'authorizeAction' : self._authorizeProposal
                              }
     #Call static initialization function
     try:
@@ -197,9 +204,11 @@ class Service:
         exportedName = attribute[ len( methodPrefix ) : ]
         methodsList[ actionType ].append( exportedName )
         gLogger.verbose( "+ Found %s method %s" % ( actionType, exportedName ) )
-        #Create lock for method
-        self._lockManager.createLock( "%s/%s" % ( actionType, exportedName ),
-                                       self._cfg.getMaxThreadsForMethod( actionType, exportedName ) )
+        #Create lock for method. Limits that the thread pool can't reach are not enforced
+        maxMethodThreads = self._cfg.getMaxThreadsForMethod( actionType, exportedName )
+        if maxMethodThreads >= self._cfg.getMaxThreads():
+          maxMethodThreads = 0
+        self._lockManager.createLock( "%s/%s" % ( actionType, exportedName ), maxMethodThreads )
         #Look for type and auth rules
         if actionType == 'RPC':
           typeAttr = "types_%s" % exportedName
@@ -244,6 +253,8 @@ class Service:
     self._monitor.registerActivity( 'ActiveQueries', "Active queries", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'RunningThreads', "Running threads", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'MaxFD', "Max File Descriptors", 'Framework', 'fd', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'CompressionSavedBytes', "Bytes saved by compression", 'Framework', 'bytes',
+                                    MonitoringClient.OP_SUM )
 
     self._monitor.setComponentExtraParam( 'DIRACVersion', DIRAC.version )
     self._monitor.setComponentExtraParam( 'platform', DIRAC.platform )
@@ -271,6 +282,15 @@ class Service:
   def getConfig( self ):
     return self._cfg
 
+  def setEventReactor( self, eventReactor ):
+    """
+    Use an EventReactor to receive the proposals instead of waiting for them in the worker threads
+    """
+    self.__eventReactor = eventReactor
+
+  def usesEventReactor( self ):
+    return bool( self.__eventReactor )
+
   #End of initialization functions
 
   def handleConnection( self, clientTransport ):
@@ -279,52 +299,134 @@ class Service:
     self._threadPool.generateJobAndQueueIt( self._processInThread,
                                              args = ( clientTransport, ) )
 
+  def handleProposal( self, clientTransport, trid = False ):
+    """
+    Process a connection whose handshake is done and whose proposal is already buffered
+    """
+    if not trid:
+      self._stats[ 'connections' ] += 1
+      self._monitor.setComponentExtraParam( 'queries', self._stats[ 'connections' ] )
+    self._threadPool.generateJobAndQueueIt( self._processInThread,
+                                             args = ( clientTransport, trid, True ) )
+
+  def closeConnection( self, trid ):
+    self.__releasePersistentConnection( trid )
+    self._transportPool.close( trid )
+
   #Threaded process function
-  def _processInThread( self, clientTransport ):
+  def _processInThread( self, clientTransport, trid = False, handshaken = False ):
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
-    self._lockManager.lockGlobal()
-    try:
-      monReport = self.__startReportToMonitoring()
-    except Exception, e:
-      monReport = False
+    watched = False
     try:
-      #Handshake
-      try:
-        result = clientTransport.handshake()
-        if not result[ 'OK' ]:
-          clientTransport.close()
-          return
-      except:
-        return
-      #Add to the transport pool
-      trid = self._transportPool.add( clientTransport )
-      if not trid:
-        return
-      #Receive and check proposal
-      result = self._receiveAndCheckProposal( trid )
-      if not result[ 'OK' ]:
-        self._transportPool.sendAndClose( trid, result )
-        return
-      proposalTuple = result[ 'Value' ]
-      #Instantiate handler
-      result = self._instantiateHandler( trid, proposalTuple )
+      while True:
+        try:
+          monReport = self.__startReportToMonitoring()
+        except Exception, e:
+          monReport = False
+        try:
+          if not trid:
+            #Handshake
+            if not handshaken:
+              try:
+                result = clientTransport.handshake()
+                if not result[ 'OK' ]:
+                  clientTransport.close()
+                  return
+              except:
+                return
+            #Add to the transport pool
+            trid = self._transportPool.add( clientTransport )
+            if not trid:
+              return
+          result = self.__processConnectionProposal( trid )
+          self.__reportCompressionStats( clientTransport )
+        finally:
+          if monReport:
+            self.__endReportToMonitoring( *monReport )
+        if not result or not result.get( 'keepConnection' ):
+          return result
+        if self.__eventReactor:
+          #The reactor waits for the next proposal so the thread is free for other clients.
+          #The connection keeps its persistent slot until the reactor closes it
+          watched = True
+          self.__eventReactor.watchConnection( self, clientTransport, trid,
+                                               self._cfg.getConnectionIdleTimeout() )
+          return result
+        #Wait for the next proposal from the client on the same connection
+        if not self._transportPool.waitForData( trid, self._cfg.getConnectionIdleTimeout() ):
+          self._transportPool.close( trid )
+          return result
+    finally:
+      if not watched:
+        self.__releasePersistentConnection( trid )
+
+  def __processConnectionProposal( self, trid ):
+    #Receive and check proposal
+    result = self._receiveAndCheckProposal( trid )
+    if not result[ 'OK' ]:
+      self._transportPool.sendAndClose( trid, result )
+      return
+    proposalTuple = result[ 'Value' ]
+    #Instantiate handler
+    result = self._instantiateHandler( trid, proposalTuple )
+    if not result[ 'OK' ]:
+      self._transportPool.sendAndClose( trid, result )
+      return
+    handlerObj = result[ 'Value' ]
+    #Execute the action
+    result = self._processProposal( trid, proposalTuple, handlerObj )
+    #Close the connection if required
+    if result[ 'closeTransport' ] or not result[ 'OK' ]:
       if not result[ 'OK' ]:
-        self._transportPool.sendAndClose( trid, result )
-        return
-      handlerObj = result[ 'Value' ]
-      #Execute the action
-      result = self._processProposal( trid, proposalTuple, handlerObj )
-      #Close the connection if required
-      if result[ 'closeTransport' ] or not result[ 'OK' ]:
-        if not result[ 'OK' ]:
-          gLogger.error( "Error processing proposal", result[ 'Message' ] )
-        self._transportPool.close( trid )
-      return result
+        gLogger.error( "Error processing proposal", result[ 'Message' ] )
+      self._transportPool.close( trid )
+    return result
+
+  def __reportCompressionStats( self, clientTransport ):
+    stats = clientTransport.popCompressionStats()
+    if stats[ 'rawBytes' ]:
+      savedBytes = stats[ 'rawBytes' ] - stats[ 'sentBytes' ]
+      self._stats[ 'compressionSavedBytes' ] += savedBytes
+      self._monitor.addMark( 'CompressionSavedBytes', savedBytes )
+
+  def _negotiateCompression( self, trid, proposalTuple ):
+    """
+    Choose a compression codec among the ones offered by the client. Only RPC replies are compressed
+    """
+    if len( proposalTuple ) < 4 or type( proposalTuple[3] ) != types.DictType:
+      return False
+    if proposalTuple[1][0] not in ( 'RPC', 'BatchRPC' ) or not self._cfg.getCompressionEnabled():
+      return False
+    offeredCodecs = proposalTuple[3].get( 'compression', [] )
+    if type( offeredCodecs ) not in ( types.ListType, types.TupleType ):
+      return False
+    return Compression.negotiateCodec( offeredCodecs )
+
+  def _acceptKeepConnection( self, trid, proposalTuple ):
+    """
+    Check if the client asked to keep the connection open after an RPC and there's room for it
+    """
+    if len( proposalTuple ) < 4 or type( proposalTuple[3] ) != types.DictType:
+      return False
+    if not proposalTuple[3].get( 'keepConnection' ) or proposalTuple[1][0] not in ( 'RPC', 'BatchRPC' ):
+      return False
+    self.__persistentLock.acquire()
+    try:
+      if trid in self.__persistentConnections:
+        return True
+      if len( self.__persistentConnections ) >= self._cfg.getMaxPersistentConnections():
+        return False
+      self.__persistentConnections.add( trid )
+      return True
     finally:
-      self._lockManager.unlockGlobal()
-      if monReport:
-        self.__endReportToMonitoring( *monReport )
+      self.__persistentLock.release()
 
+  def __releasePersistentConnection( self, trid ):
+    self.__persistentLock.acquire()
+    try:
+      self.__persistentConnections.discard( trid )
+    finally:
+      self.__persistentLock.release()
 
   def _createIdentityString( self, credDict, clientTransport = None ):
     if 'username' in credDict:
@@ -347,7 +449,7 @@ class Service:
     #Get the peer credentials
     credDict = clientTransport.getConnectingCredentials()
     #Receive the action proposal
-    retVal = clientTransport.receiveData( 1024 )
+    retVal = clientTransport.receiveData( 1024, allowCompression = False )
     if not retVal[ 'OK' ]:
       gLogger.error( "Invalid action proposal", "%s %s" % ( self._createIdentityString( credDict,
                                                                                         clientTransport ),
@@ -448,9 +550,26 @@ class Service:
 
   def _processProposal( self, trid, proposalTuple, handlerObj ):
     #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    keepConnection = self._acceptKeepConnection( trid, proposalTuple )
+    codec = self._negotiateCompression( trid, proposalTuple )
+    readyDict = {}
+    if keepConnection:
+      readyDict[ 'keepConnection' ] = True
+    if codec:
+      readyDict[ 'compression' ] = codec
+      readyDict[ 'compressionThreshold' ] = self._cfg.getCompressionThreshold()
+    if readyDict:
+      retVal = self._transportPool.send( trid, S_OK( readyDict ) )
+    else:
+      retVal = self._transportPool.send( trid, S_OK() )
     if not retVal[ 'OK' ]:
       return retVal
+    clientTransport = self._transportPool.get( trid )
+    if clientTransport:
+      if codec:
+        clientTransport.setCompression( codec, self._cfg.getCompressionThreshold() )
+      else:
+        clientTransport.setCompression( False )
 
     messageConnection = False
     if proposalTuple[1] == ( 'Connection', 'new' ):
@@ -476,7 +595,8 @@ class Service:
       if not result[ 'OK' ]:
         self._msgBroker.removeTransport( trid )
 
-    result[ 'closeTransport' ] = not messageConnection or not result[ 'OK' ]
+    result[ 'keepConnection' ] = keepConnection and result[ 'OK' ]
+    result[ 'closeTransport' ] = not ( messageConnection or result[ 'keepConnection' ] ) or not result[ 'OK' ]
     return result
 
   def _mbConnect( self, trid, handlerObj = None ):
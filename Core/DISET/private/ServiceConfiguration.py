@@ -5,6 +5,7 @@ from DIRAC.Core.Utilities import Network, List
 from DIRAC.ConfigurationSystem.Client.ConfigurationData import gConfigurationData
 from DIRAC.ConfigurationSystem.Client import PathFinder
 from DIRAC.Core.DISET.private.Protocols import gDefaultProtocol
+from DIRAC.Core.DISET.private import Compression
 
 class ServiceConfiguration:
 
@@ -80,6 +81,42 @@ class ServiceConfiguration:
     except:
       return 15
 
+  def getMaxPersistentConnections( self ):
+    try:
+      return int( self.getOption( "MaxPersistentConnections" ) )
+    except:
+      return self.getMaxThreads() / 2
+
+  def getConnectionIdleTimeout( self ):
+    try:
+      return int( self.getOption( "ConnectionIdleTimeout" ) )
+    except:
+      return 60
+
+  def getEventReactorEnabled( self ):
+    optionValue = self.getOption( "EventReactor" )
+    if not optionValue:
+      return False
+    return optionValue.lower() in ( "y", "yes", "true", "1" )
+
+  def getHandshakeTimeout( self ):
+    try:
+      return int( self.getOption( "HandshakeTimeout" ) )
+    except:
+      return 30
+
+  def getCompressionEnabled( self ):
+    optionValue = self.getOption( "Compression" )
+    if not optionValue:
+      return True
+    return optionValue.lower() in ( "y", "yes", "true", "1" )
+
+  def getCompressionThreshold( self ):
+    try:
+      return int( self.getOption( "CompressionThreshold" ) )
+    except:
+      return Compression.DEFAULT_THRESHOLD
+
   def getCloneProcesses( self ):
     try:
       return int( self.getOption( "CloneProcesses" ) )
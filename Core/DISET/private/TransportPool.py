@@ -1,12 +1,13 @@
 
 import time
+import select
 import threading
-from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 
 class TransportPool:
 
-  def __init__( self, logger = False ):
+  def __init__( self, logger = False, idleTimeout = 30, maxPerDestination = 4 ):
     if logger:
       self.log = logger
     else:
@@ -15,10 +16,18 @@ class TransportPool:
     self.__transports = {}
     self.__listenPersistConn = False
     self.__msgCounter = 0
+    #Idle persistent client connections: connKey -> [ ( trid, lastUsed ), ... ]
+    self.__idleConnections = {}
+    self.__idleTimeout = idleTimeout
+    self.__maxPerDestination = maxPerDestination
     result = gThreadScheduler.addPeriodicTask( 5, self.__sendKeepAlives )
     if not result[ 'OK' ]:
       self.log.fatal( "Cannot add task to thread scheduler", result[ 'Message' ] )
     self.__keepAlivesTask = result[ 'Value' ]
+    result = gThreadScheduler.addPeriodicTask( max( 1, idleTimeout / 2 ), self.__evictIdleConnections )
+    if not result[ 'OK' ]:
+      self.log.fatal( "Cannot add task to thread scheduler", result[ 'Message' ] )
+    self.__evictionTask = result[ 'Value' ]
 
   #
   # Send keep alives
@@ -93,6 +102,14 @@ class TransportPool:
     except KeyError:
       return None
 
+  # Wait for data on an idle connection
+
+  def waitForData( self, trid, timeout ):
+    try:
+      return self.__transports[ trid ][0].waitForData( timeout )
+    except KeyError:
+      return False
+
   # Receive
   def receive( self, trid, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False ):
     try:
@@ -155,11 +172,86 @@ class TransportPool:
     finally:
       self.__modLock.release()
 
+  #
+  # Persistent client connections
+  #
+
+  def __isReusable( self, trid ):
+    """ An idle connection can be reused if nothing is pending in it. If the socket
+        is readable while idle the peer has closed it (or sent something unexpected)
+    """
+    transport = self.get( trid )
+    if not transport or transport.byteStream or transport.receivedMessages:
+      return False
+    try:
+      inList = select.select( [ transport.getSocket() ], [], [], 0 )[0]
+    except Exception:
+      return False
+    return not inList
+
+  def checkOutConnection( self, connKey ):
+    """ Get an idle connection for connKey. Returns None if there is none available
+    """
+    while True:
+      self.__modLock.acquire()
+      try:
+        idleList = self.__idleConnections.get( connKey, [] )
+        if not idleList:
+          return None
+        trid = idleList.pop()[0]
+        if not idleList:
+          del( self.__idleConnections[ connKey ] )
+      finally:
+        self.__modLock.release()
+      if self.__isReusable( trid ):
+        self.log.debug( "Reusing connection", trid )
+        return trid
+      self.close( trid )
+
+  def checkInConnection( self, connKey, trid ):
+    """ Return a connection to the pool once the client is done with it.
+        The connection is closed if it can't be reused or the destination is full
+    """
+    if self.__isReusable( trid ):
+      self.__modLock.acquire()
+      try:
+        idleList = self.__idleConnections.setdefault( connKey, [] )
+        if len( idleList ) < self.__maxPerDestination:
+          idleList.append( ( trid, time.time() ) )
+          return True
+      finally:
+        self.__modLock.release()
+    self.close( trid )
+    return False
+
+  def __evictIdleConnections( self ):
+    limit = time.time() - self.__idleTimeout
+    toClose = []
+    self.__modLock.acquire()
+    try:
+      for connKey in list( self.__idleConnections ):
+        idleList = self.__idleConnections[ connKey ]
+        toClose.extend( [ trid for trid, lastUsed in idleList if lastUsed < limit ] )
+        idleList = [ ( trid, lastUsed ) for trid, lastUsed in idleList if lastUsed >= limit ]
+        if idleList:
+          self.__idleConnections[ connKey ] = idleList
+        else:
+          del( self.__idleConnections[ connKey ] )
+    finally:
+      self.__modLock.release()
+    for trid in toClose:
+      self.log.debug( "Closing idle connection", trid )
+      self.close( trid )
+
+  def getIdleConnectionsCount( self ):
+    return sum( [ len( idleList ) for idleList in self.__idleConnections.values() ] )
+
 
 gTransportPool = None
 
 def getGlobalTransportPool():
   global gTransportPool
   if not gTransportPool:
-    gTransportPool = TransportPool()
+    gTransportPool = TransportPool( idleTimeout = gConfig.getValue( "/DIRAC/ConnectionPool/IdleTimeout", 30 ),
+                                    maxPerDestination = gConfig.getValue( "/DIRAC/ConnectionPool/MaxPerDestination", 4 ) )
   return gTransportPool
@@ -3,7 +3,8 @@ __RCSID__ = "$Id$"
 
 import time
 import select
-import cStringIO
+import socket
+import errno
 try:
   from hashlib import md5
 except:
@@ -11,6 +12,7 @@ except:
 
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
 from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.DISET.private import Compression
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 
 class BaseTransport:
@@ -43,6 +45,9 @@ class BaseTransport:
         pass
     self.__lastActionTimestamp = time.time()
     self.__lastServerRenewTimestamp = self.__lastActionTimestamp
+    self.__compressionCodec = False
+    self.__compressionThreshold = Compression.DEFAULT_THRESHOLD
+    self.__compressionStats = { 'rawBytes' : 0, 'sentBytes' : 0 }
 
   def __updateLastActionTimestamp( self ):
     self.__lastActionTimestamp = time.time()
@@ -56,6 +61,38 @@ class BaseTransport:
   def handshake( self ):
     return S_OK()
 
+  def handshakeStep( self ):
+    """
+    Advance the handshake without blocking. Returns S_OK( True ) once done or
+    S_OK( "wantRead" / "wantWrite" ) if the socket has to be ready before trying again
+    """
+    result = self.handshake()
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( True )
+
+  def setCompression( self, codec, threshold = Compression.DEFAULT_THRESHOLD ):
+    """
+    Compress outgoing messages bigger than threshold with codec. False disables compression.
+    Compressed messages are always understood when received
+    """
+    if codec and codec not in Compression.gCompressionCodecs:
+      return S_ERROR( "Unknown compression codec %s" % codec )
+    self.__compressionCodec = codec
+    self.__compressionThreshold = threshold
+    return S_OK()
+
+  def getCompression( self ):
+    return self.__compressionCodec
+
+  def popCompressionStats( self ):
+    """
+    Get the bytes before and after compression of the messages sent since the last call
+    """
+    stats = self.__compressionStats
+    self.__compressionStats = { 'rawBytes' : 0, 'sentBytes' : 0 }
+    return stats
+
   def close( self ):
     self.oSocket.close()
 
@@ -98,6 +135,19 @@ class BaseTransport:
       return True
     return False
 
+  def waitForData( self, timeout ):
+    """
+    Wait up to timeout secs for data to be available. Used by servers to keep
+    an idle connection open waiting for the next proposal
+    """
+    if self.byteStream or self.receivedMessages:
+      return True
+    try:
+      inList = select.select( [ self.oSocket ], [], [], timeout )[0]
+    except Exception:
+      return False
+    return self.oSocket in inList
+
   def _read( self, bufSize = 4096, skipReadyCheck = False ):
     try:
       if skipReadyCheck or self._readReady():
@@ -111,22 +161,108 @@ class BaseTransport:
     except Exception, e:
       return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
 
+  def _readNonBlocking( self, bufSize = 16384 ):
+    """
+    Read whatever is available. Returns S_OK( None ) if reading would block
+    and S_OK( "" ) if the peer closed the connection
+    """
+    try:
+      return S_OK( self.oSocket.recv( bufSize, socket.MSG_DONTWAIT ) )
+    except socket.error, e:
+      if e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ):
+        return S_OK( None )
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    except Exception, e:
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+
+  def readAvailable( self ):
+    """
+    Buffer the data available in the socket without blocking.
+    Returns S_OK( True ) if there's a complete message ready for receiveData
+    """
+    retVal = self._readNonBlocking()
+    if not retVal[ 'OK' ]:
+      return retVal
+    data = retVal[ 'Value' ]
+    if data is not None:
+      if not data:
+        return S_ERROR( "Peer closed connection" )
+      self.byteStream += data
+    return S_OK( self.hasBufferedMessage() )
+
+  def hasBufferedMessage( self, maxBufferSize = 1048576 ):
+    """
+    Check if receiveData can return the next message without reading from the socket.
+    Messages that receiveData will reject (malformed, bigger than maxBufferSize) also count
+    as ready so the error is generated where it's expected
+    """
+    if self.receivedMessages:
+      return True
+    stream = self.byteStream
+    keepAliveMagicLen = len( BaseTransport.keepAliveMagic )
+    if stream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0:
+      return True
+    iSeparatorPosition = stream.find( ":", 0, 20 )
+    if iSeparatorPosition == -1:
+      return len( stream ) >= 20
+    if stream[ :3 ] in Compression.gCodecMagics:
+      sizeStart = 3
+    else:
+      sizeStart = 0
+    try:
+      pkgSize = int( stream[ sizeStart:iSeparatorPosition ] )
+    except ValueError:
+      return True
+    if pkgSize > maxBufferSize:
+      return True
+    return len( stream ) - iSeparatorPosition - 1 >= pkgSize
+
+  def _readInto( self, view, bufSize ):
+    """
+    Read up to bufSize bytes into a writable memoryview. Transports that can
+    receive straight into a buffer should overwrite this one
+    """
+    retVal = self._read( min( bufSize, self.packetSize ), skipReadyCheck = True )
+    if not retVal[ 'OK' ]:
+      return retVal
+    data = retVal[ 'Value' ]
+    view[ :len( data ) ] = data
+    return S_OK( len( data ) )
+
   def _write( self, buffer ):
     return S_OK( self.oSocket.send( buffer ) )
 
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
     sCodedData = DEncode.encode( uData )
+    if not prefix and self.__compressionCodec and len( sCodedData ) >= self.__compressionThreshold:
+      magic, compress = Compression.gCompressionCodecs[ self.__compressionCodec ][:2]
+      sCompressedData = compress( sCodedData )
+      if len( sCompressedData ) < len( sCodedData ):
+        self.__compressionStats[ 'rawBytes' ] += len( sCodedData )
+        self.__compressionStats[ 'sentBytes' ] += len( sCompressedData )
+        sCodedData = sCompressedData
+        prefix = magic
     if prefix:
-      dataToSend = "%s%s:%s" % ( prefix, len( sCodedData ), sCodedData )
+      header = "%s%s:" % ( prefix, len( sCodedData ) )
     else:
-      dataToSend = "%s:%s" % ( len( sCodedData ), sCodedData )
+      header = "%s:" % len( sCodedData )
+    #Small messages go in one write. Big ones are sent without copying the payload
+    if len( sCodedData ) < self.packetSize:
+      return self.__sendBuffer( header + sCodedData )
+    result = self.__sendBuffer( header )
+    if not result[ 'OK' ]:
+      return result
+    return self.__sendBuffer( sCodedData )
+
+  def __sendBuffer( self, dataToSend ):
+    dataView = memoryview( dataToSend )
     for index in range( 0, len( dataToSend ), self.packetSize ):
       bytesToSend = min( self.packetSize, len( dataToSend ) - index )
       packSentBytes = 0
       while packSentBytes < bytesToSend:
         try:
-          result = self._write( dataToSend[ index + packSentBytes : index + bytesToSend ] )
+          result = self._write( dataView[ index + packSentBytes : index + bytesToSend ] )
           if not result[ 'OK' ]:
             return result
           sentBytes = result[ 'Value' ]
@@ -138,7 +274,13 @@ class BaseTransport:
     return S_OK()
 
 
-  def receiveData( self, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False ):
+  def receiveData( self, maxBufferSize = 0, blockAfterKeepAlive = True, idleReceive = False,
+                   allowCompression = True ):
+    """
+    Receive the next message, at most maxBufferSize bytes once decompressed if maxBufferSize
+    is set. Compressed messages are rejected if allowCompression is False, as they have to be
+    for the frames exchanged before the compression is negotiated
+    """
     self.__updateLastActionTimestamp()
     if self.receivedMessages:
       return self.receivedMessages.pop( 0 )
@@ -146,7 +288,7 @@ class BaseTransport:
     maxBufferSize = max( maxBufferSize, 0 )
     try:
       #Look either for message length of keep alive magic string
-      iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
+      iSeparatorPosition = self.byteStream.find( ":", 0, 20 )
       keepAliveMagicLen = len( BaseTransport.keepAliveMagic )
       isKeepAlive = self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0
       #While not found the message length or the ka, keep receiving
@@ -161,7 +303,7 @@ class BaseTransport:
         #New data!
         self.byteStream += retVal[ 'Value' ]
         #Look again for either message length of ka magic string
-        iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
+        iSeparatorPosition = self.byteStream.find( ":", 0, 20 )
         isKeepAlive = self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0
         #Over the limit?
         if maxBufferSize and len( self.byteStream ) > maxBufferSize and iSeparatorPosition == -1 :
@@ -171,40 +313,50 @@ class BaseTransport:
         gLogger.debug( "Received keep alive header" )
         #Remove the ka magic from the buffer and process the keep alive
         self.byteStream = self.byteStream[ keepAliveMagicLen: ]
-        return self.__processKeepAlive( maxBufferSize, blockAfterKeepAlive )
+        return self.__processKeepAlive( maxBufferSize, blockAfterKeepAlive, allowCompression )
       #From here it must be a real message!
+      #Is it compressed?
+      compressionCodec = Compression.gCodecMagics.get( self.byteStream[ :3 ], False )
+      if compressionCodec:
+        if not allowCompression:
+          return S_ERROR( "Compressed data is not allowed here" )
+        sizeStart = 3
+      else:
+        sizeStart = 0
       #Process the size and remove the msg length from the bytestream
-      pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
-      pkgData = self.byteStream[ iSeparatorPosition + 1: ]
-      readSize = len( pkgData )
+      pkgSize = int( self.byteStream[ sizeStart:iSeparatorPosition ] )
+      if maxBufferSize and pkgSize > maxBufferSize:
+        return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
+      pkgStart = iSeparatorPosition + 1
+      readSize = len( self.byteStream ) - pkgStart
       if readSize >= pkgSize:
         #If we already have all the data we need
-        data = pkgData[ :pkgSize ]
-        self.byteStream = pkgData[ pkgSize: ]
+        data = self.byteStream[ pkgStart : pkgStart + pkgSize ]
+        self.byteStream = self.byteStream[ pkgStart + pkgSize: ]
       else:
-        #If we still need to read stuff
-        pkgMem = cStringIO.StringIO()
-        pkgMem.write( pkgData )
+        #If we still need to read stuff, receive it straight into a buffer of the final size
+        pkgMem = bytearray( pkgSize )
+        pkgView = memoryview( pkgMem )
+        pkgView[ :readSize ] = buffer( self.byteStream, pkgStart )
+        self.byteStream = ""
         #Receive while there's still data to be received
         while readSize < pkgSize:
-          retVal = self._read( pkgSize - readSize, skipReadyCheck = True )
+          retVal = self._readInto( pkgView[ readSize: ], pkgSize - readSize )
           if not retVal[ 'OK' ]:
             return retVal
           if not retVal[ 'Value' ]:
             return S_ERROR( "Peer closed connection" )
-          rcvData = retVal[ 'Value' ]
-          readSize += len( rcvData )
-          pkgMem.write( rcvData )
-          if maxBufferSize and readSize > maxBufferSize:
-            return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
-        #Data is here! take it out from the bytestream, dencode and return
-        if readSize == pkgSize:
-          data = pkgMem.getvalue()
-          self.byteStream = ""
-        else: #readSize > pkgSize:
-          pkgMem.seek( 0, 0 )
-          data = pkgMem.read( pkgSize )
-          self.byteStream = pkgMem.read()
+          readSize += retVal[ 'Value' ]
+        #Data is here! dencode and return
+        del( pkgView )
+        data = str( pkgMem )
+        del( pkgMem )
+      if compressionCodec:
+        try:
+          data = Compression.gCompressionCodecs[ compressionCodec ][2]( data, maxBufferSize or
+                                                                              Compression.MAX_DECOMPRESSED_SIZE )
+        except Exception, e:
+          return S_ERROR( "Could not decompress received data: %s" % str( e ) )
       try:
         data = DEncode.decode( data )[0]
       except Exception, e:
@@ -217,10 +369,10 @@ class BaseTransport:
       gLogger.exception( "Network error while receiving data" )
       return S_ERROR( "Network error while receiving data: %s" % str( e ) )
 
-  def __processKeepAlive( self, maxBufferSize, blockAfterKeepAlive = True ):
+  def __processKeepAlive( self, maxBufferSize, blockAfterKeepAlive = True, allowCompression = True ):
     gLogger.debug( "Received Keep Alive" )
     #Next message down the stream will be the ka data
-    result = self.receiveData( maxBufferSize, blockAfterKeepAlive = False )
+    result = self.receiveData( maxBufferSize, blockAfterKeepAlive = False, allowCompression = allowCompression )
     if not result[ 'OK' ]:
       gLogger.debug( "Error while receiving keep alive: %s" % result[ 'Message' ] )
       return result
@@ -245,7 +397,7 @@ class BaseTransport:
       result[ 'keepAlive' ] = True
       return result
     #Let's listen for the next message downstream
-    return self.receiveData( maxBufferSize, blockAfterKeepAlive )
+    return self.receiveData( maxBufferSize, blockAfterKeepAlive, allowCompression = allowCompression )
 
   def sendKeepAlive( self, responseId = None, now = False ):
     #If not responseId or not keepAliveLapse or not enough time has passed don't send keep alive
@@ -23,6 +23,7 @@ class SocketInfo:
 
   def __init__( self, infoDict, sslContext = None ):
     self.__retry = 0
+    self.__stepHandshakeStarted = False
     self.infoDict = infoDict
     #HACK:DISABLE CRLS!!!!!
     self.infoDict[ 'IgnoreCRLs' ] = True
@@ -305,6 +306,27 @@ class SocketInfo:
     self.sslSocket.set_accept_state()
     return self.__sslHandshake()
 
+  def doServerHandshakeStep( self ):
+    """
+    Try to advance the server handshake once without waiting for the peer.
+    Returns S_OK( credentialsDict ) when done or S_OK( "wantRead"/"wantWrite" )
+    """
+    if not self.__stepHandshakeStarted:
+      self.sslSocket.set_accept_state()
+      self.__stepHandshakeStarted = True
+    try:
+      self.sslSocket.do_handshake()
+    except GSI.SSL.WantReadError:
+      return S_OK( "wantRead" )
+    except GSI.SSL.WantWriteError:
+      return S_OK( "wantWrite" )
+    except Exception, v:
+      gLogger.warn( "Error while handshaking", v )
+      return S_ERROR( "Error while handshaking" )
+    credentialsDict = self.gatherPeerCredentials()
+    gLogger.debug( "", "Authenticated peer (%s)" % credentialsDict[ 'DN' ] )
+    return S_OK( credentialsDict )
+
   #@gSynchro
   def __sslHandshake( self ):
     start = time.time()
@@ -97,6 +97,19 @@ class SSLTransport( BaseTransport ):
       self.peerCredentials[ key ] = creds[ key ]
     return S_OK()
 
+  def handshakeStep( self ):
+    retVal = self.oSocketInfo.doServerHandshakeStep()
+    if not retVal[ 'OK' ]:
+      return retVal
+    creds = retVal[ 'Value' ]
+    if type( creds ) != types.DictType:
+      return retVal
+    if not self.oSocket.session_reused():
+      gLogger.debug( "New session connecting from client at %s" % str( self.getRemoteAddress() ) )
+    for key in creds.keys():
+      self.peerCredentials[ key ] = creds[ key ]
+    return S_OK( True )
+
   def setClientSocket( self, oSocket ):
     if self.serverMode():
       raise RuntimeError( "Must be initialized as client mode" )
@@ -139,10 +152,44 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def _readNonBlocking( self, bufSize = 16384 ):
+    self.__lock()
+    try:
+      try:
+        data = self.oSocket.recv( bufSize )
+        #Drain what's already decrypted, the socket won't be flagged as readable for it
+        pending = self.oSocket.pending()
+        while pending:
+          data += self.oSocket.recv( pending )
+          pending = self.oSocket.pending()
+        return S_OK( data )
+      except GSI.SSL.WantReadError:
+        return S_OK( None )
+      except GSI.SSL.WantWriteError:
+        return S_OK( None )
+      except GSI.SSL.ZeroReturnError:
+        return S_OK( "" )
+      except Exception, e:
+        return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    finally:
+      self.__unlock()
+
+  def waitForData( self, timeout ):
+    #Data may be already decrypted and waiting in the SSL buffers
+    try:
+      if self.oSocket.pending():
+        return True
+    except Exception:
+      pass
+    return BaseTransport.waitForData( self, timeout )
+
   def isLocked( self ):
     return self.__locked
 
   def _write( self, buffer ):
+    #The SSL layer only takes strings
+    if type( buffer ) != types.StringType:
+      buffer = buffer.tobytes()
     self.__lock()
     try:
       #Renegotiation
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: EventReactorBenchmark.py
+########################################################################
+
+""" :mod: EventReactorBenchmark
+    ===========================
+
+    .. module: EventReactorBenchmark
+    :synopsis: compare thread per connection and event reactor proposal handling
+
+    Starts a local plain transport listener served by a small ThreadPool, either
+    handing every connection to a worker (thread per connection) or receiving the
+    proposals with the EventReactor first. Local clients issue one shot RPC-like
+    exchanges. Some of them wait before sending the proposal, like clients on a slow
+    network do, and in thread per connection mode they keep a worker busy meanwhile.
+
+    Usage: python EventReactorBenchmark.py [clients] [requestsPerClient] [slowClients] [slowDelay] [workers]
+"""
+
+__RCSID__ = "$Id $"
+
+import sys
+import time
+import socket
+import threading
+from DIRAC.Core.Utilities.ReturnValues import S_OK, isReturnStructure
+from DIRAC.Core.Utilities.ThreadPool import ThreadPool
+from DIRAC.Core.DISET.private.Transports.PlainTransport import PlainTransport
+from DIRAC.Core.DISET.private.EventReactor import EventReactor
+
+class EchoService:
+  """ answers proposals like a Service does for a one shot RPC """
+
+  def __init__( self, workers ):
+    self.threadPool = ThreadPool( workers, workers )
+    self.threadPool.daemonize()
+
+  def handleConnection( self, clientTransport ):
+    self.threadPool.generateJobAndQueueIt( self.process, args = ( clientTransport, ) )
+
+  def handleProposal( self, clientTransport, trid = False ):
+    self.threadPool.generateJobAndQueueIt( self.process, args = ( clientTransport, ) )
+
+  def closeConnection( self, trid ):
+    pass
+
+  def process( self, clientTransport ):
+    try:
+      proposal = clientTransport.receiveData( 1024 )
+      if isReturnStructure( proposal ) and not proposal[ 'OK' ]:
+        return
+      clientTransport.sendData( S_OK() )
+      args = clientTransport.receiveData()
+      clientTransport.sendData( S_OK( args ) )
+    finally:
+      clientTransport.close()
+
+class Listener( threading.Thread ):
+
+  def __init__( self, service, eventReactor = False ):
+    threading.Thread.__init__( self )
+    self.setDaemon( 1 )
+    self.service = service
+    self.eventReactor = eventReactor
+    self.transport = PlainTransport( ( "", 0 ), bServerMode = True )
+    self.transport.iListenQueueSize = 128
+    self.transport.initAsServer()
+    self.port = self.transport.getSocket().getsockname()[1]
+
+  def run( self ):
+    while True:
+      result = self.transport.acceptConnection()
+      if not result[ 'OK' ]:
+        continue
+      if self.eventReactor:
+        self.eventReactor.watchConnection( self.service, result[ 'Value' ] )
+      else:
+        self.service.handleConnection( result[ 'Value' ] )
+
+def client( port, requests, delay, latencies, errors ):
+  proposal = ( ( "Test/Echo", "Benchmark", "" ), ( "RPC", "echo" ), "" )
+  for i in range( requests ):
+    start = time.time()
+    transport = PlainTransport( ( "localhost", port ) )
+    try:
+      transport.setClientSocket( socket.create_connection( ( "localhost", port ) ) )
+      if delay:
+        time.sleep( delay )
+      transport.sendData( proposal )
+      result = transport.receiveData()
+      if result[ 'OK' ]:
+        transport.sendData( ( "echo", ( i, ) ) )
+        result = transport.receiveData()
+      if not result[ 'OK' ]:
+        errors.append( result[ 'Message' ] )
+    finally:
+      transport.close()
+    latencies.append( time.time() - start - delay )
+
+def percentile( values, pct ):
+  values = sorted( values )
+  return values[ min( len( values ) - 1, int( len( values ) * pct / 100.0 ) ) ]
+
+def runBenchmark( mode, clients, requests, slowClients, slowDelay, workers ):
+  service = EchoService( workers )
+  eventReactor = False
+  if mode == "event":
+    eventReactor = EventReactor()
+    eventReactor.start()
+  listener = Listener( service, eventReactor )
+  listener.start()
+  errors = []
+  latencies = []
+  clientThreads = []
+  for i in range( clients ):
+    if i < slowClients:
+      clientArgs = ( listener.port, requests, slowDelay, [], errors )
+    else:
+      clientArgs = ( listener.port, requests, 0, latencies, errors )
+    clientThreads.append( threading.Thread( target = client, args = clientArgs ) )
+  start = time.time()
+  for thread in clientThreads:
+    thread.start()
+  for thread in clientThreads[ slowClients: ]:
+    thread.join()
+  elapsed = time.time() - start
+  for thread in clientThreads[ :slowClients ]:
+    thread.join()
+  total = len( latencies )
+  print "%-7s %6d fast requests in %6.2f s: %8.1f req/s, latency p50 %6.1f ms p99 %7.1f ms, errors %d" % \
+        ( mode, total, elapsed, total / elapsed, percentile( latencies, 50 ) * 1000,
+          percentile( latencies, 99 ) * 1000, len( errors ) )
+  if eventReactor:
+    eventReactor.stop()
+
+if __name__ == "__main__":
+  clients = 64
+  requests = 50
+  slowClients = 8
+  slowDelay = 0.5
+  workers = 8
+  if len( sys.argv ) > 1:
+    clients = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    requests = int( sys.argv[2] )
+  if len( sys.argv ) > 3:
+    slowClients = int( sys.argv[3] )
+  if len( sys.argv ) > 4:
+    slowDelay = float( sys.argv[4] )
+  if len( sys.argv ) > 5:
+    workers = int( sys.argv[5] )
+  print "%s clients (%s slow waiting %s s before the proposal) x %s requests, %s workers" % ( clients, slowClients,
+                                                                                          slowDelay, requests,
+                                                                                          workers )
+  for mode in ( "thread", "event" ):
+    runBenchmark( mode, clients, requests, slowClients, slowDelay, workers )
@@ -0,0 +1,80 @@
+########################################################################
+# $HeadURL $
+# File: LockManagerTests.py
+########################################################################
+
+""" :mod: LockManagerTests
+    ======================
+
+    .. module: LockManagerTests
+    :synopsis: test cases for the DISET LockManager
+
+    test cases for LockManager: limits are enforced, waiting threads get
+    the free slots in arrival order and waits end up in the histograms
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import time
+import threading
+import unittest
+## SUT
+from DIRAC.Core.DISET.private.LockManager import LockManager, FairSemaphore
+
+########################################################################
+class LockManagerTestCase( unittest.TestCase ):
+  """
+  .. class:: LockManagerTestCase
+
+  """
+
+  def testNoLimit( self ):
+    """ actions without limit don't get a lock """
+    lockManager = LockManager()
+    lockManager.createLock( "RPC/free", 0 )
+    lockManager.createLock( "RPC/limited", 2 )
+    self.assertEqual( lockManager.dLocks.keys(), [ "RPC/limited" ] )
+    self.assertRaises( RuntimeError, lockManager.createLock, "RPC/limited", 2 )
+    for i in range( 10 ):
+      lockManager.lock( "RPC/free" )
+    lockManager.unlock( "RPC/free" )
+    self.assertEqual( lockManager.getWaitStats().keys(), [ "RPC/limited" ] )
+
+  def testLimitAndFairness( self ):
+    """ no more than the limit at once, waiters served in order """
+    semaphore = FairSemaphore( 2 )
+    semaphore.acquire()
+    semaphore.acquire()
+    served = []
+    threads = []
+    for i in range( 4 ):
+      thread = threading.Thread( target = lambda i = i : ( semaphore.acquire(), served.append( i ) ) )
+      thread.setDaemon( 1 )
+      thread.start()
+      threads.append( thread )
+      #Let the thread get in the queue before the next one
+      while semaphore.getStats()[ 'waiting' ] < i + 1:
+        time.sleep( 0.001 )
+    self.assertEqual( served, [] )
+    for i in range( 4 ):
+      semaphore.release()
+      threads[ i ].join( 5 )
+      self.assertEqual( served, range( i + 1 ) )
+    stats = semaphore.getStats()
+    self.assertEqual( stats[ 'active' ], 2 )
+    self.assertEqual( stats[ 'waiting' ], 0 )
+    self.assertEqual( stats[ 'acquired' ], 6 )
+    self.assertEqual( sum( stats[ 'histogram' ] ), 6 )
+    self.assertEqual( len( stats[ 'histogram' ] ), len( stats[ 'buckets' ] ) + 1 )
+    self.assertEqual( stats[ 'histogram' ][0] >= 2, True )
+    semaphore.release()
+    semaphore.release()
+    semaphore.release()
+    self.assertEqual( semaphore.getStats()[ 'active' ], 0 )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( LockManagerTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -11,6 +11,9 @@ Encoding and decoding for dirac, Ids:
  l -> list
  t -> tuple
  d -> dictionary
+
+encode/decode are the fast implementations, encodeWithTables/decodeWithTables
+the reference ones.
 """
 __RCSID__ = "$Id$"
 
@@ -221,24 +224,172 @@ g_dEncodeFunctions[ types.DictType ] = encodeDict
 g_dDecodeFunctions[ "d" ] = decodeDict
 
 
+#Table driven encode and decode. Kept as the reference implementation of the format
+def encodeWithTables( uObject ):
+  eList = []
+  g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  return "".join( eList )
+
+def decodeWithTables( data ):
+  if not data:
+    return data
+  return g_dDecodeFunctions[ data[ 0 ] ]( data, 0 )
+
+#
+# Fast encoding and decoding. Same wire format as the functions above, but
+# strings and ints (the vast majority of tokens) are handled inline inside the
+# containers instead of with a function call per token
+#
+
+_StringType = types.StringType
+_IntType = types.IntType
+
+def _encodeUnknown( uObject, eList ):
+  raise KeyError( type( uObject ) )
+
+def _encodeDateTime( oValue, eList ):
+  if type( oValue ) == _dateTimeType and oValue.tzinfo is None:
+    eList.extend( ( "zati", str( oValue.year ), "ei", str( oValue.month ), "ei", str( oValue.day ),
+                    "ei", str( oValue.hour ), "ei", str( oValue.minute ), "ei", str( oValue.second ),
+                    "ei", str( oValue.microsecond ), "ene" ) )
+  else:
+    encodeDateTime( oValue, eList )
+
+def _encodeSequence( lValue, eList ):
+  extend = eList.extend
+  for value in lValue:
+    vType = type( value )
+    if vType is _StringType:
+      extend( ( "s", str( len( value ) ), ":", value ) )
+    elif vType is _IntType:
+      extend( ( "i", str( value ), "e" ) )
+    else:
+      _fastEncoders.get( vType, _encodeUnknown )( value, eList )
+
+def _encodeList( lValue, eList ):
+  eList.append( "l" )
+  _encodeSequence( lValue, eList )
+  eList.append( "e" )
+
+def _encodeTuple( tValue, eList ):
+  eList.append( "t" )
+  _encodeSequence( tValue, eList )
+  eList.append( "e" )
+
+def _encodeDict( dValue, eList ):
+  extend = eList.extend
+  eList.append( "d" )
+  for key in sorted( dValue ):
+    if type( key ) is _StringType:
+      extend( ( "s", str( len( key ) ), ":", key ) )
+    else:
+      _fastEncoders.get( type( key ), _encodeUnknown )( key, eList )
+    value = dValue[ key ]
+    vType = type( value )
+    if vType is _StringType:
+      extend( ( "s", str( len( value ) ), ":", value ) )
+    elif vType is _IntType:
+      extend( ( "i", str( value ), "e" ) )
+    else:
+      _fastEncoders.get( vType, _encodeUnknown )( value, eList )
+  eList.append( "e" )
+
+_fastEncoders = dict( g_dEncodeFunctions )
+_fastEncoders[ types.DictType ] = _encodeDict
+_fastEncoders[ types.ListType ] = _encodeList
+_fastEncoders[ types.TupleType ] = _encodeTuple
+_fastEncoders[ _dateTimeType ] = _encodeDateTime
+
+def _decodeList( data, i ):
+  oL = []
+  append = oL.append
+  index = data.index
+  i += 1
+  while True:
+    token = data[ i ]
+    if token == "s":
+      colon = index( ":", i + 1 )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      append( data[ colon + 1 : end ] )
+      i = end
+    elif token == "i":
+      end = index( "e", i + 1 )
+      append( int( data[ i + 1 : end ] ) )
+      i = end + 1
+    elif token == "e":
+      return ( oL, i + 1 )
+    else:
+      value, i = _fastDecoders[ token ]( data, i )
+      append( value )
+
+def _decodeTuple( data, i ):
+  oL, i = _decodeList( data, i )
+  return ( tuple( oL ), i )
+
+def _decodeDict( data, i ):
+  oD = {}
+  index = data.index
+  i += 1
+  while True:
+    token = data[ i ]
+    if token == "s":
+      colon = index( ":", i + 1 )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      key = data[ colon + 1 : end ]
+      i = end
+    elif token == "e":
+      return ( oD, i + 1 )
+    else:
+      key, i = _fastDecoders[ token ]( data, i )
+    token = data[ i ]
+    if token == "s":
+      colon = index( ":", i + 1 )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      oD[ key ] = data[ colon + 1 : end ]
+      i = end
+    elif token == "i":
+      end = index( "e", i + 1 )
+      oD[ key ] = int( data[ i + 1 : end ] )
+      i = end + 1
+    else:
+      oD[ key ], i = _fastDecoders[ token ]( data, i )
+
+def _decodeDateTime( data, i ):
+  dataType = data[ i + 1 ]
+  if dataType == 'a' and data[ i + 2 : i + 4 ] == "ti":
+    #Naive datetimes: all fields are ints and the tuple ends with a None
+    end = data.index( "ene", i + 4 )
+    fields = [ int( field ) for field in data[ i + 4 : end ].split( "ei" ) ]
+    return ( datetime.datetime( *fields ), end + 3 )
+  tupleObject, i = _decodeList( data, i + 2 )
+  if dataType == 'a':
+    return ( datetime.datetime( *tupleObject ), i )
+  elif dataType == 'd':
+    return ( datetime.date( *tupleObject ), i )
+  elif dataType == 't':
+    return ( datetime.time( *tupleObject ), i )
+  raise ValueError( "Unexpected type %s while decoding a datetime object" % dataType )
+
+_fastDecoders = dict( g_dDecodeFunctions )
+_fastDecoders[ "l" ] = _decodeList
+_fastDecoders[ "t" ] = _decodeTuple
+_fastDecoders[ "d" ] = _decodeDict
+_fastDecoders[ "z" ] = _decodeDateTime
+
 #Encode function
 def encode( uObject ):
-  try:
-    eList = []
-    #print "ENCODE FUNCTION : %s" % g_dEncodeFunctions[ type( uObject ) ]
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
-    return "".join( eList )
-  except Exception:
-    raise
+  eList = []
+  oType = type( uObject )
+  _fastEncoders.get( oType, _encodeUnknown )( uObject, eList )
+  return "".join( eList )
 
 def decode( data ):
   if not data:
     return data
   try:
-    #print "DECODE FUNCTION : %s" % g_dDecodeFunctions[ sStream [ iIndex ] ]
-    return g_dDecodeFunctions[ data[ 0 ] ]( data, 0 )
-  except Exception:
-    raise
+    return _fastDecoders[ data[ 0 ] ]( data, 0 )
+  except ( IndexError, KeyError ), e:
+    raise ValueError( "Corrupted data: %s" % repr( e ) )
 
 
 if __name__ == "__main__":
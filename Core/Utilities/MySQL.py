@@ -37,6 +37,16 @@
     If a connection to the the DB is passed as second argument this connection
     is used and is not  in the Queue.
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
+    With params, "cmd" is a statement template whose %s placeholders are replaced
+    by the values of the params list, escaped by the driver ( see StatementTemplate ).
+
+
+    _queryIter( cmd, [chunkSize] )
+
+    Generator executing SQL command "cmd" with an unbuffered (server side) cursor.
+    Yields S_OK with lists of at most chunkSize rows as they are fetched, or S_ERROR
+    upon failure after which it stops. The query uses its own connection, so the
+    thread can execute other commands while iterating.
 
 
     _update( cmd, [conn] )
@@ -48,6 +58,13 @@
     is used and is not  in the Queue
     Returns S_OK with number of updated registers in Value or S_ERROR upon failure.
 
+    The statements executed by _query, _queryIter and _update are accounted in the
+    QueryProfiler of the process, unless queryProfiling is set to False.
+
+    The queries of the methods decorated with readOnlySafe go to the read replicas set
+    with _setReadReplicas, unless in a transaction or after an update. Replicas lagging
+    more than maxLag seconds or losing the connection are skipped, the primary serves the query if none is left.
+
 
     _createTables( tableDict )
 
@@ -153,6 +170,7 @@ from DIRAC                                  import gLogger
 from DIRAC                                  import S_OK, S_ERROR
 from DIRAC.Core.Utilities.DataStructures    import MutableStruct
 from DIRAC.Core.Utilities                   import Time
+from DIRAC.Core.Utilities.QueryProfiler     import gQueryProfiler, getFingerprint
 
 # Get rid of the annoying Deprecation warning of the current MySQLdb
 # FIXME: compile a newer MySQLdb version
@@ -167,18 +185,24 @@ import warnings
 with warnings.catch_warnings():
   warnings.simplefilter( 'ignore', DeprecationWarning )
   import MySQLdb
+  import MySQLdb.cursors
   
 # This is for proper initialization of embedded server, it should only be called once
 MySQLdb.server_init( ['--defaults-file=/opt/dirac/etc/my.cnf', '--datadir=/opt/mysql/db'], ['mysqld'] )
 gInstancesCount = 0
-gDebugFile = None
 
+import re
+import sys
+import random
+import functools
 import collections
 import time
 import threading
 from types import StringTypes, DictType, ListType, TupleType, BooleanType
 
 MAXCONNECTRETRY = 10
+# Default number of statement templates kept by each MySQL instance
+STATEMENTCACHESIZE = 1000
 
 def _checkFields( inFields, inValues ):
   """
@@ -215,6 +239,162 @@ def _quotedList( fieldList = None ):
 
   return ', '.join( quotedFields )
 
+class StatementTemplate( object ):
+  """
+    SQL statement with %s placeholders for its parameters ( %% for a literal % ), split once
+    into the fragments around them. Binding escapes all the parameters in one call to the driver:
+    None becomes NULL, numbers are not quoted, strings and dates are quoted. List and tuple
+    parameters become comma separated lists of values, for IN (%s), NULL if they are empty.
+    The parameters are always values: SQL expressions like UTC_TIMESTAMP() go in the template
+  """
+  __placeholderRE = re.compile( '%[s%]' )
+
+  def __init__( self, cmd ):
+    self.fragments = []
+    current = []
+    pos = 0
+    for match in self.__placeholderRE.finditer( cmd ):
+      current.append( cmd[pos:match.start()] )
+      if match.group() == '%%':
+        current.append( '%' )
+      else:
+        self.fragments.append( ''.join( current ) )
+        current = []
+      pos = match.end()
+    current.append( cmd[pos:] )
+    self.fragments.append( ''.join( current ) )
+    self.numParams = len( self.fragments ) - 1
+    self.__cmd = cmd
+    self.__fingerprint = None
+
+  def getFingerprint( self ):
+    """ Get the fingerprint of the statement for the QueryProfiler, computed once
+    """
+    if self.__fingerprint is None:
+      self.__fingerprint = getFingerprint( self.__cmd )
+    return self.__fingerprint
+
+  def bind( self, connection, params ):
+    """ Get the statement with the given parameters, escaped with the connection
+    """
+    if len( params ) != self.numParams:
+      raise ValueError( 'The statement needs %d parameters, %d given' % ( self.numParams, len( params ) ) )
+    values = []
+    sizes = []
+    for param in params:
+      if type( param ) in ( ListType, TupleType ):
+        values.extend( param )
+        sizes.append( len( param ) )
+      else:
+        values.append( param )
+        sizes.append( -1 )
+    literals = connection.literal( tuple( values ) )
+    statement = [ self.fragments[0] ]
+    pos = 0
+    for i in range( self.numParams ):
+      size = sizes[i]
+      if size < 0:
+        statement.append( literals[pos] )
+        pos += 1
+      elif size == 0:
+        statement.append( 'NULL' )
+      else:
+        statement.append( ','.join( literals[pos:pos + size] ) )
+        pos += size
+      statement.append( self.fragments[i + 1] )
+    return ''.join( statement )
+
+# Per thread state of the methods marked with readOnlySafe
+gReadOnlyContext = threading.local()
+# Client errors of a lost or refused connection: CR_CONNECTION_ERROR, CR_CONN_HOST_ERROR,
+# CR_SERVER_GONE_ERROR, CR_SERVER_LOST and CR_SERVER_LOST_EXTENDED
+CONNECTION_ERRORS = ( 2002, 2003, 2006, 2013, 2055 )
+
+def readOnlySafe( method ):
+  """
+    Decorator marking a method of a MySQL derived class as read only safe: the queries it
+    executes outside transactions may go to the read replicas, and so see data some seconds old.
+    Once the thread has executed an update, the following queries of the call go to the primary
+  """
+  @functools.wraps( method )
+  def readOnlySafeMethod( *args, **kwargs ):
+    depth = getattr( gReadOnlyContext, 'depth', 0 )
+    gReadOnlyContext.depth = depth + 1
+    try:
+      return method( *args, **kwargs )
+    finally:
+      gReadOnlyContext.depth = depth
+      if not depth:
+        gReadOnlyContext.updated = False
+  return readOnlySafeMethod
+
+class ReadReplica( object ):
+  """
+    Read replica of a database, used while its replication lag is below maxLag seconds.
+    The lag is checked every checkPeriod seconds with SHOW SLAVE STATUS, a server which
+    is not a replica has no lag. A replica failing the check or a query is not used
+    until the next check
+  """
+
+  def __init__( self, connectionPool, host, port, maxLag = 30, checkPeriod = 60 ):
+    self.connectionPool = connectionPool
+    self.name = '%s:%s' % ( host, port )
+    self.maxLag = maxLag
+    self.checkPeriod = checkPeriod
+    self.lag = None
+    self.__available = False
+    self.__checked = False
+    self.__lastCheck = 0
+    self.__checkLock = threading.Lock()
+
+  def isAvailable( self, dbName ):
+    """ Whether the replica can serve the queries, checking its lag if it is time to.
+        Only one thread checks, the others get the state of the last check meanwhile
+    """
+    if time.time() - self.__lastCheck > self.checkPeriod and self.__checkLock.acquire( False ):
+      try:
+        self.__checkLag( dbName )
+      finally:
+        self.__checkLock.release()
+    return self.__available
+
+  def setUnavailable( self, reason ):
+    """ Do not use the replica until the next check
+    """
+    if self.__available or not self.__checked:
+      gLogger.warn( 'Read replica %s is not used' % self.name, reason )
+    self.__available = False
+    self.__checked = True
+    self.__lastCheck = time.time()
+
+  def __checkLag( self, dbName ):
+    self.__lastCheck = time.time()
+    result = self.connectionPool.get( dbName, retries = 0 )
+    if not result['OK']:
+      self.setUnavailable( result['Message'] )
+      return
+    try:
+      cursor = result['Value'].cursor()
+      cursor.execute( 'SHOW SLAVE STATUS' )
+      row = cursor.fetchone()
+      lag = 0
+      if row:
+        lag = dict( zip( [ field[0] for field in cursor.description ], row ) ).get( 'Seconds_Behind_Master' )
+      cursor.close()
+    except Exception, x:
+      self.setUnavailable( 'Cannot get the replication status: %s' % str( x ) )
+      return
+    self.lag = lag
+    if lag is None:
+      self.setUnavailable( 'The replication is stopped' )
+    elif lag > self.maxLag:
+      self.setUnavailable( 'Replication lag of %s seconds' % lag )
+    else:
+      if not self.__available:
+        gLogger.info( 'Read replica %s is used' % self.name, 'replication lag of %s seconds' % lag )
+      self.__available = True
+      self.__checked = True
+
 
 class MySQL:
   """
@@ -228,12 +408,14 @@ class MySQL:
     """
     __connData = MutableStruct( 'ConnData', [ 'conn', 'dbName', 'last', 'intrans' ] )
 
-    def __init__( self, host, user, passwd, port = 3306, graceTime = 600 ):
+    def __init__( self, host, user, passwd, port = 3306, graceTime = 600, retryDelay = 5, connectTimeout = 0 ):
       self.__host = host
       self.__user = user
       self.__passwd = passwd
       self.__port = port
       self.__graceTime = graceTime
+      self.__retryDelay = retryDelay
+      self.__connectTimeout = connectTimeout
       self.__spares = collections.deque()
       self.__maxSpares = 10
       self.__lastClean = 0
@@ -244,10 +426,14 @@ class MySQL:
       return threading.current_thread()
 
     def __newConn( self ):
+      connArgs = {}
+      if self.__connectTimeout:
+        connArgs['connect_timeout'] = self.__connectTimeout
       conn = MySQLdb.connect( host = self.__host,
                               port = self.__port,
                               user = self.__user,
-                              passwd = self.__passwd )
+                              passwd = self.__passwd,
+                              **connArgs )
 
       self.__execute( conn, "SET AUTOCOMMIT=1" )
       return conn
@@ -267,7 +453,7 @@ class MySQL:
       return S_OK( result[ 'Value' ].conn )
 
     def __getWithRetry( self, dbName, totalRetries = 10, retriesLeft = 10 ):
-      sleepTime = 5 * ( totalRetries - retriesLeft )
+      sleepTime = self.__retryDelay * ( totalRetries - retriesLeft )
       if sleepTime > 0:
         time.sleep( sleepTime )
       try:
@@ -335,6 +521,55 @@ class MySQL:
       else:
         connData.conn.close()
 
+    def getCached( self, dbName ):
+      """ Get the connection of the thread without checking that it is alive, for the
+          client side operations like escaping. Falls back to get if it has none yet
+      """
+      connData = self.__assigned.get( self.__thid )
+      if connData is not None and connData.dbName == dbName:
+        return S_OK( connData.conn )
+      return self.get( dbName )
+
+    def getDedicated( self, dbName ):
+      """ Get a connection that is not assigned to the thread, for the statements that keep
+          it busy while the thread goes on using its own one. Give it back with releaseDedicated
+      """
+      try:
+        connData = self.__spares.pop()
+        if not self.__ping( connData.conn ):
+          raise IndexError()
+      except IndexError:
+        try:
+          connData = self.__connData( self.__newConn(), "", time.time(), False )
+        except MySQLdb.MySQLError, excp:
+          return S_ERROR( "Could not connect: %s" % excp )
+      if connData.dbName != dbName:
+        try:
+          connData.conn.select_db( dbName )
+          connData.dbName = dbName
+        except MySQLdb.MySQLError, excp:
+          self.releaseDedicated( connData, False )
+          return S_ERROR( "Could not select db %s: %s" % ( dbName, excp ) )
+      return S_OK( connData )
+
+    def releaseDedicated( self, connData, reuse = True ):
+      """ Give back a connection from getDedicated, it is closed if it can't be reused
+      """
+      connData.last = time.time()
+      if reuse and len( self.__spares ) < self.__maxSpares:
+        self.__spares.append( connData )
+      else:
+        try:
+          connData.conn.close()
+        except Exception:
+          pass
+
+    def inTransaction( self ):
+      """ Whether the connection of the thread is in a transaction
+      """
+      connData = self.__assigned.get( self.__thid )
+      return connData is not None and connData.intrans
+
     def clean( self, now = False ):
       if not now:
         now = time.time()
@@ -351,7 +586,6 @@ class MySQL:
           self.__pop( thid )
 
     def transactionStart( self, dbName ):
-      print "TRANS START"
       result = self.__getWithRetry( dbName )
       if not result[ 'OK' ]:
         return result
@@ -367,11 +601,9 @@ class MySQL:
         return S_ERROR( "Could not begin transaction: %s" % excp )
 
     def transactionCommit( self, dbName ):
-      print "TRANS COMMIT"
       return self.__endTransaction( dbName, True )
 
     def transactionRollback( self, dbName ):
-      print "TRANS ROLLBACK"
       return self.__endTransaction( dbName, False )
 
     def __endTransaction( self, dbName, commit ):
@@ -399,7 +631,7 @@ class MySQL:
     """
     set MySQL connection parameters and try to connect
     """
-    global gInstancesCount, gDebugFile
+    global gInstancesCount
     gInstancesCount += 1
 
     self._connected = False
@@ -422,17 +654,17 @@ class MySQL:
       MySQL.__connectionPools[ cKey ] = MySQL.ConnectionPool( *cKey )
     self.__connectionPool = MySQL.__connectionPools[ cKey ]
 
+    self.statementCacheSize = STATEMENTCACHESIZE
+    self.__statements = {}
+    # Account the statements in the QueryProfiler, the debug flag is kept for backward compatibility
+    self.queryProfiling = True
+    self.__readReplicas = []
+
     self.__initialized = True
     result = self._connect()
     if not result[ 'OK' ]:
       gLogger.error( "Cannot connect to to DB", " %s" % result[ 'Message' ] )
 
-    if debug:
-      try:
-        gDebugFile = open( "%s.debug.log" % self.__dbName, "w" )
-      except IOError:
-        pass
-
 
   def __del__( self ):
     global gInstancesCount
@@ -472,17 +704,18 @@ class MySQL:
       return False
 
 
-  def __escapeString( self, myString ):
+  def __escapeString( self, myString, connection = None ):
     """
     To be used for escaping any MySQL string before passing it to the DB
     this should prevent passing non-MySQL accepted characters to the DB
     It also includes quotation marks " around the given string
     """
 
-    retDict = self.__getConnection()
-    if not retDict['OK']:
-      return retDict
-    connection = retDict['Value']
+    if not connection:
+      retDict = self.__getEscapeConnection()
+      if not retDict['OK']:
+        return retDict
+      connection = retDict['Value']
 
     try:
       myString = str( myString )
@@ -557,16 +790,22 @@ class MySQL:
     if not inValues:
       return S_OK( inEscapeValues )
 
+    # All the values are escaped with the same connection
+    retDict = self.__getEscapeConnection()
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+
     for value in inValues:
       if type( value ) in StringTypes:
-        retDict = self.__escapeString( value )
+        retDict = self.__escapeString( value, connection )
         if not retDict['OK']:
           return retDict
         inEscapeValues.append( retDict['Value'] )
       elif type( value ) == TupleType or type( value ) == ListType:
         tupleValues = []
         for v in list( value ):
-          retDict = self.__escapeString( v )
+          retDict = self.__escapeString( v, connection )
           if not retDict['OK']:
             return retDict
           tupleValues.append( retDict['Value'] )
@@ -574,12 +813,68 @@ class MySQL:
       elif type( value ) == BooleanType:
         inEscapeValues = [str( value )]
       else:
-        retDict = self.__escapeString( str( value ) )
+        retDict = self.__escapeString( str( value ), connection )
         if not retDict['OK']:
           return retDict
         inEscapeValues.append( retDict['Value'] )
     return S_OK( inEscapeValues )
 
+  def _bindParams( self, cmd, params, conn = None ):
+    """
+    Get the statement of the template cmd with the given parameters ( see StatementTemplate ).
+    The templates are parsed once and kept in a cache of statementCacheSize entries
+    """
+    connection = conn
+    if not connection:
+      retDict = self.__getEscapeConnection()
+      if not retDict['OK']:
+        return retDict
+      connection = retDict['Value']
+    try:
+      return S_OK( self.__getStatement( cmd ).bind( connection, params ) )
+    except Exception, x:
+      return self._except( '_bindParams', x, 'Cannot bind the statement parameters' )
+
+  def __getStatement( self, cmd ):
+    """ Get the parsed template of a statement
+    """
+    try:
+      return self.__statements[ cmd ]
+    except KeyError:
+      pass
+    if len( self.__statements ) >= self.statementCacheSize:
+      self.__statements.clear()
+    template = StatementTemplate( cmd )
+    self.__statements[ cmd ] = template
+    return template
+
+  def __profile( self, cmd, params, start, rows ):
+    """
+    Account the execution of a statement, or of a template if params are given, in the QueryProfiler
+    """
+    elapsed = time.time() - start
+    try:
+      if params is not None:
+        fingerprint = self.__getStatement( cmd ).getFingerprint()
+      else:
+        fingerprint = getFingerprint( cmd )
+      gQueryProfiler.add( self.__dbName, fingerprint, self.__getCaller(), elapsed, rows )
+    except Exception, x:
+      self.log.warn( 'Failed to profile the statement', str( x ) )
+
+  def __getCaller( self ):
+    """
+    Get the module and function that issued the statement: the first one out of this module
+    and of the DB base class
+    """
+    frame = sys._getframe( 2 )
+    while frame:
+      module = frame.f_globals.get( '__name__', '' )
+      if module not in ( __name__, 'DIRAC.Core.Base.DB' ):
+        return '%s.%s' % ( module.split( '.' )[-1], frame.f_code.co_name )
+      frame = frame.f_back
+    return ''
+
 
   def _connect( self ):
     """
@@ -606,10 +901,38 @@ class MySQL:
     except Exception, x:
       return self._except( '_connect', x, 'Could not connect to DB.' )
 
+  def _setReadReplicas( self, replicas, maxLag = 30, checkPeriod = 60 ):
+    """
+    Set the read replicas of the DB as a list of ( host, port ): the queries of the methods
+    marked with readOnlySafe go to one of them outside transactions, while its lag is below maxLag
+    seconds ( checked every checkPeriod seconds ), or to the primary if no replica can be used
+    """
+    self.__readReplicas = []
+    for host, port in replicas:
+      # No retries nor long connection timeout, the primary is there to fall back to
+      connectionPool = MySQL.ConnectionPool( str( host ), self.__userName, self.__passwd, int( port ),
+                                             retryDelay = 0, connectTimeout = 5 )
+      self.__readReplicas.append( ReadReplica( connectionPool, host, port, maxLag, checkPeriod ) )
+    return S_OK()
+
+  def __getReadReplica( self ):
+    """
+    Get the replica for a query, None if it must go to the primary: not in a readOnlySafe method,
+    after an update in it, in a transaction or with no available replica
+    """
+    if not self.__readReplicas or not getattr( gReadOnlyContext, 'depth', 0 ):
+      return None
+    if getattr( gReadOnlyContext, 'updated', False ) or self.__connectionPool.inTransaction():
+      return None
+    replicas = [ replica for replica in self.__readReplicas if replica.isAvailable( self.__dbName ) ]
+    if not replicas:
+      return None
+    return random.choice( replicas )
 
-  def _query( self, cmd, conn = None, debug = False ):
+
+  def _query( self, cmd, conn = None, debug = False, params = None ):
     """
-    execute MySQL query command
+    execute MySQL query command, a template if params are given
     return S_OK structure with fetchall result as tuple
     it returns an empty tuple if no matching rows are found
     return S_ERROR upon error
@@ -622,14 +945,27 @@ class MySQL:
       else:
         self.logger.verbose( '_query:', cmd[:min( len( cmd ) , 512 )] )
 
-    if gDebugFile:
-      start = time.time()
-
-    retDict = self.__getConnection()
+    replica = self.__getReadReplica()
+    if replica:
+      retDict = replica.connectionPool.get( self.__dbName, retries = 0 )
+      if not retDict['OK']:
+        replica.setUnavailable( retDict['Message'] )
+        replica = None
+    if not replica:
+      retDict = self.__getConnection()
     if not retDict['OK']:
       return retDict
     connection = retDict[ 'Value' ]
 
+    template = cmd
+    if params is not None:
+      retDict = self._bindParams( cmd, params, connection )
+      if not retDict['OK']:
+        return retDict
+      cmd = retDict['Value']
+
+    start = time.time()
+    res = ()
     try:
       cursor = connection.cursor()
       if cursor.execute( cmd ):
@@ -652,6 +988,14 @@ class MySQL:
           self.logger.verbose( '_query: %s ...' % str( res[:10] ) )
 
       retDict = S_OK( res )
+    except MySQLdb.OperationalError, x:
+      if replica and x.args and x.args[0] in CONNECTION_ERRORS:
+        # The replica is gone, the query is repeated on the primary
+        replica.setUnavailable( str( x ) )
+        retDict = None
+      else:
+        self.log.warn( '_query:', cmd )
+        retDict = self._except( '_query', x, 'Execution failed.' )
     except Exception , x:
       self.log.warn( '_query:', cmd )
       retDict = self._except( '_query', x, 'Execution failed.' )
@@ -661,15 +1005,96 @@ class MySQL:
     except Exception:
       pass
 
-    if gDebugFile:
-      print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
-      gDebugFile.flush()
+    if retDict is None:
+      return self._query( template, debug = debug, params = params )
+
+    if self.queryProfiling:
+      self.__profile( template, params, start, len( res ) )
 
     return retDict
 
+  def _queryIter( self, cmd, chunkSize = 1000, params = None ):
+    """
+    Generator executing a MySQL query with an unbuffered (server side) cursor:
+    yields S_OK structures with tuples of at most chunkSize rows as they are fetched,
+    so the whole result is never in memory, or one S_ERROR after which it stops.
+
+    The query runs on a connection pinned to the generator until it is exhausted,
+    the thread can execute other commands meanwhile. Stopping the iteration early
+    closes that connection rather than reading the remaining rows. Inside a transaction
+    the rows are read from the transaction connection, as _query does, to see its snapshot.
+    The rows are sent by the server as they are read, keep the processing between chunks short
+    """
+    self.logger.verbose( '_queryIter:', cmd[:min( len( cmd ) , 512 )] )
+
+    if self.__connectionPool.inTransaction():
+      retDict = self._query( cmd, params = params )
+      if not retDict['OK']:
+        yield retDict
+        return
+      rows = retDict['Value']
+      for i in xrange( 0, len( rows ), chunkSize ):
+        yield S_OK( rows[i:i + chunkSize] )
+      return
+
+    if not self.__initialized:
+      error = 'DB not properly initialized'
+      gLogger.error( error )
+      yield S_ERROR( error )
+      return
+    connectionPool = self.__connectionPool
+    replica = self.__getReadReplica()
+    if replica:
+      retDict = replica.connectionPool.getDedicated( self.__dbName )
+      if retDict['OK']:
+        connectionPool = replica.connectionPool
+      else:
+        replica.setUnavailable( retDict['Message'] )
+        retDict = connectionPool.getDedicated( self.__dbName )
+    else:
+      retDict = connectionPool.getDedicated( self.__dbName )
+    if not retDict['OK']:
+      yield retDict
+      return
+    connData = retDict['Value']
+
+    template = cmd
+    if params is not None:
+      retDict = self._bindParams( cmd, params, connData.conn )
+      if not retDict['OK']:
+        connectionPool.releaseDedicated( connData )
+        yield retDict
+        return
+      cmd = retDict['Value']
 
-  def _update( self, cmd, conn = None, debug = False ):
-    """ execute MySQL update command
+    start = time.time()
+    exhausted = False
+    total = 0
+    try:
+      try:
+        cursor = connData.conn.cursor( MySQLdb.cursors.SSCursor )
+        cursor.execute( cmd )
+        while True:
+          rows = cursor.fetchmany( chunkSize )
+          if not rows:
+            break
+          total += len( rows )
+          yield S_OK( rows )
+        cursor.close()
+        exhausted = True
+      except Exception, x:
+        self.log.warn( '_queryIter:', cmd )
+        yield self._except( '_queryIter', x, 'Execution failed.' )
+    finally:
+      connectionPool.releaseDedicated( connData, reuse = exhausted )
+      self.logger.verbose( '_queryIter: Total %d records returned' % total )
+      # The time includes the processing of the chunks by the caller
+      if self.queryProfiling:
+        self.__profile( template, params, start, total )
+
+
+  def _update( self, cmd, conn = None, debug = False, params = None ):
+    """ execute MySQL update command, a template if params are given
         return S_OK with number of updated registers upon success
         return S_ERROR upon error
     """
@@ -681,14 +1106,24 @@ class MySQL:
       else:
         self.logger.verbose( '_update:', cmd[:min( len( cmd ) , 512 )] )
 
-    if gDebugFile:
-      start = time.time()
+    # The next queries of a readOnlySafe method must see this update
+    if getattr( gReadOnlyContext, 'depth', 0 ):
+      gReadOnlyContext.updated = True
 
     retDict = self.__getConnection( conn = conn )
     if not retDict['OK']:
       return retDict
     connection = retDict['Value']
 
+    template = cmd
+    if params is not None:
+      retDict = self._bindParams( cmd, params, connection )
+      if not retDict['OK']:
+        return retDict
+      cmd = retDict['Value']
+
+    start = time.time()
+    res = 0
     try:
       cursor = connection.cursor()
       res = cursor.execute( cmd )
@@ -709,9 +1144,8 @@ class MySQL:
     except Exception:
       pass
 
-    if gDebugFile:
-      print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
-      gDebugFile.flush()
+    if self.queryProfiling:
+      self.__profile( template, params, start, res or 0 )
 
     return retDict
 
@@ -1026,6 +1460,17 @@ class MySQL:
 
     return self.__connectionPool.get( self.__dbName )
 
+  def __getEscapeConnection( self ):
+    """
+    Return the connection of the thread to escape values, without checking it is alive
+    """
+    if not self.__initialized:
+      error = 'DB not properly initialized'
+      gLogger.error( error )
+      return S_ERROR( error )
+
+    return self.__connectionPool.getCached( self.__dbName )
+
 ########################################################################################
 #
 #  Transaction functions
@@ -0,0 +1,140 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Per statement profile of the database queries of the process.
+
+    The statements are reduced to fingerprints: literal strings and numbers become ?,
+    lists of values become (...) and repeated groups of values are merged, so all the
+    executions of the same statement with different values are counted together.
+    For each database, fingerprint and calling component ( the DB class and method that
+    issued the statement ) the profiler keeps the number of executions, the total, max,
+    median and 99th percentile of the elapsed time and the number of rows returned or changed.
+    The percentiles are computed on a uniform sample of at most SAMPLESIZE executions.
+
+    The profile of the process is in gQueryProfiler. It is filled by the MySQL class and
+    served by the getDBProfile RPC of every service
+"""
+
+__RCSID__ = "$Id$"
+
+import re
+import random
+import threading
+
+# Maximum number of elapsed times kept per statement for the percentiles
+SAMPLESIZE = 200
+# Maximum number of statements profiled, the others are counted under OTHERSTATEMENTS
+MAXSTATEMENTS = 5000
+OTHERSTATEMENTS = '<other statements>'
+
+__stringRE = re.compile( r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"" )
+__numberRE = re.compile( r"(?<![\w`])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w`])" )
+__placeholderRE = re.compile( r"%s" )
+__valueListRE = re.compile( r"\(\s*\?(?:\s*,\s*\?)*\s*\)" )
+__repeatedGroupRE = re.compile( r"(\([^()]*(?:\([^()]*\)[^()]*)*\))(?:\s*,\s*\1)+" )
+__spaceRE = re.compile( r"\s+" )
+
+def getFingerprint( cmd ):
+  """ Get the fingerprint of a statement, or of a statement template with %s placeholders
+  """
+  fingerprint = __stringRE.sub( '?', cmd )
+  fingerprint = __numberRE.sub( '?', fingerprint )
+  fingerprint = __placeholderRE.sub( '?', fingerprint )
+  fingerprint = __spaceRE.sub( ' ', fingerprint ).strip()
+  fingerprint = __valueListRE.sub( '(...)', fingerprint )
+  return __repeatedGroupRE.sub( r'\1', fingerprint )
+
+class StatementProfile:
+  """ Counters of one statement issued by one component
+  """
+
+  def __init__( self ):
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+    self.rows = 0
+    self.samples = []
+
+  def add( self, elapsed, rows ):
+    self.count += 1
+    self.total += elapsed
+    self.rows += rows
+    if elapsed > self.max:
+      self.max = elapsed
+    # Reservoir sampling: each execution has the same chance to be in the sample
+    if len( self.samples ) < SAMPLESIZE:
+      self.samples.append( elapsed )
+    else:
+      index = random.randint( 0, self.count - 1 )
+      if index < SAMPLESIZE:
+        self.samples[index] = elapsed
+
+  def getPercentile( self, percent ):
+    if not self.samples:
+      return 0.
+    samples = sorted( self.samples )
+    return samples[ min( len( samples ) - 1, int( len( samples ) * percent / 100. ) ) ]
+
+class QueryProfiler:
+  """ Profile of the statements executed by the databases of the process
+  """
+
+  def __init__( self ):
+    self.__lock = threading.Lock()
+    # ( dbName, fingerprint, component ) -> StatementProfile
+    self.__profiles = {}
+
+  def add( self, dbName, fingerprint, component, elapsed, rows = 0 ):
+    """ Account one execution of a statement
+    """
+    key = ( dbName, fingerprint, component )
+    self.__lock.acquire()
+    try:
+      profile = self.__profiles.get( key )
+      if profile is None:
+        if len( self.__profiles ) >= MAXSTATEMENTS:
+          key = ( dbName, OTHERSTATEMENTS, '' )
+          profile = self.__profiles.get( key )
+        if profile is None:
+          profile = StatementProfile()
+          self.__profiles[key] = profile
+      profile.add( elapsed, rows )
+    finally:
+      self.__lock.release()
+
+  def getReport( self, sortBy = 'Total', limit = 0 ):
+    """ Get the profiles as a list of dictionaries sorted by decreasing sortBy value,
+        at most limit of them if given
+    """
+    self.__lock.acquire()
+    try:
+      report = []
+      for ( dbName, fingerprint, component ), profile in self.__profiles.items():
+        report.append( { 'DB' : dbName,
+                         'Fingerprint' : fingerprint,
+                         'Component' : component,
+                         'Count' : profile.count,
+                         'Total' : profile.total,
+                         'Mean' : profile.total / profile.count,
+                         'P50' : profile.getPercentile( 50 ),
+                         'P99' : profile.getPercentile( 99 ),
+                         'Max' : profile.max,
+                         'Rows' : profile.rows } )
+    finally:
+      self.__lock.release()
+    if report and sortBy in report[0]:
+      report.sort( key = lambda record: record[sortBy], reverse = True )
+    if limit:
+      report = report[:limit]
+    return report
+
+  def reset( self ):
+    """ Forget all the profiles
+    """
+    self.__lock.acquire()
+    try:
+      self.__profiles = {}
+    finally:
+      self.__lock.release()
+
+gQueryProfiler = QueryProfiler()
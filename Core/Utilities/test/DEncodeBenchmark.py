@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: DEncodeBenchmark.py
+########################################################################
+
+""" :mod: DEncodeBenchmark
+    ======================
+
+    .. module: DEncodeBenchmark
+    :synopsis: compare the fast DEncode codec with the table driven one
+
+    Compares encode and decode times on payloads shaped like real replies
+    (getReplicas for many LFNs, job page summaries).
+
+    Usage: python DEncodeBenchmark.py [numberOfLFNs] [repetitions]
+"""
+
+__RCSID__ = "$Id $"
+
+import sys
+import time
+import datetime
+from DIRAC.Core.Utilities import DEncode
+
+def replicasPayload( numLFNs ):
+  """ like FileCatalog getReplicas reply """
+  successful = {}
+  for i in xrange( numLFNs ):
+    lfn = "/lhcb/MC/2012/ALLSTREAMS.DST/00012345/0000/00012345_%08d_1.allstreams.dst" % i
+    successful[ lfn ] = { 'CERN-DST' : "srm://srm-eoslhcb.cern.ch/eos/lhcb/grid/prod%s" % lfn,
+                          'RAL-DST' : "srm://srm-lhcb.gridpp.rl.ac.uk/castor/ads.rl.ac.uk/prod%s" % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def jobSummaryPayload( numJobs ):
+  """ like JobMonitoring getJobPageSummaryWeb reply """
+  now = datetime.datetime.utcnow()
+  records = []
+  for i in xrange( numJobs ):
+    records.append( [ 1000000 + i, 'Done', 'Execution Complete', 'Unknown', 'LCG.CERN.ch', 'user',
+                      'lhcb_user', now, now, now, 'job_%d' % i, 2L, 1.5 * i ] )
+  return { 'OK' : True, 'Value' : { 'ParameterNames' : [ 'JobID', 'Status', 'MinorStatus', 'ApplicationStatus',
+                                                         'Site', 'Owner', 'OwnerGroup', 'LastUpdateTime',
+                                                         'HeartBeatTime', 'SubmissionTime', 'JobName',
+                                                         'RescheduleCounter', 'CPUTime' ],
+                                    'Records' : records,
+                                    'TotalRecords' : numJobs } }
+
+def timeIt( func, arg, repetitions ):
+  best = None
+  for _i in range( repetitions ):
+    start = time.time()
+    func( arg )
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def main():
+  numLFNs = 100000
+  repetitions = 3
+  if len( sys.argv ) > 1:
+    numLFNs = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    repetitions = int( sys.argv[2] )
+  for name, payload in ( ( "getReplicas %s LFNs" % numLFNs, replicasPayload( numLFNs ) ),
+                         ( "job summary %s jobs" % numLFNs, jobSummaryPayload( numLFNs ) ) ):
+    data = DEncode.encode( payload )
+    assert data == DEncode.encodeWithTables( payload )
+    print "%s (%.1f MB)" % ( name, len( data ) / 1048576.0 )
+    tEncOld = timeIt( DEncode.encodeWithTables, payload, repetitions )
+    tEncNew = timeIt( DEncode.encode, payload, repetitions )
+    tDecOld = timeIt( DEncode.decodeWithTables, data, repetitions )
+    tDecNew = timeIt( DEncode.decode, data, repetitions )
+    print "  encode        tables %.3fs  fast %.3fs  speedup %.2f" % ( tEncOld, tEncNew, tEncOld / tEncNew )
+    print "  decode        tables %.3fs  fast %.3fs  speedup %.2f" % ( tDecOld, tDecNew, tDecOld / tDecNew )
+
+if __name__ == "__main__":
+  main()
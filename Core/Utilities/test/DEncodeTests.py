@@ -0,0 +1,69 @@
+########################################################################
+# $HeadURL $
+# File: DEncodeTests.py
+########################################################################
+
+""" :mod: DEncodeTests
+    ==================
+
+    .. module: DEncodeTests
+    :synopsis: test cases for DEncode
+
+    test cases for DEncode: the fast codec has to produce the same wire
+    format as the table driven one, decode it back to the same objects and
+    reject malformed data
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import datetime
+import unittest
+## SUT
+from DIRAC.Core.Utilities import DEncode
+
+########################################################################
+class DEncodeTestCase( unittest.TestCase ):
+  """
+  .. class:: DEncodeTestCase
+
+  """
+  def setUp( self ):
+    """ test setup """
+    self.objects = [ 1, -12345678901234567890L, 2.0 * 10 ** 20, 2.0 * 10 ** -10, 3.25, True, False, None,
+                     "", "abc:e", u"unicod\xe9", [], (), {},
+                     datetime.datetime( 2013, 5, 6, 7, 8, 9, 10 ), datetime.date( 2013, 5, 6 ),
+                     datetime.time( 7, 8, 9, 10 ),
+                     { 'OK' : True,
+                       'Value' : { 'Successful' : dict( [ ( "/lhcb/data/file%d" % i, { 'CERN-DST' : "srm://x/%d" % i,
+                                                                                         'size' : i * 1024L,
+                                                                                         'ratio' : i / 4.0 } )
+                                                          for i in range( 50 ) ] ),
+                                   'Failed' : { '/lhcb/missing' : 'No such file' } } },
+                     [ ( 1, [ 2, ( 3, { 4 : "5" } ) ] ), { ( 1, 2 ) : [ None, 1e-5 ] } ] ]
+
+  def test01SameWireFormat( self ):
+    """ fast encode gives the same bytes as the table driven one """
+    for obj in self.objects:
+      self.assertEqual( DEncode.encode( obj ), DEncode.encodeWithTables( obj ) )
+
+  def test02Decode( self ):
+    """ fast decode gives the same objects as the table driven one """
+    for obj in self.objects:
+      data = DEncode.encodeWithTables( obj )
+      self.assertEqual( DEncode.decode( data ), DEncode.decodeWithTables( data ) )
+      self.assertEqual( DEncode.decode( data )[0], obj )
+      self.assertEqual( type( DEncode.decode( data )[0] ), type( obj ) )
+
+  def test03Errors( self ):
+    """ corrupted data """
+    self.assertRaises( ValueError, DEncode.decode, "li1e" )
+    self.assertRaises( ValueError, DEncode.decode, "ls10:abce" )
+    self.assertRaises( ValueError, DEncode.decode, "x" )
+    self.assertRaises( KeyError, DEncode.encode, set( [ 1 ] ) )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( DEncodeTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
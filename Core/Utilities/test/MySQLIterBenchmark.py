@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: MySQLIterBenchmark.py
+########################################################################
+
+""" :mod: MySQLIterBenchmark
+    ========================
+
+    .. module: MySQLIterBenchmark
+    :synopsis: peak memory of a large scan with _query and _queryIter
+
+    Fills a table of the given database with rows shaped like TransformationFiles
+    (5M by default) and scans it in a fresh process with _query (fetchall) and with
+    the streaming _queryIter, reporting the time and the peak RSS of each scan.
+    The table is dropped at the end.
+
+    Usage: python MySQLIterBenchmark.py host user password database [rows]
+"""
+
+__RCSID__ = "$Id $"
+
+import os
+import sys
+import time
+import resource
+from DIRAC.Core.Utilities.MySQL import MySQL
+
+TABLE = 'MySQLIterBenchmark'
+
+def fillTable( db, rows ):
+  """ create the table and double its content up to the number of rows """
+  db._update( "DROP TABLE IF EXISTS %s" % TABLE )
+  result = db._createTables( { TABLE : { 'Fields' : { 'ID' : 'INTEGER NOT NULL AUTO_INCREMENT',
+                                                      'TransformationID' : 'INTEGER NOT NULL',
+                                                      'Status' : 'VARCHAR(32) NOT NULL',
+                                                      'TargetSE' : 'VARCHAR(255) NOT NULL',
+                                                      'LastUpdate' : 'DATETIME' },
+                                         'PrimaryKey' : 'ID' } } )
+  if not result['OK']:
+    return result
+  db._update( "INSERT INTO %s (TransformationID,Status,TargetSE,LastUpdate) " % TABLE +
+              "VALUES (1,'Unused','CERN-DST-EOS',UTC_TIMESTAMP())" )
+  count = 1
+  while count < rows:
+    result = db._update( "INSERT INTO %s (TransformationID,Status,TargetSE,LastUpdate) " % TABLE +
+                         "SELECT TransformationID+1,Status,TargetSE,LastUpdate FROM %s LIMIT %d" % ( TABLE, rows - count ) )
+    if not result['OK']:
+      return result
+    count += result['Value']
+  return result
+
+def scan( db, streaming ):
+  """ read the whole table, keeping only a count """
+  req = "SELECT ID,TransformationID,Status,TargetSE,LastUpdate FROM %s" % TABLE
+  count = 0
+  if streaming:
+    for result in db._queryIter( req, chunkSize = 10000 ):
+      if not result['OK']:
+        return result
+      count += len( result['Value'] )
+  else:
+    result = db._query( req )
+    if not result['OK']:
+      return result
+    count = len( result['Value'] )
+  return count
+
+def runScan( dbArgs, streaming ):
+  """ scan in a child process so that each scan has its own peak RSS """
+  pid = os.fork()
+  if not pid:
+    db = MySQL( *dbArgs )
+    start = time.time()
+    count = scan( db, streaming )
+    elapsed = time.time() - start
+    # ru_maxrss is in kB on Linux
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.
+    print "%-10s: %8s rows in %7.2f s, peak RSS %8.1f MB" % ( streaming and '_queryIter' or '_query',
+                                                            count, elapsed, peak )
+    sys.stdout.flush()
+    os._exit( 0 )
+  os.waitpid( pid, 0 )
+
+if __name__ == "__main__":
+  if len( sys.argv ) < 5:
+    print __doc__
+    sys.exit( 1 )
+  dbArgs = sys.argv[1:5]
+  rows = 5000000
+  if len( sys.argv ) > 5:
+    rows = int( sys.argv[5] )
+  db = MySQL( *dbArgs )
+  result = fillTable( db, rows )
+  if not result['OK']:
+    print "Cannot fill the table:", result['Message']
+    sys.exit( 1 )
+  for streaming in ( True, False ):
+    runScan( dbArgs, streaming )
+  db._update( "DROP TABLE IF EXISTS %s" % TABLE )
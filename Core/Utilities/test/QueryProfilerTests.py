@@ -0,0 +1,73 @@
+########################################################################
+# $HeadURL $
+# File: QueryProfilerTests.py
+########################################################################
+
+""" :mod: QueryProfilerTests
+    ========================
+
+    .. module: QueryProfilerTests
+    :synopsis: test cases for the QueryProfiler
+
+    test cases for the statement fingerprints and the QueryProfiler counters
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+## SUT
+from DIRAC.Core.Utilities import QueryProfiler
+from DIRAC.Core.Utilities.QueryProfiler import getFingerprint
+
+########################################################################
+class QueryProfilerTestCase( unittest.TestCase ):
+  """
+  .. class:: QueryProfilerTestCase
+
+  """
+
+  def test01Fingerprint( self ):
+    """ literals, value lists and repeated value groups """
+    self.assertEqual( getFingerprint( "SELECT Name FROM `tq_TQTo1` WHERE JobID=123 AND Status IN ('Done', 'Fail''d')" ),
+                      "SELECT Name FROM `tq_TQTo1` WHERE JobID=? AND Status IN (...)" )
+    self.assertEqual( getFingerprint( "INSERT INTO T (A,B) VALUES (1,'a'),\n (2, 'b'), (3,'c')" ),
+                      "INSERT INTO T (A,B) VALUES (...)" )
+    self.assertEqual( getFingerprint( "INSERT INTO T VALUES ( 1, 'a',UTC_TIMESTAMP()),( 2, 'b',UTC_TIMESTAMP())" ),
+                      "INSERT INTO T VALUES ( ?, ?,UTC_TIMESTAMP())" )
+    self.assertEqual( getFingerprint( "UPDATE Jobs SET Status=%s WHERE JobID IN (%s) AND Owner IS NULL" ),
+                      getFingerprint( "UPDATE Jobs SET Status='Done' WHERE JobID IN (1,2) AND Owner IS NULL" ) )
+
+  def test02Profile( self ):
+    """ counters, percentiles and the bound on the number of statements """
+    profiler = QueryProfiler.QueryProfiler()
+    for i in range( 100 ):
+      profiler.add( 'JobDB', 'SELECT ?', 'JobDB.getJob', ( i + 1 ) / 1000., 2 )
+    profiler.add( 'JobDB', 'UPDATE ?', 'JobDB.setJob', 1., 1 )
+    report = profiler.getReport()
+    self.assertEqual( [ record['Fingerprint'] for record in report ], [ 'SELECT ?', 'UPDATE ?' ] )
+    self.assertEqual( report[0]['Count'], 100 )
+    self.assertEqual( report[0]['Rows'], 200 )
+    self.assertAlmostEqual( report[0]['P50'], 0.051 )
+    self.assertAlmostEqual( report[0]['P99'], 0.1 )
+    self.assertAlmostEqual( report[0]['Max'], 0.1 )
+    self.assertEqual( profiler.getReport( 'Max', 1 )[0]['Fingerprint'], 'UPDATE ?' )
+
+    maxStatements = QueryProfiler.MAXSTATEMENTS
+    QueryProfiler.MAXSTATEMENTS = 2
+    try:
+      profiler.add( 'JobDB', 'DELETE ?', 'JobDB.deleteJob', 1. )
+      profiler.add( 'JobDB', 'SELECT ?', 'JobDB.getJob', 1. )
+    finally:
+      QueryProfiler.MAXSTATEMENTS = maxStatements
+    counts = dict( [ ( record['Fingerprint'], record['Count'] ) for record in profiler.getReport() ] )
+    self.assertEqual( counts, { 'SELECT ?' : 101, 'UPDATE ?' : 1, QueryProfiler.OTHERSTATEMENTS : 1 } )
+
+    profiler.reset()
+    self.assertEqual( profiler.getReport(), [] )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( QueryProfilerTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
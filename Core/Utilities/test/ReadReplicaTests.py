@@ -0,0 +1,163 @@
+########################################################################
+# $HeadURL $
+# File: ReadReplicaTests.py
+########################################################################
+
+""" :mod: ReadReplicaTests
+    ======================
+
+    .. module: ReadReplicaTests
+    :synopsis: test cases for the routing of the queries to the read replicas
+
+    test cases for readOnlySafe and the fall back of the MySQL queries to the primary,
+    with fake connection pools
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+## SUT
+from DIRAC.Core.Utilities import MySQL as MySQLModule
+from DIRAC.Core.Utilities.MySQL import MySQL, ReadReplica, readOnlySafe
+from DIRAC import S_OK, S_ERROR, gLogger
+
+class FakeCursor( object ):
+  """ records the statements in the pool, fails them with the error of the pool """
+
+  def __init__( self, pool ):
+    self.pool = pool
+    self.description = None
+    self.lastrowid = None
+
+  def execute( self, cmd ):
+    if self.pool.error:
+      raise MySQLModule.MySQLdb.OperationalError( *self.pool.error )
+    self.pool.executed.append( cmd )
+    if cmd == 'SHOW SLAVE STATUS':
+      self.description = ( ( 'Slave_IO_State', ), ( 'Seconds_Behind_Master', ) )
+    return 1
+
+  def fetchone( self ):
+    return ( 'Waiting for master to send event', self.pool.lag )
+
+  def fetchall( self ):
+    return ( ( self.pool.name, ), )
+
+  def close( self ):
+    pass
+
+class FakeConnection( object ):
+
+  def __init__( self, pool ):
+    self.pool = pool
+
+  def cursor( self ):
+    return FakeCursor( self.pool )
+
+class FakePool( object ):
+  """ connection pool of one server """
+
+  def __init__( self, name, lag = 0 ):
+    self.name = name
+    self.lag = lag
+    self.error = None
+    self.down = False
+    self.intrans = False
+    self.executed = []
+
+  def get( self, dbName, retries = 10 ):
+    if self.down:
+      return S_ERROR( "Can't connect to %s" % self.name )
+    return S_OK( FakeConnection( self ) )
+
+  def inTransaction( self ):
+    return self.intrans
+
+class FakeDB( MySQL ):
+  """ MySQL with fake pools for the primary and one replica """
+
+  def __init__( self, primary, replica ):
+    self.log = gLogger.getSubLogger( 'FakeDB' )
+    self.logger = self.log
+    self.queryProfiling = False
+    self._MySQL__initialized = True
+    self._MySQL__dbName = 'FakeDB'
+    self._MySQL__connectionPool = primary
+    self._MySQL__readReplicas = [ ReadReplica( replica, 'replica', 3306, maxLag = 10, checkPeriod = 60 ) ]
+
+  def plainQuery( self ):
+    return self._query( "SELECT 1" )
+
+  @readOnlySafe
+  def safeQuery( self ):
+    return self._query( "SELECT 1" )
+
+  @readOnlySafe
+  def safeUpdateAndQuery( self ):
+    self._update( "UPDATE T SET A=1" )
+    return self._query( "SELECT 1" )
+
+  @readOnlySafe
+  def nestedQueries( self ):
+    results = [ self.safeQuery()['Value'][0][0] ]
+    results.append( self.safeUpdateAndQuery()['Value'][0][0] )
+    results.append( self._query( "SELECT 1" )['Value'][0][0] )
+    return results
+
+########################################################################
+class ReadReplicaTestCase( unittest.TestCase ):
+  """
+  .. class:: ReadReplicaTestCase
+
+  """
+
+  def setUp( self ):
+    self.primary = FakePool( 'primary' )
+    self.replica = FakePool( 'replica' )
+    self.db = FakeDB( self.primary, self.replica )
+
+  def test01Routing( self ):
+    """ readOnlySafe depth, updates and transactions """
+    self.assertEqual( self.db.plainQuery()['Value'][0][0], 'primary' )
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'replica' )
+    self.assertEqual( self.db.safeUpdateAndQuery()['Value'][0][0], 'primary' )
+    # The update only sends to the primary the rest of the outermost call
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'replica' )
+    self.assertEqual( self.db.nestedQueries(), [ 'replica', 'primary', 'primary' ] )
+    self.assertEqual( getattr( MySQLModule.gReadOnlyContext, 'depth', 0 ), 0 )
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'replica' )
+    self.primary.intrans = True
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'primary' )
+
+  def test02Lag( self ):
+    """ lagging replica """
+    self.replica.lag = 20
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'primary' )
+    self.db = FakeDB( self.primary, self.replica )
+    self.replica.lag = None
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'primary' )
+
+  def test03Fallback( self ):
+    """ the primary serves the query only if the replica connection is lost """
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'replica' )
+    self.replica.error = ( 1054, "Unknown column 'A' in 'field list'" )
+    result = self.db.safeQuery()
+    self.assertFalse( result['OK'] )
+    self.assertEqual( self.primary.executed, [] )
+    self.replica.error = ( 2013, 'Lost connection to MySQL server during query' )
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'primary' )
+    self.assertEqual( self.primary.executed, [ "SELECT 1" ] )
+    # Not used until the next check
+    self.replica.error = None
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'primary' )
+
+    self.db = FakeDB( self.primary, self.replica )
+    self.replica.down = True
+    self.assertEqual( self.db.safeQuery()['Value'][0][0], 'primary' )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ReadReplicaTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,68 @@
+########################################################################
+# $HeadURL $
+# File: StatementTemplateTests.py
+########################################################################
+
+""" :mod: StatementTemplateTests
+    ============================
+
+    .. module: StatementTemplateTests
+    :synopsis: test cases for the MySQL StatementTemplate
+
+    test cases for StatementTemplate: parsing of the placeholders and binding of the parameters
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+## SUT
+from DIRAC.Core.Utilities.MySQL import StatementTemplate
+
+class FakeConnection( object ):
+  """ escapes the values like the MySQLdb connection literal method """
+
+  def __init__( self ):
+    self.calls = 0
+
+  def literal( self, values ):
+    self.calls += 1
+    literals = []
+    for value in values:
+      if value is None:
+        literals.append( 'NULL' )
+      elif isinstance( value, ( int, long, float ) ):
+        literals.append( str( value ) )
+      else:
+        literals.append( "'%s'" % str( value ).replace( "'", "\\'" ) )
+    return tuple( literals )
+
+########################################################################
+class StatementTemplateTestCase( unittest.TestCase ):
+  """
+  .. class:: StatementTemplateTestCase
+
+  """
+
+  def test01Parse( self ):
+    """ placeholders and escaped percent signs """
+    template = StatementTemplate( "SELECT Name FROM T WHERE Name LIKE 'a%%' AND ID=%s AND Status IN (%s)" )
+    self.assertEqual( template.numParams, 2 )
+    self.assertEqual( template.fragments, [ "SELECT Name FROM T WHERE Name LIKE 'a%' AND ID=",
+                                            " AND Status IN (", ")" ] )
+    self.assertEqual( StatementTemplate( "SELECT 1" ).numParams, 0 )
+
+  def test02Bind( self ):
+    """ all the parameters are escaped in one call, lists are expanded """
+    connection = FakeConnection()
+    template = StatementTemplate( "UPDATE T SET Name=%s, Value=%s WHERE ID IN (%s) AND Status IN (%s)" )
+    statement = template.bind( connection, [ "O'Neil", None, [ 1, 2, 3 ], [] ] )
+    self.assertEqual( statement, "UPDATE T SET Name='O\\'Neil', Value=NULL WHERE ID IN (1,2,3) AND Status IN (NULL)" )
+    self.assertEqual( connection.calls, 1 )
+    self.assertRaises( ValueError, template.bind, connection, [ 1 ] )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( StatementTemplateTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
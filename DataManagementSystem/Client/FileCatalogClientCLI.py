@@ -1975,6 +1975,8 @@ File Catalog Client $Revision: 1.17 $Date:
           dataset update <dataset_name>                    - update the dataset parameters
           dataset freeze <dataset_name>                    - fix the current contents of the dataset     
           dataset release <dataset_name>                   - release the dynamic dataset
+          dataset materialize <dataset_name>               - store the dataset files and refresh them incrementally
+          dataset changes <dataset_name> [<version>]       - show files added and removed since the version
     """
     argss = args.split()
     if (len(argss)==0):
@@ -2002,6 +2004,10 @@ File Catalog Client $Revision: 1.17 $Date:
       self.dataset_release( argss )      
     elif command == "status":
       self.dataset_status( argss )        
+    elif command == "materialize":
+      self.dataset_materialize( argss )
+    elif command == "changes":
+      self.dataset_changes( argss )
 
   def dataset_add( self, argss ):
     """ Add a new dataset
@@ -2102,6 +2108,33 @@ File Catalog Client $Revision: 1.17 $Date:
     else:
       print "Successfully released dataset", datasetName       
 
+  def dataset_materialize( self, argss ):
+    """ Materialize the given dataset
+    """
+    datasetName = argss[0]
+    result = self.fc.materializeDataset( datasetName )
+    if not result['OK']:
+      print "ERROR: failed to materialize dataset:", result['Message']
+    else:
+      print "Successfully materialized dataset", datasetName, "version", result['Value']['Version']
+
+  def dataset_changes( self, argss ):
+    """ Show the changes of the given materialized dataset since a version
+    """
+    datasetName = argss[0]
+    version = 0
+    if len( argss ) > 1:
+      version = int( argss[1] )
+    result = self.fc.getDatasetChanges( datasetName, version )
+    if not result['OK']:
+      print "ERROR: failed to get changes for dataset:", result['Message']
+    else:
+      print "Dataset version", result['Value']['Version']
+      for lfn in result['Value']['Added']:
+        print '+', lfn
+      for lfn in result['Value']['Removed']:
+        print '-', lfn
+
   def dataset_files( self, argss ):
     """ Get the given dataset files
     """
@@ -14,8 +14,19 @@ except ImportError:
   import md5
 from types import StringTypes, ListType, DictType
 import os
+import zlib
 from DIRAC import S_OK, S_ERROR, gLogger
-from DIRAC.Core.Utilities.List import stringListToString
+from DIRAC.Core.Utilities.List import stringListToString, intListToString, breakListIntoChunks
+
+# Number of files asked at once when evaluating the query of a materialized dataset
+MATERIALIZE_PAGE_SIZE = 10000
+# The incremental refresh evaluates the query again on this number of FileIDs below the
+# last one seen, to catch the files of registrations committed after a refresh
+MATERIALIZE_FILEID_MARGIN = 10000
+# Seconds after which the refresh of a materialized dataset evaluates the whole query
+MATERIALIZE_FULL_REFRESH_PERIOD = 86400
+# Number of versions of a materialized dataset for which all the changes are kept
+MATERIALIZE_KEPT_VERSIONS = 100
 
 class DatasetManager:
 
@@ -50,6 +61,36 @@ class DatasetManager:
                                                  },
                                        "PrimaryKey": "DatasetID",
                                      }
+  # Materialized datasets keep their files in FC_MetaDatasetFiles, refreshed incrementally.
+  # LastFileID is the highest FileID of the catalog when the query was last evaluated, the
+  # Checksum is the XOR of the CRC32 of the file IDs and FullRefresh is set by metadata changes.
+  # The changes of the versions up to PrunedVersion are only kept for the files still in the dataset
+  _tables["FC_MaterializedDatasets"] = { "Fields": {
+                                                    "DatasetID": "INT NOT NULL",
+                                                    "Version": "INT NOT NULL DEFAULT 0",
+                                                    "LastFileID": "INT NOT NULL DEFAULT 0",
+                                                    "NumberOfFiles": "INT NOT NULL DEFAULT 0",
+                                                    "TotalSize": "BIGINT UNSIGNED NOT NULL DEFAULT 0",
+                                                    "Checksum": "INT UNSIGNED NOT NULL DEFAULT 0",
+                                                    "FullRefresh": "TINYINT NOT NULL DEFAULT 1",
+                                                    "RefreshDate": "DATETIME",
+                                                    "FullRefreshDate": "DATETIME",
+                                                    "PrunedVersion": "INT NOT NULL DEFAULT 0"
+                                                   },
+                                         "PrimaryKey": "DatasetID"
+                                       }
+  # Files added to or removed from the materialized datasets in each version
+  _tables["FC_MetaDatasetChanges"] = { "Fields": {
+                                                  "DatasetID": "INT NOT NULL",
+                                                  "Version": "INT NOT NULL",
+                                                  "FileID": "INT NOT NULL",
+                                                  "LFN": "VARCHAR(1024) NOT NULL",
+                                                  "Size": "BIGINT UNSIGNED NOT NULL DEFAULT 0",
+                                                  "Added": "TINYINT NOT NULL"
+                                                 },
+                                       "Indexes": { "DatasetID_Version": ["DatasetID","Version"],
+                                                    "DatasetID_FileID": ["DatasetID","FileID"] }
+                                     }
 
   def __init__( self, database = None ):
     self.db = None
@@ -341,7 +382,8 @@ class DatasetManager:
       return S_OK( 'Dataset %s does not exist' % datasetName  )
     datasetID = result['Value'][0][0]
 
-    for table in ["FC_MetaDatasetFiles","FC_MetaDatasets","FC_DatasetAnnotations"]:
+    for table in ["FC_MetaDatasetFiles","FC_MetaDatasets","FC_DatasetAnnotations",
+                  "FC_MaterializedDatasets","FC_MetaDatasetChanges"]:
       req = "DELETE FROM %s WHERE DatasetID=%s" % (table, datasetID)
       result = self.db._update( req )
 
@@ -623,6 +665,11 @@ class DatasetManager:
     datasetID = result['Value']['DatasetID']
     if status in ["Frozen","Static"]:
       return self.__getFrozenDatasetFiles( datasetID, credDict )
+    elif status == "Materialized":
+      result = self.__refreshMaterializedDataset( datasetID, credDict )
+      if not result['OK']:
+        return result
+      return self.__getFrozenDatasetFiles( datasetID, credDict )
     else:
       return self.__getDynamicDatasetFiles( datasetID, credDict )
 
@@ -637,8 +684,9 @@ class DatasetManager:
       return S_OK()
 
     datasetID = result['Value']['DatasetID']
-    req = "DELETE FROM FC_MetaDatasetFiles WHERE DatasetID=%d" % datasetID
-    result = self.db._update( req )
+    result = self.__dropMaterialization( datasetID )
+    if not result['OK']:
+      return result
 
     result = self.__getDynamicDatasetFiles( datasetID, credDict )
 
@@ -668,9 +716,308 @@ class DatasetManager:
       return S_OK()
 
     datasetID = result['Value']['DatasetID']
-    req = "DELETE FROM FC_MetaDatasetFiles WHERE DatasetID=%d" % datasetID
-    result = self.db._update( req )
+    result = self.__dropMaterialization( datasetID )
+    if not result['OK']:
+      return result
 
     result = self.setDatasetStatus( datasetName, 'Dynamic' )
     return result
 
+  def __dropMaterialization( self, datasetID ):
+    """ Remove the stored files and the change history of the dataset
+    """
+    for table in ["FC_MetaDatasetFiles","FC_MaterializedDatasets","FC_MetaDatasetChanges"]:
+      req = "DELETE FROM %s WHERE DatasetID=%d" % ( table, datasetID )
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+    return S_OK()
+
+  def materializeDataset( self, datasetName, credDict ):
+    """ Keep the files of the dynamic dataset in the catalog and refresh them incrementally
+    """
+    result = self.getDatasetParameters( datasetName, credDict )
+    if not result['OK']:
+      return result
+    status = result['Value']['Status']
+    datasetID = result['Value']['DatasetID']
+    if status == "Materialized":
+      return self.__refreshMaterializedDataset( datasetID, credDict )
+    if status in ["Frozen","Static"]:
+      return S_ERROR( 'Dataset %s is frozen, release it first' % datasetName )
+
+    result = self.__dropMaterialization( datasetID )
+    if not result['OK']:
+      return result
+    req = "INSERT INTO FC_MaterializedDatasets (DatasetID,RefreshDate) VALUES (%d,UTC_TIMESTAMP())" % datasetID
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    result = self.setDatasetStatus( datasetName, 'Materialized' )
+    if not result['OK']:
+      return result
+    return self.__refreshMaterializedDataset( datasetID, credDict )
+
+  def refreshDataset( self, datasetName, credDict, full = False ):
+    """ Bring the files of the materialized dataset up to date. The new files are found
+        by evaluating the query on the files registered since the last refresh, the
+        whole query is evaluated again only if full is set or the metadata have changed
+    """
+    result = self.getDatasetParameters( datasetName, credDict )
+    if not result['OK']:
+      return result
+    if result['Value']['Status'] != "Materialized":
+      return S_ERROR( 'Dataset %s is not materialized' % datasetName )
+    return self.__refreshMaterializedDataset( result['Value']['DatasetID'], credDict, full = full )
+
+  def invalidateMaterializedDatasets( self ):
+    """ Metadata have changed, the next refresh of the materialized datasets evaluates the whole query
+    """
+    return self.db._update( "UPDATE FC_MaterializedDatasets SET FullRefresh=1 WHERE FullRefresh=0" )
+
+  def getDatasetChanges( self, datasetName, version, credDict ):
+    """ Get the LFNs added to and removed from the materialized dataset after the given version
+    """
+    result = self.getDatasetParameters( datasetName, credDict )
+    if not result['OK']:
+      return result
+    if result['Value']['Status'] != "Materialized":
+      return S_ERROR( 'Dataset %s is not materialized' % datasetName )
+    datasetID = result['Value']['DatasetID']
+
+    result = self.__refreshMaterializedDataset( datasetID, credDict )
+    if not result['OK']:
+      return result
+    resultDict = result['Value']
+
+    result = self.db._query( "SELECT PrunedVersion FROM FC_MaterializedDatasets WHERE DatasetID=%d" % datasetID )
+    if not result['OK']:
+      return result
+    if result['Value'] and version < result['Value'][0][0]:
+      return S_ERROR( 'The changes of dataset %s before version %d are not kept anymore' % ( datasetName, result['Value'][0][0] ) )
+
+    req = "SELECT FileID,LFN,Added FROM FC_MetaDatasetChanges WHERE DatasetID=%d AND Version>%d" % ( datasetID, version )
+    req += " ORDER BY Version"
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    # Only the last change of each file counts, a file added and removed since the version did not change
+    lastChange = {}
+    for fileID, lfn, added in result['Value']:
+      if fileID in lastChange and lastChange[fileID][1] != added:
+        del lastChange[fileID]
+      else:
+        lastChange[fileID] = ( lfn, added )
+    resultDict['Added'] = sorted( [ lfn for lfn, added in lastChange.values() if added ] )
+    resultDict['Removed'] = sorted( [ lfn for lfn, added in lastChange.values() if not added ] )
+    return S_OK( resultDict )
+
+  def __findDatasetFiles( self, metaQuery, credDict, lastFileID ):
+    """ Get the { FileID: LFN } of the files satisfying the query with a FileID above lastFileID
+    """
+    findMetaQuery = dict( metaQuery )
+    path = findMetaQuery.pop( 'Path', '/' )
+    # The directories are selected once, the pages only go through the files
+    result = self.db.fmeta._getFileSelection( findMetaQuery, path, credDict )
+    if not result['OK']:
+      return result
+    selection = result['Value']
+    fileDict = {}
+    while True:
+      result = self.db.fmeta._findFilesBySelectionPage( selection, credDict,
+                                                        lastFileID = lastFileID, maxItems = MATERIALIZE_PAGE_SIZE )
+      if not result['OK']:
+        return result
+      fileDict.update( result['LFNIDDict'] )
+      lastFileID = result['NextToken']
+      if not lastFileID:
+        return S_OK( fileDict )
+
+  def __refreshMaterializedDataset( self, datasetID, credDict, full = False ):
+    """ Apply the changes of the query result to the stored files of the dataset as a new version
+    """
+    req = "SELECT M.Version,M.LastFileID,M.NumberOfFiles,M.TotalSize,M.Checksum,M.FullRefresh,"
+    req += "IFNULL(M.FullRefreshDate<UTC_TIMESTAMP()-INTERVAL %d SECOND,1),M.PrunedVersion,D.MetaQuery " % \
+           MATERIALIZE_FULL_REFRESH_PERIOD
+    req += "FROM FC_MaterializedDatasets AS M, FC_MetaDatasets AS D "
+    req += "WHERE M.DatasetID=%d AND D.DatasetID=M.DatasetID" % datasetID
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'Dataset ID %d is not materialized' % datasetID )
+    version, lastFileID, numberOfFiles, totalSize, checksum, fullRefresh, fullRefreshDue, \
+      prunedVersion, metaQuery = result['Value'][0]
+    metaQuery = eval( metaQuery )
+    # The whole query is evaluated now and then in case files were missed by the FileID margin
+    full = full or fullRefresh or fullRefreshDue
+
+    # Files registered while the query runs are looked at again by the next refresh
+    result = self.db._query( "SELECT MAX(FileID) FROM FC_Files" )
+    if not result['OK']:
+      return result
+    maxFileID = int( result['Value'][0][0] or 0 )
+
+    result = self.__findDatasetFiles( metaQuery, credDict,
+                                      0 if full else max( 0, lastFileID - MATERIALIZE_FILEID_MARGIN ) )
+    if not result['OK']:
+      return result
+    foundFiles = result['Value']
+
+    if full:
+      req = "SELECT FileID FROM FC_MetaDatasetFiles WHERE DatasetID=%d" % datasetID
+    else:
+      # Files removed from the catalog
+      req = "SELECT D.FileID FROM FC_MetaDatasetFiles AS D LEFT JOIN FC_Files AS F ON D.FileID=F.FileID "
+      req += "WHERE D.DatasetID=%d AND F.FileID IS NULL" % datasetID
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    storedIDs = set( [ row[0] for row in result['Value'] ] )
+    if full:
+      addedIDs = set( foundFiles ) - storedIDs
+      removedIDs = storedIDs - set( foundFiles )
+    else:
+      addedIDs = set( foundFiles )
+      removedIDs = storedIDs
+      if addedIDs:
+        # Files of the FileID margin already stored, or stored by a refresh running concurrently
+        req = "SELECT FileID FROM FC_MetaDatasetFiles WHERE DatasetID=%d AND FileID IN (%s)"
+        result = self.db._query( req % ( datasetID, intListToString( addedIDs ) ) )
+        if not result['OK']:
+          return result
+        addedIDs -= set( [ row[0] for row in result['Value'] ] )
+
+    changes = []
+    if addedIDs:
+      result = self.db._query( "SELECT FileID,Size FROM FC_Files WHERE FileID IN (%s)" % intListToString( addedIDs ) )
+      if not result['OK']:
+        return result
+      for fileID, size in result['Value']:
+        changes.append( ( fileID, foundFiles[fileID], int( size ), 1 ) )
+    if removedIDs:
+      # The removed files may be gone from the catalog, their LFN and size are taken from their addition
+      req = "SELECT FileID,LFN,Size FROM FC_MetaDatasetChanges WHERE DatasetID=%d AND Added=1 AND FileID IN (%s)"
+      result = self.db._query( req % ( datasetID, intListToString( removedIDs ) ) )
+      if not result['OK']:
+        return result
+      for fileID, lfn, size in dict( [ ( row[0], row ) for row in result['Value'] ] ).values():
+        changes.append( ( fileID, lfn, int( size ), 0 ) )
+
+    resultDict = { 'Version': int( version ),
+                   'NumberOfFiles': int( numberOfFiles ),
+                   'TotalSize': int( totalSize ),
+                   'Checksum': int( checksum ),
+                   'Added': len( [ change for change in changes if change[3] ] ),
+                   'Removed': len( [ change for change in changes if not change[3] ] ) }
+    refreshSQL = "LastFileID=GREATEST(LastFileID,%d),FullRefresh=0,RefreshDate=UTC_TIMESTAMP()" % maxFileID
+    if full:
+      refreshSQL += ",FullRefreshDate=UTC_TIMESTAMP()"
+    if not changes:
+      req = "UPDATE FC_MaterializedDatasets SET %s WHERE DatasetID=%d" % ( refreshSQL, datasetID )
+      result = self.db._update( req )
+      if not result['OK']:
+        return result
+      return S_OK( resultDict )
+
+    for fileID, lfn, size, added in changes:
+      sign = 1 if added else -1
+      resultDict['NumberOfFiles'] += sign
+      resultDict['TotalSize'] += sign * size
+      resultDict['Checksum'] ^= zlib.crc32( str( fileID ) ) & 0xffffffff
+    resultDict['Version'] += 1
+
+    result = self.db.transactionStart()
+    if not result['OK']:
+      return result
+    result = self.__storeDatasetChanges( datasetID, changes, resultDict, refreshSQL )
+    if not result['OK'] or not result['Value']:
+      self.db.transactionRollback()
+      if not result['OK']:
+        return result
+      # Another refresh stored its changes first, it has done the work of this one
+      return self.__getMaterializedCounters( datasetID )
+    result = self.db.transactionCommit()
+    if not result['OK']:
+      return result
+
+    if resultDict['Version'] - prunedVersion >= 2 * MATERIALIZE_KEPT_VERSIONS:
+      result = self.__pruneDatasetChanges( datasetID, resultDict['Version'] - MATERIALIZE_KEPT_VERSIONS )
+      if not result['OK']:
+        gLogger.warn( "Failed to prune the changes of dataset", "%d: %s" % ( datasetID, result['Message'] ) )
+    return S_OK( resultDict )
+
+  def __getMaterializedCounters( self, datasetID ):
+    """ Get the stored version and counters of the materialized dataset, with nothing added or removed
+    """
+    req = "SELECT Version,NumberOfFiles,TotalSize,Checksum FROM FC_MaterializedDatasets WHERE DatasetID=%d" % datasetID
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'Dataset ID %d is not materialized' % datasetID )
+    version, numberOfFiles, totalSize, checksum = result['Value'][0]
+    return S_OK( { 'Version': int( version ),
+                   'NumberOfFiles': int( numberOfFiles ),
+                   'TotalSize': int( totalSize ),
+                   'Checksum': int( checksum ),
+                   'Added': 0,
+                   'Removed': 0 } )
+
+  def __pruneDatasetChanges( self, datasetID, prunedVersion ):
+    """ Forget the changes up to prunedVersion except the additions of the files still in the
+        dataset, they give the LFN and size of the files when they are removed
+    """
+    req = "DELETE C FROM FC_MetaDatasetChanges AS C LEFT JOIN FC_MetaDatasetFiles AS F "
+    req += "ON F.DatasetID=C.DatasetID AND F.FileID=C.FileID "
+    req += "WHERE C.DatasetID=%d AND C.Version<=%d AND ( C.Added=0 OR F.FileID IS NULL )" % ( datasetID, prunedVersion )
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    req = "UPDATE FC_MaterializedDatasets SET PrunedVersion=GREATEST(PrunedVersion,%d) WHERE DatasetID=%d"
+    return self.db._update( req % ( prunedVersion, datasetID ) )
+
+  def __storeDatasetChanges( self, datasetID, changes, resultDict, refreshSQL ):
+    """ Write the changed files and the new counters of the materialized dataset.
+        Returns S_OK( False ) if another refresh has stored a new version in the meantime
+    """
+    # The version only moves forward if nobody else has stored changes in the meantime
+    req = "UPDATE FC_MaterializedDatasets SET Version=%d,NumberOfFiles=%d,TotalSize=%d,Checksum=%d,%s " % \
+          ( resultDict['Version'], resultDict['NumberOfFiles'], resultDict['TotalSize'], resultDict['Checksum'],
+            refreshSQL )
+    req += "WHERE DatasetID=%d AND Version=%d" % ( datasetID, resultDict['Version'] - 1 )
+    result = self.db._update( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_OK( False )
+
+    for changeChunk in breakListIntoChunks( changes, 1000 ):
+      params = []
+      for fileID, lfn, size, added in changeChunk:
+        params += [ datasetID, resultDict['Version'], fileID, lfn, size, added ]
+      req = "INSERT INTO FC_MetaDatasetChanges (DatasetID,Version,FileID,LFN,Size,Added) VALUES %s" % \
+            ','.join( [ "(%s,%s,%s,%s,%s,%s)" ] * len( changeChunk ) )
+      result = self.db._update( req, params = params )
+      if not result['OK']:
+        return result
+      addedIDs = [ str( fileID ) for fileID, _lfn, _size, added in changeChunk if added ]
+      if addedIDs:
+        values = [ "(%d,%s)" % ( datasetID, fileID ) for fileID in addedIDs ]
+        req = "INSERT INTO FC_MetaDatasetFiles (DatasetID,FileID) VALUES %s" % ','.join( values )
+        result = self.db._update( req )
+        if not result['OK']:
+          return result
+      removedIDs = [ str( fileID ) for fileID, _lfn, _size, added in changeChunk if not added ]
+      if removedIDs:
+        req = "DELETE FROM FC_MetaDatasetFiles WHERE DatasetID=%d AND FileID IN (%s)" % ( datasetID, ','.join( removedIDs ) )
+        result = self.db._update( req )
+        if not result['OK']:
+          return result
+
+    req = "UPDATE FC_MetaDatasets SET NumberOfFiles=%d,TotalSize=%d,ModificationDate=UTC_TIMESTAMP() WHERE DatasetID=%d"
+    result = self.db._update( req % ( resultDict['NumberOfFiles'], resultDict['TotalSize'], datasetID ) )
+    if not result['OK']:
+      return result
+    return S_OK( True )
+
@@ -38,6 +38,8 @@ class DirectoryLevelTree(DirectoryTreeBase):
   for i in range( 1, MAX_LEVELS+1 ):
     _tables["FC_DirectoryLevelTree"]["Fields"]['LPATH%d' % i] = "SMALLINT NOT NULL DEFAULT 0"
   
+  supportsDirectoryCache = True
+
   def __init__(self,database=None):
     DirectoryTreeBase.__init__(self,database)
     self.treeTable = 'FC_DirectoryLevelTree'
@@ -51,8 +53,14 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """
     
     dpath = os.path.normpath( path )    
-    req = "SELECT DirID,Level from FC_DirectoryLevelTree WHERE DirName='%s'" % dpath
-    result = self.db._query(req,connection)
+    if self.dirCache:
+      cached = self.dirCache.get( 'Path', dpath )
+      if cached:
+        res = S_OK( cached[0] )
+        res['Level'] = cached[1]
+        return res
+    req = "SELECT DirID,Level from FC_DirectoryLevelTree WHERE DirName=%s"
+    result = self.db._query( req, connection, params = [ dpath ] )
     if not result['OK']:
       return result
     
@@ -61,19 +69,34 @@ class DirectoryLevelTree(DirectoryTreeBase):
     
     res = S_OK(result['Value'][0][0])  
     res['Level'] = result['Value'][0][1]
+    if self.dirCache:
+      self.dirCache.set( 'Path', dpath, ( res['Value'], res['Level'] ) )
     return res
   
   def findDirs( self, paths, connection=False ):
     """ Find DirIDs for the given path list
     """
-    dpaths = ','.join( [ "'"+os.path.normpath( path )+"'" for path in paths ] )
-    req = "SELECT DirName,DirID from FC_DirectoryLevelTree WHERE DirName in (%s)" % dpaths
-    result = self.db._query(req,connection)
+    dirDict = {}
+    toFind = [ os.path.normpath( path ) for path in paths ]
+    if self.dirCache:
+      notCached = []
+      for dpath in toFind:
+        cached = self.dirCache.get( 'Path', dpath )
+        if cached:
+          dirDict[dpath] = cached[0]
+        else:
+          notCached.append( dpath )
+      toFind = notCached
+    if not toFind:
+      return S_OK( dirDict )
+    req = "SELECT DirName,DirID,Level from FC_DirectoryLevelTree WHERE DirName in (%s)"
+    result = self.db._query( req, connection, params = [ toFind ] )
     if not result['OK']:
       return result
-    dirDict = {}
-    for dirName, dirID in result['Value']:
+    for dirName, dirID, level in result['Value']:
       dirDict[dirName] = dirID
+      if self.dirCache:
+        self.dirCache.set( 'Path', dirName, ( dirID, level ) )
 
     return S_OK( dirDict )
   
@@ -92,12 +115,20 @@ class DirectoryLevelTree(DirectoryTreeBase):
     dirID = result['Value']
     req = "DELETE FROM FC_DirectoryLevelTree WHERE DirID=%d" % dirID
     result = self.db._update(req)
+    if self.dirCache:
+      self.dirCache.removeDirectory( path, dirID )
     result['DirID'] = dirID
     return result
 
   def __getNumericPath(self,dirID,connection=False):
     """ Get the enumerated path of the given directory
     """
+    if self.dirCache:
+      cached = self.dirCache.get( 'NumericPath', dirID )
+      if cached:
+        result = S_OK( list( cached[0] ) )
+        result['Level'] = cached[1]
+        return result
     epathString = ','.join( [ 'LPATH%d' % (i+1) for i in range( MAX_LEVELS ) ] )
     req = 'SELECT LEVEL,%s FROM FC_DirectoryLevelTree WHERE DirID=%d' % (epathString,dirID)
     result = self.db._query(req,connection)
@@ -112,6 +143,8 @@ class DirectoryLevelTree(DirectoryTreeBase):
     for i in range(level):
       epathList.append(row[i+1])
       
+    if self.dirCache:
+      self.dirCache.set( 'NumericPath', dirID, ( tuple( epathList ), level ) )
     result = S_OK(epathList)
     result['Level'] = level   
     return result
@@ -248,6 +281,10 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def getDirectoryPath(self,dirID):
     """ Get directory name by directory ID
     """
+    if self.dirCache:
+      cached = self.dirCache.get( 'DirID', int( dirID ) )
+      if cached:
+        return S_OK( cached )
     req = "SELECT DirName FROM FC_DirectoryLevelTree WHERE DirID=%d" % int(dirID)
     result = self.db._query(req)
     if not result['OK']:
@@ -255,6 +292,8 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_ERROR('Directory with id %d not found' % int(dirID) )
     
+    if self.dirCache:
+      self.dirCache.set( 'DirID', int( dirID ), result['Value'][0][0] )
     return S_OK(result['Value'][0][0])
 
   def getDirectoryPaths(self,dirIDList):
@@ -297,6 +336,10 @@ class DirectoryLevelTree(DirectoryTreeBase):
         specified by its path
     """    
     
+    if self.dirCache:
+      cached = self.dirCache.get( 'PathIDs', path )
+      if cached:
+        return S_OK( list( cached ) )
     elements = path.split('/')
     pelements = []
     dPath = ''
@@ -313,7 +356,10 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_ERROR('Directory %s not found' % path)
        
-    return S_OK([ x[0] for x in result['Value'] ])
+    pathIDs = [ x[0] for x in result['Value'] ]
+    if self.dirCache:
+      self.dirCache.set( 'PathIDs', path, tuple( pathIDs ) )
+    return S_OK( pathIDs )
   
   def getPathIDsByID_old(self,dirID):
     """ Get IDs of all the directories in the parent hierarchy for a directory
@@ -332,6 +378,10 @@ class DirectoryLevelTree(DirectoryTreeBase):
     """ Get IDs of all the directories in the parent hierarchy for a directory
         specified by its ID
     """    
+    if self.dirCache:
+      cached = self.dirCache.get( 'PathIDsByID', dirID )
+      if cached:
+        return S_OK( list( cached ) )
     result = self.__getNumericPath( dirID )
     if not result['OK']:
       return result
@@ -352,7 +402,10 @@ class DirectoryLevelTree(DirectoryTreeBase):
     if not result['Value']:
       return S_ERROR( 'No result for the path of Directory with ID %d' % dirID )
 
-    return S_OK([ x[1] for x in result['Value'] ] + [dirID] )
+    pathIDs = [ x[1] for x in result['Value'] ] + [dirID]
+    if self.dirCache:
+      self.dirCache.set( 'PathIDsByID', dirID, tuple( pathIDs ) )
+    return S_OK( pathIDs )
     
   def getChildren(self,path,connection=False):
     """ Get child directory IDs for the given directory 
@@ -478,6 +531,11 @@ class DirectoryLevelTree(DirectoryTreeBase):
   def recoverOrphanDirectories( self, credDict ):
     """ Recover orphan directories
     """
+    # IDs and enumerated paths are about to change
+    self.treeVersion += 1
+    if self.dirCache:
+      self.dirCache.clear()
+    self.invalidateDirectoryPermissions()
     # Find out orphan directories
     treeTable = 'FC_DirectoryLevelTree'
     req = "SELECT DirID,Parent FROM %s WHERE Parent NOT IN ( SELECT DirID from %s )" % (treeTable,treeTable)
@@ -548,6 +606,9 @@ class DirectoryLevelTree(DirectoryTreeBase):
       result = self.__rebuildLevelIndexes( parentID, connection)
       self.db._query("UNLOCK TABLES", connection )       
       
+    if self.dirCache:
+      self.dirCache.clear()
+    self.invalidateDirectoryPermissions()
     return S_OK()
 
   def _getConnection( self, connection=False ):
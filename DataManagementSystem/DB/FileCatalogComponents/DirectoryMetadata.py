@@ -10,6 +10,7 @@ __RCSID__ = "$Id$"
 import os, types
 from DIRAC import S_OK, S_ERROR, gLogger
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities import queryTime
+from DIRAC.Core.Utilities.DictCache import DictCache
 
 class DirectoryMetadata:
 
@@ -47,6 +48,11 @@ class DirectoryMetadata:
     self.db = None
     if database is not None:
       self.setDatabase( database )
+    # Seconds the results of a metadata query are kept, 0 disables the cache
+    self.queryCacheTime = 0
+    self.__queryCache = DictCache()
+    # Incremented when metadata values or fields change
+    self.metaVersion = 0
 
   def setDatabase( self, database ):
     self.db = database
@@ -101,6 +107,7 @@ class DirectoryMetadata:
     if not result['OK']:
       return result
 
+    self.metaVersion += 1
     result = self.db._insert( 'FC_MetaFields', ['MetaName', 'MetaType'], [pname, ptype] )
     if not result['OK']:
       return result
@@ -116,6 +123,7 @@ class DirectoryMetadata:
     """ Remove metadata field
     """
 
+    self.metaVersion += 1
     req = "DROP TABLE FC_Meta_%s" % pname
     result = self.db._update( req )
     error = ''
@@ -241,6 +249,8 @@ class DirectoryMetadata:
     if not dirmeta['OK']:
       return dirmeta
 
+    self.metaVersion += 1
+
     for metaName, metaValue in metadict.items():
       if not metaName in metaFields:
         result = self.setMetaParameter( dpath, metaName, metaValue, credDict )
@@ -277,6 +287,7 @@ class DirectoryMetadata:
       return S_ERROR( 'Path not found: %s' % dpath )
     dirID = result['Value']
 
+    self.metaVersion += 1
     failedMeta = {}
     for meta in metadata:
       if meta in metaFields:
@@ -636,6 +647,16 @@ class DirectoryMetadata:
       return result
     metaDict = result['Value']
 
+    cacheKey = None
+    if self.queryCacheTime:
+      cacheKey = ( path, repr( sorted( metaDict.items() ) ) )
+      cached = self.__queryCache.get( cacheKey )
+      if cached and cached[0] == ( self.metaVersion, self.db.dtree.treeVersion ):
+        result = S_OK( list( cached[1] ) )
+        result['Selection'] = cached[2]
+        return result
+      queryVersion = ( self.metaVersion, self.db.dtree.treeVersion )
+
     # Now check the meta data for the requested directory and its parents
     finalMetaDict = dict( metaDict )
     for meta in metaDict.keys():
@@ -654,25 +675,32 @@ class DirectoryMetadata:
         if not result['OK']:
           return result
         pathSelection = result['Value']
-      dirList = []
-      first = True
-      for meta, value in finalMetaDict.items():
-        if value == "Missing":
-          result = self.__findSubdirMissingMeta( meta, pathSelection )
-        else:
-          result = self.__findSubdirByMeta( meta, value, pathSelection )
-        if not result['OK']:
-          return result
-        mList = result['Value']
-        if first:
-          dirList = mList
-          first = False
+      result = self.__planMetaQuery( finalMetaDict )
+      if not result['OK']:
+        return result
+      dirSet = None
+      for meta, value in result['Value']:
+        if value == "Missing" and dirSet is not None:
+          # Remove the candidates having the meta datum instead of listing all the others
+          result = self.__findSubdirByMeta( meta, 'Any', pathSelection )
+          if not result['OK']:
+            return result
+          dirSet.difference_update( result['Value'] )
         else:
-          newList = []
-          for d in dirList:
-            if d in mList:
-              newList.append( d )
-          dirList = newList
+          if value == "Missing":
+            result = self.__findSubdirMissingMeta( meta, pathSelection )
+          else:
+            result = self.__findSubdirByMeta( meta, value, pathSelection )
+          if not result['OK']:
+            return result
+          if dirSet is None:
+            dirSet = set( result['Value'] )
+          else:
+            dirSet.intersection_update( result['Value'] )
+        if not dirSet:
+          # No need to evaluate the rest
+          break
+      dirList = list( dirSet )
     else:
       if pathDirID:
         result = self.db.dtree.getSubdirectoriesByID( pathDirID, includeParent = True )
@@ -700,8 +728,36 @@ class DirectoryMetadata:
     else:
       result['Selection'] = 'All'
 
+    if cacheKey:
+      self.__queryCache.add( cacheKey, self.queryCacheTime, ( queryVersion, list( finalList ), result['Selection'] ) )
     return result
 
+  def __planMetaQuery( self, metaDict ):
+    """ Order the meta data constraints by the estimated number of matching
+        directories, so the most selective ones are evaluated first
+    """
+    if len( metaDict ) == 1:
+      return S_OK( metaDict.items() )
+    estimates = []
+    missing = []
+    for meta, value in metaDict.items():
+      if value == "Missing":
+        # Complement of the directories defining the meta datum, usually the largest set
+        missing.append( ( meta, value ) )
+        continue
+      result = self.__createMetaSelection( meta, value, "M." )
+      if not result['OK']:
+        return result
+      req = "SELECT COUNT(*) FROM FC_Meta_%s AS M" % meta
+      if result['Value']:
+        req += " WHERE %s" % result['Value']
+      result = self.db._query( req )
+      if not result['OK']:
+        return result
+      estimates.append( ( result['Value'][0][0], meta, value ) )
+    estimates.sort()
+    return S_OK( [ ( meta, value ) for _count, meta, value in estimates ] + missing )
+
   @queryTime
   def findDirectoriesByMetadata( self, queryDict, path, credDict ):
     """ Find Directory names satisfying the given metadata and being subdirectories of 
@@ -899,6 +955,7 @@ class DirectoryMetadata:
       dirs = [dirList]
 
     dirListString = ','.join( [ str( d ) for d in dirs ] )
+    self.metaVersion += 1
 
     # Get the list of metadata fields to inspect
     result = self.getMetadataFields( credDict )
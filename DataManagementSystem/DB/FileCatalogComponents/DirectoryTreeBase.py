@@ -7,12 +7,104 @@ __RCSID__ = "$Id$"
 
 from DIRAC.DataManagementSystem.DB.FileCatalogComponents.Utilities  import checkArgumentFormat
 from DIRAC                                                          import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities.List                                       import breakListIntoChunks
+from DIRAC.Core.Utilities.DictCache                                  import DictCache
 import time, threading, os
 from types import StringTypes, ListType
 import stat
 
 DEBUG = 0
 
+#############################################################################
+class DirectoryCache:
+  """ Bounded LRU cache of the directory tree lookups. Keys are ( kind, path or DirID ):
+        'Path'        : path -> ( DirID, Level )
+        'DirID'       : DirID -> path
+        'PathIDs'     : path -> IDs of the directory and its ancestors
+        'PathIDsByID' : DirID -> IDs of the directory and its ancestors
+        'NumericPath' : DirID -> ( enumerated path, Level )
+  """
+
+  def __init__( self, maxSize = 100000 ):
+    self.maxSize = max( 1, maxSize )
+    self.__lock = threading.Lock()
+    # key -> [ value, last use ]
+    self.__data = {}
+    self.__tick = 0
+    self.__hits = 0
+    self.__misses = 0
+
+  def get( self, kind, key ):
+    self.__lock.acquire()
+    try:
+      entry = self.__data.get( ( kind, key ) )
+      if entry is None:
+        self.__misses += 1
+        return None
+      self.__hits += 1
+      self.__tick += 1
+      entry[1] = self.__tick
+      return entry[0]
+    finally:
+      self.__lock.release()
+
+  def set( self, kind, key, value ):
+    self.__lock.acquire()
+    try:
+      self.__tick += 1
+      self.__data[ ( kind, key ) ] = [ value, self.__tick ]
+      if len( self.__data ) > self.maxSize:
+        self.__prune()
+    finally:
+      self.__lock.release()
+
+  def __prune( self ):
+    """ Drop the least recently used entries down to 90% of the size in one go,
+        so the sort is not done on every insertion
+    """
+    entries = sorted( self.__data.items(), key = lambda item: item[1][1] )
+    for key, _entry in entries[ : len( entries ) - self.maxSize * 9 / 10 ]:
+      del self.__data[ key ]
+
+  def removeDirectory( self, path, dirID ):
+    """ Forget a directory and anything below it
+    """
+    path = os.path.normpath( path )
+    prefix = path.rstrip( '/' ) + '/'
+    isBelow = lambda dirPath: dirPath == path or dirPath.startswith( prefix )
+    self.__lock.acquire()
+    try:
+      for key in self.__data.keys():
+        kind, keyValue = key
+        value = self.__data[ key ][0]
+        if kind in ( 'Path', 'PathIDs' ):
+          drop = isBelow( keyValue )
+        elif kind == 'DirID':
+          drop = keyValue == dirID or isBelow( value )
+        elif kind == 'PathIDsByID':
+          drop = dirID in value
+        else:
+          drop = keyValue == dirID
+        if drop:
+          del self.__data[ key ]
+    finally:
+      self.__lock.release()
+
+  def clear( self ):
+    self.__lock.acquire()
+    try:
+      self.__data = {}
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    lookups = self.__hits + self.__misses
+    hitRatio = 0.
+    if lookups:
+      hitRatio = 100. * self.__hits / lookups
+    return { 'Hits' : self.__hits, 'Misses' : self.__misses, 'HitRatio' : hitRatio,
+             'Size' : len( self.__data ), 'MaxSize' : self.maxSize }
+
 #############################################################################
 class DirectoryTreeBase:
 
@@ -43,12 +135,47 @@ class DirectoryTreeBase:
                                         "PrimaryKey": "DirID"
                                        }
   
+  # Tree implementations that keep their lookups in a DirectoryCache when enabled
+  supportsDirectoryCache = False
+
   def __init__( self, database = None ):
     self.db = None
     if database is not None:
       self.setDatabase( database )
     self.lock = threading.Lock()
     self.treeTable = ''
+    self.dirCache = None
+    # Incremented when directories are added or removed
+    self.treeVersion = 0
+    # Seconds the ( UID, GID, Mode ) of the directories are kept for the permission checks, 0 disables it
+    self.permissionCacheTime = 0
+    self.__permissionCache = DictCache()
+
+  def enableDirectoryCache( self, maxSize ):
+    """ Keep up to maxSize directory lookups in memory, 0 disables the cache
+    """
+    if maxSize <= 0:
+      self.dirCache = None
+      return S_OK()
+    if not self.supportsDirectoryCache:
+      return S_ERROR( '%s does not support the directory cache' % self.__class__.__name__ )
+    self.dirCache = DirectoryCache( maxSize )
+    return S_OK()
+
+  def invalidateDirectoryPermissions( self, dirID = None ):
+    """ Forget the cached ownership and mode of the given directory, or of all of them
+    """
+    if dirID is None:
+      self.__permissionCache.purgeAll()
+    else:
+      self.__permissionCache.delete( dirID )
+
+  def getDirectoryCacheStats( self ):
+    """ Get the hits, misses and size of the directory cache
+    """
+    if not self.dirCache:
+      return S_OK( {} )
+    return S_OK( self.dirCache.getStats() )
 
 ############################################################################
 #
@@ -166,6 +293,7 @@ class DirectoryTreeBase:
       return result
     dirID = result['Value']
     if result['NewDirectory']:
+      self.treeVersion += 1
       req = "INSERT INTO FC_DirectoryInfo (DirID,UID,GID,CreationDate,ModificationDate,Mode,Status) Values "
       req = req + "(%d,%d,%d,UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d,%d)" % ( dirID, l_uid, l_gid, self.db.umask, status )
       result = self.db._update( req )
@@ -329,6 +457,8 @@ class DirectoryTreeBase:
         failed[dir_] = 'Failed to remove non-empty directory'
         continue
       result = self.removeDir(dir_)
+      self.treeVersion += 1
+      self.invalidateDirectoryPermissions( dirDict[dir_] )
       if not result['OK']:
         failed[dir_] = result['Message']
       else: 
@@ -402,6 +532,7 @@ class DirectoryTreeBase:
     dirID = result['Value']
     req = "UPDATE FC_DirectoryInfo SET %s=%d WHERE DirID=%d" % ( pname, pvalue, dirID )
     result = self.db._update( req )
+    self.invalidateDirectoryPermissions( dirID )
     return result
 
 #####################################################################
@@ -546,14 +677,21 @@ class DirectoryTreeBase:
   def getPathPermissions( self, lfns, credDict ):
     """ Get permissions for the given user/group to manipulate the given lfns 
     """
+    result = self.db.ugManager.getUserAndGroupID( credDict )
+    if not result['OK']:
+      return result
+    uid, gid = result['Value']
+
     successful = {}
     failed = {}
+    # The permissions found for this request, many lfns share the same parent directories
+    requestCache = {}
     for path in lfns:
-      result = self.getDirectoryPermissions( path, credDict )
+      result = self.__getDirectoryPermissions( path, uid, gid, requestCache )
       if not result['OK']:
         failed[path] = result['Message']
       else:
-        successful[path] = result['Value']
+        successful[path] = dict( result['Value'] )
 
     return S_OK( {'Successful':successful, 'Failed':failed} )
 
@@ -566,7 +704,18 @@ class DirectoryTreeBase:
       return result
     uid, gid = result['Value']
 
-    result = self.getDirectoryParameters( path )
+    result = self.__getDirectoryPermissions( path, uid, gid, {} )
+    if not result['OK']:
+      return result
+    return S_OK( dict( result['Value'] ) )
+
+  def __getDirectoryPermissions( self, path, uid, gid, requestCache ):
+    """ Get the permissions of the uid/gid on the given directory, or on its nearest existing parent
+    """
+    if path in requestCache:
+      return requestCache[path]
+
+    result = self.__getDirectoryOwnership( path )
     if not result['OK']:
       if "not found" in result['Message'] or "not exist" in result['Message']:
         # If the directory does not exist, check the nearest parent for the permissions
@@ -576,17 +725,14 @@ class DirectoryTreeBase:
           resultDict['Write'] = True
           resultDict['Read'] = True 
           resultDict['Execute'] = True
-          return S_OK( resultDict )
+          result = S_OK( resultDict )
         else:
           pDir = os.path.dirname( path )
-          result = self.getDirectoryPermissions( pDir, credDict )
-          return result
-      else:
-        return result
+          result = self.__getDirectoryPermissions( pDir, uid, gid, requestCache )
+        requestCache[path] = result
+      return result
 
-    dUid = result['Value']['UID']
-    dGid = result['Value']['GID']
-    mode = result['Value']['Mode']
+    dUid, dGid, mode = result['Value']
 
     owner = uid == dUid
     group = gid == dGid
@@ -607,7 +753,41 @@ class DirectoryTreeBase:
                             or ( group and mode & stat.S_IXGRP > 0 )\
                             or mode & stat.S_IXOTH > 0
 
-    return S_OK( resultDict )
+    result = S_OK( resultDict )
+    requestCache[path] = result
+    return result
+
+  def __getDirectoryOwnership( self, path ):
+    """ Get the ( UID, GID, Mode ) of the given directory, from the permission cache if enabled
+    """
+    result = self.__getDirID( path )
+    if not result['OK']:
+      return result
+    dirID = result['Value']
+
+    if self.permissionCacheTime:
+      ownership = self.__permissionCache.get( dirID )
+      if ownership:
+        return S_OK( ownership )
+
+    result = self._getDirectoryOwnership( dirID )
+    if not result['OK']:
+      return result
+    ownership = result['Value']
+    if self.permissionCacheTime:
+      self.__permissionCache.add( dirID, self.permissionCacheTime, ownership )
+    return S_OK( ownership )
+
+  def _getDirectoryOwnership( self, dirID ):
+    """ Get the ( UID, GID, Mode ) of the given directory ID from the database
+    """
+    req = "SELECT UID,GID,Mode FROM FC_DirectoryInfo WHERE DirID=%d" % dirID
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'Directory not found' )
+    return S_OK( tuple( [ int( value ) for value in result['Value'][0] ] ) )
 
   def getFileIDsInDirectory( self, dirID, credDict, startItem = 1, maxItems = 25 ):
     """ Get file IDs for the given directory
@@ -697,20 +877,14 @@ class DirectoryTreeBase:
     result['LFNIDList'] = lfnIDList
     return result
 
-  def _getDirectoryContents( self, path, details = False ):
-    """ Get contents of a given directory
+  def __getSubdirectories( self, path, details = False ):
+    """ Get the subdirectories of a given directory, with their parameters if details are requested
     """
-    result = self.findDir( path )
-    if not result['OK']:
-      return result
-    directoryID = result['Value']
     directories = {}
-    links = {}
     result = self.getChildren( path )
     if not result['OK']:
       return result
 
-    # Get subdirectories
     dirIDList = result['Value']
     for dirID in dirIDList:
       result = self.getDirectoryPath( dirID )
@@ -725,6 +899,20 @@ class DirectoryTreeBase:
           directories[dirName] = result['Value']
       else:
         directories[dirName] = True
+    return S_OK( directories )
+
+  def _getDirectoryContents( self, path, details = False ):
+    """ Get contents of a given directory
+    """
+    result = self.findDir( path )
+    if not result['OK']:
+      return result
+    directoryID = result['Value']
+    links = {}
+    result = self.__getSubdirectories( path, details )
+    if not result['OK']:
+      return result
+    directories = result['Value']
     result = self.db.fileManager.getFilesInDirectory( directoryID, verbose = details )
     if not result['OK']:
       return result
@@ -737,6 +925,36 @@ class DirectoryTreeBase:
 
     return S_OK( pathDict )
 
+  def listDirectoryPage( self, path, verbose = False, lastFileID = 0, maxItems = 1000 ):
+    """ Get one page of the directory listing: at most maxItems files following lastFileID.
+        Subdirectories and datasets come with the first page ( lastFileID = 0 ) only.
+        The 'NextToken' of the result is the lastFileID to ask for next, 0 once the listing is complete
+    """
+    result = self.findDir( path )
+    if not result['OK']:
+      return result
+    directoryID = result['Value']
+    if not directoryID:
+      return S_ERROR( 'Directory %s not found' % path )
+    directories = {}
+    datasets = {}
+    if not lastFileID:
+      result = self.__getSubdirectories( path, verbose )
+      if not result['OK']:
+        return result
+      directories = result['Value']
+      result = self.db.datasetManager.getDatasetsInDirectory( directoryID, verbose = verbose )
+      if not result['OK']:
+        return result
+      datasets = result['Value']
+    result = self.db.fileManager.getFilesInDirectoryPage( directoryID, verbose = verbose,
+                                                          lastFileID = lastFileID, maxItems = maxItems )
+    if not result['OK']:
+      return result
+    pathDict = {'Files': result['Value'], 'SubDirs':directories, 'Links':{}, 'Datasets':datasets,
+                'NextToken': result['NextToken'] }
+    return S_OK( pathDict )
+
   def listDirectory( self, lfns, verbose = False ):
     """ Get the directory listing
     """
@@ -1205,6 +1423,84 @@ class DirectoryTreeBase:
 
     return S_OK( resultDict )
 
+  def checkDirectoryUsage( self, repair = False ):
+    """ Check the incrementally maintained FC_DirectoryUsage counters against the content of
+        FC_Files and FC_Replicas rolled up through the directory ancestors. Inconsistent counters
+        are returned as a list of ( DirID, SEID, SESize, SEFiles, expected SESize, expected SEFiles ),
+        SEID = 0 being the logical usage. With repair the difference is added to the counters, which
+        should be done when the catalog is not being written to
+    """
+    # The ancestors of all the directories are resolved up front, so that no other query
+    # is sent while the grouped sums are streamed
+    req = "SELECT DirID,Parent FROM %s" % self.getTreeTable()
+    result = self.db._query( req )
+    if not result['OK']:
+      return result
+    parents = dict( [ ( int( dirID ), int( parentID ) ) for dirID, parentID in result['Value'] ] )
+    pathIDs = {}
+
+    def getPathIDs( dirID ):
+      """ IDs of the directory and of its ancestors, None if the directory is not in the tree
+      """
+      if dirID not in pathIDs:
+        if dirID not in parents:
+          pathIDs[dirID] = None
+        elif parents[dirID] in parents:
+          parentPathIDs = getPathIDs( parents[dirID] )
+          pathIDs[dirID] = parentPathIDs + [ dirID ] if parentPathIDs is not None else None
+        else:
+          pathIDs[dirID] = [ dirID ]
+      return pathIDs[dirID]
+
+    expected = {}
+    # There is one row per directory and storage element, added up then dropped
+    leafQueries = [ "SELECT DirID,0,SUM(Size),COUNT(*) FROM FC_Files GROUP BY DirID",
+                    "SELECT F.DirID,R.SEID,SUM(F.Size),COUNT(*) FROM FC_Files as F, FC_Replicas as R " + \
+                    "WHERE F.FileID=R.FileID GROUP BY F.DirID,R.SEID" ]
+    for req in leafQueries:
+      for res in self.db._queryIter( req ):
+        if not res['OK']:
+          return res
+        for dirID, seID, size, files in res['Value']:
+          dirPathIDs = getPathIDs( int( dirID ) )
+          if dirPathIDs is None:
+            gLogger.warn( 'Directory usage check: no path for directory', dirID )
+            continue
+          for parentID in dirPathIDs:
+            usage = expected.setdefault( ( parentID, seID ), [0, 0] )
+            usage[0] += int( size or 0 )
+            usage[1] += int( files )
+
+    # The stored counters are compared as they are streamed
+    inconsistent = []
+    checked = len( expected )
+    req = "SELECT DirID,SEID,SESize,SEFiles FROM FC_DirectoryUsage"
+    for result in self.db._queryIter( req ):
+      if not result['OK']:
+        return result
+      for dirID, seID, size, files in result['Value']:
+        storedSize, storedFiles = int( size ), int( files )
+        expectedSize, expectedFiles = expected.pop( ( dirID, seID ), ( 0, 0 ) )
+        if ( storedSize, storedFiles ) != ( expectedSize, expectedFiles ):
+          inconsistent.append( ( dirID, seID, storedSize, storedFiles, expectedSize, expectedFiles ) )
+    for ( dirID, seID ), ( expectedSize, expectedFiles ) in expected.items():
+      inconsistent.append( ( dirID, seID, 0, 0, expectedSize, expectedFiles ) )
+
+    if repair and inconsistent:
+      insertTuples = [ '(%d,%d,%d,%d,UTC_TIMESTAMP())' % ( dirID, seID, expSize - size, expFiles - files )
+                       for dirID, seID, size, files, expSize, expFiles in inconsistent ]
+      for tupleChunk in breakListIntoChunks( insertTuples, 1000 ):
+        req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) VALUES %s" % ','.join( tupleChunk )
+        req += " ON DUPLICATE KEY UPDATE SESize=SESize+VALUES(SESize), SEFiles=SEFiles+VALUES(SEFiles), "
+        req += "LastUpdate=UTC_TIMESTAMP()"
+        result = self.db._update( req )
+        if not result['OK']:
+          return result
+
+    result = S_OK( inconsistent )
+    result['Checked'] = checked
+    return result
+
   def getDirectoryCounters( self, connection = False ):
     """ Get the total number of directories
     """
@@ -16,6 +16,8 @@ from types import StringTypes, ListType, TupleType
 
 class FileManager( FileManagerBase ):
 
+  bulkTransaction = True
+
   _tables = {}
   _tables['FC_Files'] = { "Fields": { 
                                      "FileID": "INT AUTO_INCREMENT",
@@ -145,13 +147,13 @@ class FileManager( FileManagerBase ):
     for dirIDs in breakListIntoChunks( directoryIDList, 1000 ):
 
       wheres = []
+      params = []
       for dirPath in dirIDs:
-        fileNames = dirDict[dirPath]
-        dirID = directoryIDs[dirPath]
-        wheres.append( "( DirID=%d AND FileName IN (%s) )" % (dirID, stringListToString(fileNames) ) )
+        wheres.append( "( DirID=%s AND FileName IN (%s) )" )
+        params += [ int( directoryIDs[dirPath] ), list( dirDict[dirPath] ) ]
 
       req = "SELECT FileName,DirID,FileID FROM FC_Files WHERE %s" % " OR ".join( wheres )
-      result = self.db._query(req,connection)
+      result = self.db._query( req, connection, params = params )
       if not result['OK']:
         return result
       for fileName, dirID, fileID in result['Value']:
@@ -173,18 +175,21 @@ class FileManager( FileManagerBase ):
     connection = self._getConnection(connection)
     # metadata can be any of ['FileID','Size','UID','GID','Status','Checksum','ChecksumType',
     # 'Type','CreationDate','ModificationDate','Mode']
-    req = "SELECT FileName,DirID,FileID,Size,UID,GID,Status FROM FC_Files WHERE DirID=%d" % (dirID)
+    req = "SELECT FileName,DirID,FileID,Size,UID,GID,Status FROM FC_Files WHERE DirID=%s"
+    params = [ int( dirID ) ]
     if not allStatus:
       statusIDs = []
       for status in self.db.visibleFileStatus:
         res = self._getStatusInt( status, connection=connection )
         if res['OK']:
-          statusIDs.append( res['Value'] )
+          statusIDs.append( int( res['Value'] ) )
       if statusIDs:
-        req = "%s AND Status IN (%s)" % (req,intListToString(statusIDs))
+        req = "%s AND Status IN (%%s)" % req
+        params.append( statusIDs )
     if fileNames:
-      req = "%s AND FileName IN (%s)" % (req,stringListToString(fileNames))
-    res = self.db._query(req,connection)
+      req = "%s AND FileName IN (%%s)" % req
+      params.append( list( fileNames ) )
+    res = self.db._query( req, connection, params = params )
     if not res['OK']:
       return res
     fileNameIDs = res['Value']
@@ -307,17 +312,18 @@ class FileManager( FileManagerBase ):
     if not res['OK']:
       return res
     # Get the fileIDs for the inserted files
-    res = self._findFiles(lfns.keys(),['FileID'],connection=connection)
+    res = self.__getInsertedFileIDs( lfns, connection = connection )
     if not res['OK']:
       for lfn in lfns.keys():
         failed[lfn] = 'Failed post insert check'
         lfns.pop(lfn)
     else:
-      failed.update(res['Value']['Failed'])
-      for lfn in res['Value']['Failed'].keys():
-        lfns.pop(lfn)
-      for lfn,fileDict in res['Value']['Successful'].items():
-        lfns[lfn]['FileID'] = fileDict['FileID']
+      for lfn in lfns.keys():
+        if lfn in res['Value']:
+          lfns[lfn]['FileID'] = res['Value'][lfn]
+        else:
+          failed[lfn] = 'No such file or directory'
+          lfns.pop(lfn)
     insertTuples = []
     toDelete = []
     for lfn in lfns.keys():
@@ -332,7 +338,7 @@ class FileManager( FileManagerBase ):
       insertTuples.append("(%d,'%s','%s','%s',UTC_TIMESTAMP(),UTC_TIMESTAMP(),%d)" % (fileID,guid,checksum,checksumtype,mode))
     if insertTuples:
       req = "INSERT INTO FC_FileInfo (FileID,GUID,Checksum,ChecksumType,CreationDate,ModificationDate,Mode) VALUES %s" % ','.join( insertTuples )
-      res = self.db._update(req)
+      res = self.db._update(req,connection)
       if not res['OK']:
         self._deleteFiles(toDelete,connection=connection)
         for lfn in lfns.keys():
@@ -346,6 +352,26 @@ class FileManager( FileManagerBase ):
           
     return S_OK({'Successful':lfns,'Failed':failed})
 
+  def __getInsertedFileIDs( self, lfns, connection = False ):
+    """ Get the FileIDs of the given just inserted files, whose DirIDs are known, in one pass
+    """
+    dirFiles = {}
+    for lfn in lfns:
+      dirFiles.setdefault( lfns[lfn]['DirID'], {} )[os.path.basename( lfn )] = lfn
+    fileIDs = {}
+    for dirIDs in breakListIntoChunks( dirFiles.keys(), 1000 ):
+      wheres = [ "( DirID=%d AND FileName IN (%s) )" % ( dirID, stringListToString( dirFiles[dirID].keys() ) )
+                 for dirID in dirIDs ]
+      req = "SELECT FileName,DirID,FileID FROM FC_Files WHERE %s" % " OR ".join( wheres )
+      res = self.db._query( req, connection )
+      if not res['OK']:
+        return res
+      for fileName, dirID, fileID in res['Value']:
+        lfn = dirFiles[dirID].get( fileName )
+        if lfn:
+          fileIDs[lfn] = fileID
+    return S_OK( fileIDs )
+
   def _getFileIDFromGUID(self,guid,connection=False):
     connection = self._getConnection(connection)
     if not guid:
@@ -5,7 +5,7 @@
 __RCSID__ = "$Id$"
 
 from DIRAC                                  import S_OK, S_ERROR, gLogger
-from DIRAC.Core.Utilities.List              import intListToString
+from DIRAC.Core.Utilities.List              import intListToString, breakListIntoChunks
 from DIRAC.Core.Utilities.Pfn               import pfnparse, pfnunparse
 
 import os, stat
@@ -13,6 +13,9 @@ from types import ListType, StringTypes, DictType
 
 class FileManagerBase( object ):
 
+  # Register the files, ancestors and replicas of an addFile batch in one transaction
+  bulkTransaction = False
+
   _base_tables = {}
   _base_tables['FC_FileAncestors'] = { "Fields":
                                      { 
@@ -312,8 +315,16 @@ class FileManagerBase( object ):
     if masterLfns:
       # Create the directories for the supplied files and store their IDs
       directories = self._getFileDirectories( masterLfns.keys() )
+      # Look up all the existing directories at once, only the missing ones are created
+      res = self.db.dtree.findDirs( directories.keys() )
+      existingDirs = {}
+      if res['OK']:
+        existingDirs = res['Value']
       for directory, fileNames in directories.items():
-        res = self.db.dtree.makeDirectories( directory, credDict )
+        if directory in existingDirs:
+          res = S_OK( existingDirs[directory] )
+        else:
+          res = self.db.dtree.makeDirectories( directory, credDict )
         if not res['OK']:
           for fileName in fileNames:
             lfn = os.path.join( directory, fileName )
@@ -336,10 +347,50 @@ class FileManagerBase( object ):
           else:
             masterLfns[lfn]['DirID'] = res['Value']
 
+    # The directories are created outside of the transaction: they are shared with the concurrent
+    # registrations and a directory created for a rolled back batch is harmless. The FC_DirectoryUsage
+    # rows of the ancestor directories updated in the transaction stay locked until it ends.
+    # A rollback undoes the new files and the extra replicas added to the existing ones
+    rollbackLfns = set( masterLfns ) | set( extraLfns )
+    inTransaction = False
+    if masterLfns and self.bulkTransaction:
+      res = self.db.transactionStart()
+      if res['OK']:
+        inTransaction = True
+      else:
+        gLogger.warn( "Failed to start the file registration transaction", res['Message'] )
+    try:
+      res = self.__registerFiles( masterLfns, extraLfns, uid, gid, successful, failed, inTransaction, connection )
+    except Exception:
+      if inTransaction:
+        self.db.transactionRollback()
+      raise
+    if inTransaction:
+      if res['OK']:
+        res = self.db.transactionCommit()
+      else:
+        self.db.transactionRollback()
+      if not res['OK']:
+        for lfn in rollbackLfns:
+          if lfn in successful or lfn not in failed:
+            successful.pop( lfn, None )
+            failed[lfn] = res['Message']
+    elif not res['OK']:
+      return res
+
+    return S_OK( {'Successful':successful, 'Failed':failed} )
+
+  def __registerFiles( self, masterLfns, extraLfns, uid, gid, successful, failed, inTransaction, connection ):
+    """ Insert the files, ancestors, master and extra replicas, filling the successful and failed
+        dictionaries. In a transaction the database errors are returned so that the whole batch is
+        rolled back, otherwise the files are purged one by one
+    """
     # If we still have files left to register
     if masterLfns:
       res = self._insertFiles( masterLfns, uid, gid, connection = connection )
       if not res['OK']:
+        if inTransaction:
+          return res
         for lfn in masterLfns.keys():
           failed[lfn] = res['Message']
           masterLfns.pop( lfn )
@@ -360,7 +411,7 @@ class FileManagerBase( object ):
       else:
         failed.update( res['Value']['Failed'] )
         for lfn, error in res['Value']['Failed'].items():
-          toPurge.append( masterLfns[lfn]['FileID'] )
+          toPurge.append( masterLfns.pop( lfn )['FileID'] )
       if toPurge:
         self._removeFileAncestors( toPurge, connection = connection )
         self._deleteFiles( toPurge, connection = connection )
@@ -370,6 +421,8 @@ class FileManagerBase( object ):
     if masterLfns:
       res = self._insertReplicas( masterLfns, master = True, connection = connection )
       toPurge = []
+      if not res['OK'] and inTransaction:
+        return res
       if not res['OK']:
         for lfn in masterLfns.keys():
           failed[lfn] = "Failed while registering replica"
@@ -389,10 +442,19 @@ class FileManagerBase( object ):
       if not lfn in successful:
         extraLfns.pop( lfn )
 
-    if extraLfns:
-      res = self._findFiles( extraLfns.keys(), ['FileID','DirID'], connection=connection )
+    # The IDs of the files just inserted are known, only the pre-existing files are looked up
+    toFind = []
+    for lfn in extraLfns:
+      if 'FileID' in masterLfns.get( lfn, {} ) and 'DirID' in masterLfns[lfn]:
+        extraLfns[lfn]['FileID'] = masterLfns[lfn]['FileID']
+        extraLfns[lfn]['DirID'] = masterLfns[lfn]['DirID']
+      else:
+        toFind.append( lfn )
+
+    if toFind:
+      res = self._findFiles( toFind, ['FileID','DirID'], connection=connection )
       if not res['OK']:
-        for lfn in lfns.keys():
+        for lfn in toFind:
           failed[lfn] = 'Failed while registering extra replicas'
           successful.pop( lfn )
           extraLfns.pop( lfn )
@@ -404,22 +466,34 @@ class FileManagerBase( object ):
         for lfn,fileDict in res['Value']['Successful'].items():
           extraLfns[lfn]['FileID'] = fileDict['FileID']
           extraLfns[lfn]['DirID'] = fileDict['DirID']
- 
-      if extraLfns:
-        res = self._insertReplicas( extraLfns, master = False, connection = connection )
-        if not res['OK']:
-          for lfn in extraLfns.keys():
-            failed[lfn] = "Failed while registering extra replicas"
-            successful.pop( lfn )
-        else:
-          newlyRegistered = res['Value']['Successful']
-          successful.update( newlyRegistered )
-          failed.update( res['Value']['Failed'] )
 
-    return S_OK( {'Successful':successful, 'Failed':failed} )
+    if extraLfns:
+      res = self._insertReplicas( extraLfns, master = False, connection = connection )
+      if not res['OK'] and inTransaction:
+        return res
+      if not res['OK']:
+        for lfn in extraLfns.keys():
+          failed[lfn] = "Failed while registering extra replicas"
+          successful.pop( lfn )
+      else:
+        newlyRegistered = res['Value']['Successful']
+        successful.update( newlyRegistered )
+        failed.update( res['Value']['Failed'] )
+
+    return S_OK()
 
   def _updateDirectoryUsage( self, directorySEDict, change, connection = False ):
+    """ Add ( change = '+' ) or subtract ( change = '-' ) the size and number of files of
+        directorySEDict { dirID : { seID : { 'Size' : size, 'Files' : files } } } to the usage
+        counters of the directories and of all their ancestors. The changes are first summed up
+        per ancestor and SE so that a bulk operation only costs a few statements. The rows are
+        always updated in the same order for concurrent transactions not to deadlock
+    """
     connection = self._getConnection( connection )
+    sign = 1
+    if change == '-':
+      sign = -1
+    usageDelta = {}
     for directoryID in directorySEDict.keys():
       result = self.db.dtree.getPathIDsByID( directoryID )
       if not result['OK']:
@@ -428,55 +502,93 @@ class FileManagerBase( object ):
       dirDict = directorySEDict[directoryID]
       for seID in dirDict.keys() :
         seDict = dirDict[seID]
-        files = seDict['Files']
-        size = seDict['Size']
-        insertTuples = []
         for dirID in parentIDs:
-          insertTuples.append( '(%d,%d,%d,%d,UTC_TIMESTAMP())' % ( dirID, seID, size, files ) )
-    
-        req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) "
-        req += "VALUES %s" % ','.join( insertTuples )
-        req += " ON DUPLICATE KEY UPDATE SESize=SESize%s%d, SEFiles=SEFiles%s%d, LastUpdate=UTC_TIMESTAMP() " \
-                                                           % ( change, size, change, files )
-        res = self.db._update( req )
-        if not res['OK']:
-          gLogger.warn( "Failed to update FC_DirectoryUsage", res['Message'] )
+          delta = usageDelta.setdefault( ( dirID, seID ), [0, 0] )
+          delta[0] += sign * seDict['Size']
+          delta[1] += sign * seDict['Files']
+
+    insertTuples = [ '(%d,%d,%d,%d,UTC_TIMESTAMP())' % ( dirID, seID, size, files )
+                     for ( dirID, seID ), ( size, files ) in sorted( usageDelta.items() ) if size or files ]
+    for tupleChunk in breakListIntoChunks( insertTuples, 1000 ):
+      req = "INSERT INTO FC_DirectoryUsage (DirID,SEID,SESize,SEFiles,LastUpdate) "
+      req += "VALUES %s" % ','.join( tupleChunk )
+      req += " ON DUPLICATE KEY UPDATE SESize=SESize+VALUES(SESize), SEFiles=SEFiles+VALUES(SEFiles), "
+      req += "LastUpdate=UTC_TIMESTAMP()"
+      res = self.db._update( req )
+      if not res['OK']:
+        gLogger.warn( "Failed to update FC_DirectoryUsage", res['Message'] )
     return S_OK()
-    
+
   def _populateFileAncestors( self, lfns, connection = False ):
+    """ Register the ancestors of the given files. The ancestors of the whole batch are resolved
+        together and inserted with one statement, the files are only inserted one by one to
+        tell which one failed if the bulk insertion fails
+    """
     connection = self._getConnection( connection )
     successful = {}
     failed = {}
+    lfnAncestors = {}
     for lfn, lfnDict in lfns.items():
-      originalFileID = lfnDict['FileID']
-      originalDepth = lfnDict.get( 'AncestorDepth', 1 )
       ancestors = lfnDict.get( 'Ancestors', [] )
       if type( ancestors ) == type( ' ' ):
         ancestors = [ancestors]
-      if lfn in ancestors:
-        ancestors.remove( lfn )
+      ancestors = [ ancestor for ancestor in ancestors if ancestor != lfn ]
       if not ancestors:
         successful[lfn] = True
         continue
-      res = self._findFiles( ancestors, connection = connection )
-      if res['Value']['Failed']:
+      lfnAncestors[lfn] = ancestors
+    if not lfnAncestors:
+      return S_OK( {'Successful':successful, 'Failed':failed} )
+
+    allAncestors = set()
+    for ancestors in lfnAncestors.values():
+      allAncestors.update( ancestors )
+    res = self._findFiles( list( allAncestors ), connection = connection )
+    if not res['OK']:
+      for lfn in lfnAncestors:
         failed[lfn] = "Failed to resolve ancestor files"
-        continue
-      ancestorIDs = res['Value']['Successful']
-      fileIDLFNs = {}
-      toInsert = {}
-      for ancestor in ancestorIDs.keys():
-        fileIDLFNs[ancestorIDs[ancestor]['FileID']] = ancestor
-        toInsert[ancestorIDs[ancestor]['FileID']] = originalDepth
-      res = self._getFileAncestors( fileIDLFNs.keys() )
+      return S_OK( {'Successful':successful, 'Failed':failed} )
+    ancestorIDs = dict( [ ( ancestor, fileDict['FileID'] ) for ancestor, fileDict in res['Value']['Successful'].items() ] )
+    fileIDAncestorDict = {}
+    if ancestorIDs:
+      res = self._getFileAncestors( ancestorIDs.values() )
       if not res['OK']:
-        failed[lfn] = "Failed to obtain all ancestors"
-        continue
+        for lfn in lfnAncestors:
+          failed[lfn] = "Failed to obtain all ancestors"
+        return S_OK( {'Successful':successful, 'Failed':failed} )
       fileIDAncestorDict = res['Value']
-      for fileIDDict in fileIDAncestorDict.values():
-        for ancestorID, relativeDepth in fileIDDict.items():
-          toInsert[ancestorID] = relativeDepth + originalDepth
-      res = self._insertFileAncestors( originalFileID, toInsert, connection = connection )
+
+    toInsert = {}
+    for lfn, ancestors in lfnAncestors.items():
+      if [ ancestor for ancestor in ancestors if not ancestor in ancestorIDs ]:
+        failed[lfn] = "Failed to resolve ancestor files"
+        continue
+      originalDepth = lfns[lfn].get( 'AncestorDepth', 1 )
+      ancestorDict = {}
+      for ancestor in ancestors:
+        ancestorDict[ancestorIDs[ancestor]] = originalDepth
+      for ancestor in ancestors:
+        for ancestorID, relativeDepth in fileIDAncestorDict.get( ancestorIDs[ancestor], {} ).items():
+          # An ancestor reachable through several paths is kept at its shortest distance
+          ancestorDict[ancestorID] = min( relativeDepth + originalDepth,
+                                          ancestorDict.get( ancestorID, relativeDepth + originalDepth ) )
+      toInsert[lfn] = ancestorDict
+
+    if not toInsert:
+      return S_OK( {'Successful':successful, 'Failed':failed} )
+    ancestorTuples = []
+    for lfn, ancestorDict in toInsert.items():
+      for ancestorID, depth in ancestorDict.items():
+        ancestorTuples.append( "(%d,%d,%d)" % ( lfns[lfn]['FileID'], ancestorID, depth ) )
+    req = "INSERT INTO FC_FileAncestors (FileID, AncestorID, AncestorDepth) VALUES %s" \
+                              % intListToString( ancestorTuples )
+    res = self.db._update( req, connection )
+    if res['OK']:
+      successful.update( dict.fromkeys( toInsert, True ) )
+      return S_OK( {'Successful':successful, 'Failed':failed} )
+
+    for lfn, ancestorDict in toInsert.items():
+      res = self._insertFileAncestors( lfns[lfn]['FileID'], ancestorDict, connection = connection )
       if not res['OK']:
         if "Duplicate" in res['Message']:
           failed[lfn] = "Failed to insert ancestor files: duplicate entry"
@@ -552,8 +664,47 @@ class FileManagerBase( object ):
       return result
     failed.update(result['Value']['Failed'])
     successful = result['Value']['Successful']
+
+    # Files registered earlier as descendents of these ones inherit the new ancestors
+    result = self._propagateFileAncestors( [ lfns[lfn]['FileID'] for lfn in successful ], connection = connection )
+    if not result['OK']:
+      for lfn in successful:
+        failed[lfn] = "Failed to update the ancestors of the descendents: %s" % result['Message']
+      successful = {}
     return S_OK({'Successful':successful,'Failed':failed})                                           
 
+  def _propagateFileAncestors( self, fileIDs, connection = False ):
+    """ Keep FC_FileAncestors transitively closed after ancestors were given to existing files:
+        each descendent of a file gets the ancestors of the file, at the sum of the two depths
+    """
+    if not fileIDs:
+      return S_OK()
+    connection = self._getConnection( connection )
+    res = self._getFileDescendents( fileIDs, [], connection = connection )
+    if not res['OK']:
+      return res
+    descendentDict = res['Value']
+    if not descendentDict:
+      return S_OK()
+    res = self._getFileAncestors( descendentDict.keys(), connection = connection )
+    if not res['OK']:
+      return res
+    ancestorDict = res['Value']
+
+    ancestorTuples = []
+    for fileID, descendents in descendentDict.items():
+      for descendentID, descendentDepth in descendents.items():
+        for ancestorID, ancestorDepth in ancestorDict.get( fileID, {} ).items():
+          if ancestorID != descendentID:
+            ancestorTuples.append( "(%d,%d,%d)" % ( descendentID, ancestorID, descendentDepth + ancestorDepth ) )
+    for tupleChunk in breakListIntoChunks( ancestorTuples, 1000 ):
+      req = "INSERT INTO FC_FileAncestors (FileID, AncestorID, AncestorDepth) VALUES %s" % ','.join( tupleChunk )
+      req += " ON DUPLICATE KEY UPDATE AncestorDepth=LEAST(AncestorDepth,VALUES(AncestorDepth))"
+      res = self.db._update( req, connection )
+      if not res['OK']:
+        return res
+    return S_OK()
+
   def _removeFileAncestors(self, fileIDs, connection = False ):
     """ Remove from the FC_FileAncestors the entries corresponding to the input files"""
     connection = self._getConnection( connection )
@@ -599,26 +750,28 @@ class FileManagerBase( object ):
     if not result['OK']:
       return result
    
-    failed = {}
-    successful = {}
     relDict = result['Value']
+    # All the relatives are resolved in one go, FC_FileAncestors holds them at every depth
+    relativeIDs = set()
+    for relatives in relDict.values():
+      relativeIDs.update( relatives )
+    relativeLFNs = {}
+    if relativeIDs:
+      result = self._getFileLFNs( list( relativeIDs ) )
+      if not result['OK']:
+        return result
+      relativeLFNs = result['Value']['Successful']
+
     for id_ in inputIDs:
-      if id_ in relDict:
-        aList = relDict[id_].keys()
-        result = self._getFileLFNs(aList)       
-        if not result['OK']:
-          failed[inputIDDict[id]] = "Failed to find %s" % relation    
+      resDict = {}
+      for aID, depth in relDict.get( id_, {} ).items():
+        if aID in relativeLFNs:
+          resDict[relativeLFNs[aID]] = depth
         else:
-          if result['Value']['Successful']:
-            resDict = {}
-            for aID in result['Value']['Successful']:        
-              resDict[ result['Value']['Successful'][aID] ] = relDict[id_][aID]         
-            successful[inputIDDict[id_]] = resDict
-          for aID in result['Value']['Failed']:
-            failed[inputIDDict[id_]] = "Failed to get the ancestor LFN"             
-      else:
-        successful[inputIDDict[id_]] = {}                                     
-      
+          failed[inputIDDict[id_]] = "Failed to get the %s LFN" % relation
+      if not inputIDDict[id_] in failed:
+        successful[inputIDDict[id_]] = resDict
+
     return S_OK({'Successful':successful,'Failed':failed})
     
   def getFileAncestors( self, lfns, depths, connection = False ):
@@ -1210,10 +1363,12 @@ class FileManagerBase( object ):
       return S_OK(self.statusDict[statusID])
     return S_OK('Unknown')
 
-  def getFilesInDirectory( self, dirID, verbose = False, connection = False ):
+  def getFilesInDirectory( self, dirID, verbose = False, connection = False, fileNames = None ):
     connection = self._getConnection( connection )
     files = {}
-    res = self._getDirectoryFiles( dirID, [], ['FileID', 'Size', 'GUID',
+    if fileNames is None:
+      fileNames = []
+    res = self._getDirectoryFiles( dirID, fileNames, ['FileID', 'Size', 'GUID',
                                                'Checksum', 'ChecksumType',
                                                'Type', 'UID',
                                                'GID', 'CreationDate',
@@ -1239,6 +1394,31 @@ class FileManagerBase( object ):
         
     return S_OK( files )
 
+  def getFilesInDirectoryPage( self, dirID, verbose = False, lastFileID = 0, maxItems = 1000, connection = False ):
+    """ Get at most maxItems files of the given directory, in FileID order, starting after lastFileID.
+        The 'NextToken' key of the result is the lastFileID of the next page, 0 when there are no more files
+    """
+    connection = self._getConnection( connection )
+    req = "SELECT FileID,FileName FROM FC_Files WHERE DirID=%d AND FileID>%d ORDER BY FileID LIMIT %d" % ( dirID,
+                                                                                                        lastFileID,
+                                                                                                        maxItems )
+    res = self.db._query( req, connection )
+    if not res['OK']:
+      return res
+    nextToken = 0
+    if len( res['Value'] ) == maxItems:
+      nextToken = res['Value'][-1][0]
+    fileNames = [ row[1] for row in res['Value'] ]
+    files = {}
+    if fileNames:
+      res = self.getFilesInDirectory( dirID, verbose = verbose, connection = connection, fileNames = fileNames )
+      if not res['OK']:
+        return res
+      files = res['Value']
+    result = S_OK( files )
+    result['NextToken'] = nextToken
+    return result
+
   def getDirectoryReplicas( self, dirID, path, allStatus = False, connection = False ):
     """ Get the replicas for all the Files in the given Directory
         :param DirID : ID of the directory
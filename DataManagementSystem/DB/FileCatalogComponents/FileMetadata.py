@@ -518,12 +518,13 @@ class FileMetadata:
     return S_OK( resultList )
 
 
-  def __findFilesByMetadata( self, metaDict, dirList, credDict ):
+  def __findFilesByMetadata( self, metaDict, dirList, credDict, lastFileID = 0, maxItems = 0 ):
     """ Find a list of file IDs meeting the metaDict requirements and belonging
-        to directories in dirList
+        to directories in dirList. If maxItems is given, get at most maxItems file IDs
+        following lastFileID in FileID order
     """
     # 1.- classify Metadata keys
-    storageElement = None
+    storageElements = []
     standardMetaDict = {}
     userMetaDict = {}
     leftJoinTables = []
@@ -585,9 +586,14 @@ class FileMetadata:
         condition = condition % table
       conditions.append( condition )
 
+    if maxItems:
+      conditions.append( "F.FileID > %d" % lastFileID )
+
     query += ' '.join( tables )
     if conditions:
       query += ' WHERE %s' % ' AND '.join( conditions )
+    if maxItems:
+      query += ' ORDER BY F.FileID LIMIT %d' % maxItems
 
     result = self.db._query( query )
     if not result['OK']:
@@ -603,6 +609,73 @@ class FileMetadata:
 
     return S_OK( fileList )
 
+  def findFilesByMetadataPage( self, metaDict, path, credDict, lastFileID = 0, maxItems = 1000 ):
+    """ Find at most maxItems LFNs satisfying the given metadata, in FileID order, following lastFileID.
+        The 'NextToken' of the result is the lastFileID to ask for next, 0 once all the files are found.
+        The 'LFNIDDict' of the result gives the LFN of each FileID found
+    """
+    result = self._getFileSelection( metaDict, path, credDict )
+    if not result['OK']:
+      return result
+    return self._findFilesBySelectionPage( result['Value'], credDict, lastFileID = lastFileID, maxItems = maxItems )
+
+  def _getFileSelection( self, metaDict, path, credDict ):
+    """ Get the ( dirList, dirFlag, fileMetaDict ) selection of the files satisfying the given metadata,
+        to be paged over with _findFilesBySelectionPage
+    """
+    if not path:
+      path = '/'
+
+    result = self.db.dmeta.findDirIDsByMetadata( metaDict, path, credDict )
+    if not result['OK']:
+      return result
+    dirList = result['Value']
+    dirFlag = result['Selection']
+
+    result = self.getFileMetadataFields( credDict )
+    if not result['OK']:
+      return result
+    fileMetaKeys = result['Value'].keys() + FILE_STANDARD_METAKEYS.keys()
+    fileMetaDict = dict( item for item in metaDict.items() if item[0] in fileMetaKeys )
+    return S_OK( ( dirList, dirFlag, fileMetaDict ) )
+
+  def _findFilesBySelectionPage( self, selection, credDict, lastFileID = 0, maxItems = 1000 ):
+    """ findFilesByMetadataPage for a selection given by _getFileSelection
+    """
+    dirList, dirFlag, fileMetaDict = selection
+    fileList = []
+    if dirFlag != 'None':
+      if dirFlag == 'All':
+        dirList = []
+      if fileMetaDict:
+        result = self.__findFilesByMetadata( fileMetaDict, dirList, credDict,
+                                             lastFileID = lastFileID, maxItems = maxItems )
+        if not result['OK']:
+          return result
+        fileList = result['Value']
+      elif dirList:
+        req = "SELECT FileID FROM FC_Files WHERE DirID IN ( %s ) AND FileID > %d ORDER BY FileID LIMIT %d"
+        result = self.db._query( req % ( intListToString( dirList ), lastFileID, maxItems ) )
+        if not result['OK']:
+          return result
+        fileList = [ row[0] for row in result['Value'] ]
+
+    lfnList = []
+    lfnDict = {}
+    if fileList:
+      result = self.db.fileManager._getFileLFNs( fileList )
+      if not result['OK']:
+        return result
+      lfnDict = result['Value']['Successful']
+      lfnList = [ lfnDict[fileID] for fileID in fileList if fileID in lfnDict ]
+
+    result = S_OK( lfnList )
+    result['LFNIDDict'] = lfnDict
+    result['NextToken'] = 0
+    if len( fileList ) == maxItems:
+      result['NextToken'] = fileList[-1]
+    return result
+
   @queryTime
   def findFilesByMetadata( self, metaDict, path, credDict, extra = False ):
     """ Find Files satisfying the given metadata
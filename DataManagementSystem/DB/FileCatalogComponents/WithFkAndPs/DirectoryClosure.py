@@ -515,6 +515,8 @@ class DirectoryClosure( DirectoryTreeBase ):
       if not affected:
         return S_ERROR( 'Directory does not exist: %s' % path )
 
+      # The stored procedure works on the path, we don't know the id of the directory here
+      self.invalidateDirectoryPermissions()
       return S_OK( affected )
 
 
@@ -524,6 +526,20 @@ class DirectoryClosure( DirectoryTreeBase ):
 
 
 
+  def _getDirectoryOwnership( self, dirID ):
+    """ Get the ( UID, GID, Mode ) of the given directory ID
+
+      :param dirID : the id of the directory
+
+      :returns S_OK( ( uid, gid, mode ) )
+    """
+    result = self.getDirectoryParameters( dirID )
+    if not result['OK']:
+      return result
+    dirDict = result['Value']
+    return S_OK( ( dirDict['UID'], dirDict['GID'], dirDict['Mode'] ) )
+
+
   def setDirectoryGroup( self, path, gname ):
     """ Set the directory owner
     """
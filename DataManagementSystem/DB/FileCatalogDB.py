@@ -96,6 +96,10 @@ class FileCatalogDB(DB):
     if not result['OK']:
       return result
     self.dtree = result['Value']
+    result = self.dtree.enableDirectoryCache( databaseConfig.get( 'DirectoryCacheSize', 0 ) )
+    if not result['OK']:
+      gLogger.warn( "Directory cache not enabled", result['Message'] )
+    self.dtree.permissionCacheTime = databaseConfig.get( 'PermissionCacheTime', 0 )
     
     result = self.__loadCatalogComponent( databaseConfig['FileManager'] )
     if not result['OK']:
@@ -111,6 +115,7 @@ class FileCatalogDB(DB):
     if not result['OK']:
       return result
     self.dmeta = result['Value']
+    self.dmeta.queryCacheTime = databaseConfig.get( 'MetaQueryCacheTime', 0 )
     
     result = self.__loadCatalogComponent( databaseConfig['FileMetadata'] )
     if not result['OK']:
@@ -426,6 +431,8 @@ class FileCatalogDB(DB):
     res = self.fileManager.setFileStatus( res['Value']['Successful'], credDict )
     if not res['OK']:
       return res
+    if res['Value']['Successful']:
+      self.__invalidateMaterializedDatasets()
     failed.update(res['Value']['Failed'])
     successful = res['Value']['Successful']
     return S_OK( {'Successful':successful,'Failed':failed} )
@@ -862,6 +869,23 @@ class FileCatalogDB(DB):
     successful = res['Value']['Successful']
     return S_OK( {'Successful':successful,'Failed':failed} )
   
+  def listDirectoryPage( self, path, credDict, verbose = False, lastFileID = 0, maxItems = 1000 ):
+    """
+        List one page of a directory
+        :param str path: directory to list
+        :param creDict credential
+        :param int lastFileID: token returned with the previous page, 0 for the first page
+        :param int maxItems: maximum number of files in the page
+
+        :return S_OK with a dictionary indexed "Files", "Datasets", "Subdirs", "Links" and "NextToken"
+    """
+    res = self._checkPathPermissions( 'Read', [path], credDict )
+    if not res['OK']:
+      return res
+    if res['Value']['Failed']:
+      return S_ERROR( res['Value']['Failed'].values()[0] )
+    return self.dtree.listDirectoryPage( path, verbose = verbose, lastFileID = lastFileID, maxItems = maxItems )
+
   def isDirectory(self,lfns,credDict):
     """
         Checks whether a list of LFNS are directories or not
@@ -946,6 +970,11 @@ class FileCatalogDB(DB):
     result = self.dtree._rebuildDirectoryUsage()
     return result
 
+  def checkDirectoryUsage( self, repair = False ):
+    """ Check the DirectoryUsage counters against the file and replica tables, optionally fix them
+    """
+    return self.dtree.checkDirectoryUsage( repair = repair )
+
   def repairCatalog( self, directoryFlag=True, credDict={} ):
     """ Repair catalog inconsistencies
     """
@@ -978,10 +1007,13 @@ class FileCatalogDB(DB):
       return S_ERROR('Failed to determine the path type')
     if result['Value']['Successful'][path]:
       # This is a directory
-      return self.dmeta.setMetadata(path,metadataDict,credDict)
+      result = self.dmeta.setMetadata(path,metadataDict,credDict)
     else:
       # This is a file      
-      return self.fmeta.setMetadata(path,metadataDict,credDict)      
+      result = self.fmeta.setMetadata(path,metadataDict,credDict)      
+    if result['OK']:
+      self.__invalidateMaterializedDatasets()
+    return result
     
   def setMetadataBulk( self, pathMetadataDict, credDict ):
     """  Add metadata for the given paths
@@ -1029,10 +1061,20 @@ class FileCatalogDB(DB):
       return S_ERROR('Failed to determine the path type')
     if result['Value']['Successful'][path]:
       # This is a directory
-      return self.dmeta.removeMetadata(path,metadata,credDict)
+      result = self.dmeta.removeMetadata(path,metadata,credDict)
     else:
       # This is a file      
-      return self.fmeta.removeMetadata(path,metadata,credDict)                                  
+      result = self.fmeta.removeMetadata(path,metadata,credDict)                                  
+    if result['OK']:
+      self.__invalidateMaterializedDatasets()
+    return result
+
+  def __invalidateMaterializedDatasets( self ):
+    """ The files of the materialized datasets have to be looked up again after metadata changes
+    """
+    result = self.datasetManager.invalidateMaterializedDatasets()
+    if not result['OK']:
+      gLogger.error( "Failed to invalidate the materialized datasets", result['Message'] )
     
   #######################################################################
   #
@@ -1064,6 +1106,14 @@ class FileCatalogDB(DB):
     counterDict.update(res['Value'])
     return S_OK(counterDict)
 
+  def getDirectoryCacheStats(self,credDict):
+    res = self._checkAdminPermission(credDict)
+    if not res['OK']:
+      return res
+    if not res['Value']:
+      return S_ERROR("Permission denied")
+    return self.dtree.getDirectoryCacheStats()
+
   ########################################################################
   #
   #  Security based methods
@@ -0,0 +1,103 @@
+########################################################################
+# $HeadURL $
+# File: FileCatalogBulkBenchmark.py
+########################################################################
+
+""" :mod: FileCatalogBulkBenchmark
+    ==============================
+
+    .. module: FileCatalogBulkBenchmark
+    :synopsis: file registration throughput of the FileCatalogDB
+
+    Registers files with two replicas and one ancestor in a local FileCatalogDB
+    (configured like for TestFileCatalogDB) with addFile batches of different sizes,
+    with and without the single transaction per batch, and removes them afterwards.
+
+    Usage: python FileCatalogBulkBenchmark.py [files] [filesPerDirectory]
+"""
+
+__RCSID__ = "$Id $"
+
+from DIRAC.Core.Base import Script
+Script.parseCommandLine()
+
+import sys
+import time
+from DIRAC.DataManagementSystem.DB.FileCatalogDB import FileCatalogDB
+from DIRAC.Core.Security.Properties import FC_MANAGEMENT
+
+DATABASE_CONFIG = { 'UserGroupManager'    : 'UserAndGroupManagerDB',
+                    'SEManager'           : 'SEManagerDB',
+                    'SecurityManager'     : 'NoSecurityManager',
+                    'DirectoryManager'    : 'DirectoryLevelTree',
+                    'FileManager'         : 'FileManager',
+                    'DirectoryMetadata'   : 'DirectoryMetadata',
+                    'FileMetadata'        : 'FileMetadata',
+                    'DatasetManager'      : 'DatasetManager',
+                    'UniqueGUID'          : False,
+                    'GlobalReadAccess'    : True,
+                    'LFNPFNConvention'    : 'Strong',
+                    'ResolvePFN'          : True,
+                    'DefaultUmask'        : 0775,
+                    'ValidFileStatus'     : ['AprioriGood', 'Trash', 'Removing', 'Probing'],
+                    'ValidReplicaStatus'  : ['AprioriGood', 'Trash', 'Removing', 'Probing'],
+                    'VisibleFileStatus'   : ['AprioriGood'],
+                    'VisibleReplicaStatus': ['AprioriGood'] }
+
+credDict = { 'DN': '/DC=ch/DC=cern/OU=computers/CN=benchmark.cern.ch',
+             'group': 'visitor',
+             'username': 'anonymous',
+             'properties': [FC_MANAGEMENT] }
+
+baseDir = '/benchmark/bulk'
+
+def makeLfns( run, files, filesPerDirectory ):
+  lfns = {}
+  for i in range( files ):
+    lfn = '%s/run%d/d%d/f%d' % ( baseDir, run, i / filesPerDirectory, i )
+    lfns[lfn] = { 'PFN': lfn, 'SE': [ 'BenchmarkSE-1', 'BenchmarkSE-2' ], 'Size': 1000 + i,
+                  'GUID': 'bench-%d-%d' % ( run, i ), 'Checksum': '0' }
+    if i:
+      lfns[lfn]['Ancestors'] = [ '%s/run%d/d0/f0' % ( baseDir, run ) ]
+  return lfns
+
+def runBenchmark( db, run, files, filesPerDirectory, batchSize, transaction ):
+  db.fileManager.bulkTransaction = transaction
+  lfns = makeLfns( run, files, filesPerDirectory )
+  lfnList = sorted( lfns )
+  # The ancestor of all the files goes first
+  lfnList.remove( '%s/run%d/d0/f0' % ( baseDir, run ) )
+  lfnList.insert( 0, '%s/run%d/d0/f0' % ( baseDir, run ) )
+  errors = 0
+  start = time.time()
+  for i in range( 0, len( lfnList ), batchSize ):
+    batch = dict( [ ( lfn, lfns[lfn] ) for lfn in lfnList[i:i + batchSize] ] )
+    result = db.addFile( batch, credDict )
+    if not result['OK']:
+      errors += len( batch )
+    else:
+      errors += len( result['Value']['Failed'] )
+  elapsed = time.time() - start
+  print "batch %5d transaction %-5s: %6d files in %7.2f s, %8.1f files/s, %d failed" % ( batchSize, transaction,
+                                                                                        files, elapsed,
+                                                                                        files / elapsed, errors )
+  for lfnChunk in [ lfnList[i:i + 1000] for i in range( 0, len( lfnList ), 1000 ) ]:
+    db.removeFile( lfnChunk, credDict )
+
+if __name__ == "__main__":
+  files = 10000
+  filesPerDirectory = 500
+  if len( sys.argv ) > 1:
+    files = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    filesPerDirectory = int( sys.argv[2] )
+  db = FileCatalogDB()
+  db.setConfig( DATABASE_CONFIG )
+  run = int( time.time() )
+  for batchSize in ( 1, 100, 1000 ):
+    for transaction in ( False, True ):
+      run += 1
+      if batchSize == 1 and files > 1000:
+        runBenchmark( db, run, 1000, filesPerDirectory, batchSize, transaction )
+      else:
+        runBenchmark( db, run, files, filesPerDirectory, batchSize, transaction )
@@ -20,14 +20,17 @@ from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC import gLogger, S_OK, S_ERROR, gMonitor
 from DIRAC.DataManagementSystem.DB.FileCatalogDB import FileCatalogDB
 from DIRAC.Core.Utilities.List import sortList
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 
 # This is a global instance of the FileCatalogDB class
 gFileCatalogDB = None
+gMaxPageSize = 10000
 
 def initializeFileCatalogHandler( serviceInfo ):
   """ handler initialisation """
 
   global gFileCatalogDB
+  global gMaxPageSize
 
   dbLocation = getServiceOption( serviceInfo, 'Database', 'DataManagement/FileCatalogDB' )
   gFileCatalogDB = FileCatalogDB( dbLocation )
@@ -59,13 +62,23 @@ def initializeFileCatalogHandler( serviceInfo ):
                     'ValidFileStatus'     : ['AprioriGood','Trash','Removing','Probing'],
                     'ValidReplicaStatus'  : ['AprioriGood','Trash','Removing','Probing'],
                     'VisibleFileStatus'   : ['AprioriGood'],
-                    'VisibleReplicaStatus': ['AprioriGood']}
+                    'VisibleReplicaStatus': ['AprioriGood'],
+                    'DirectoryCacheSize'  : 0,
+                    'PermissionCacheTime' : 0,
+                    'MetaQueryCacheTime'  : 0 }
   for configKey in sortList( defaultConfig.keys() ):
     defaultValue = defaultConfig[configKey]
     configValue = getServiceOption( serviceInfo, configKey, defaultValue )
     gLogger.info( "%-20s : %-20s" % ( str( configKey ), str( configValue ) ) )
     databaseConfig[configKey] = configValue
   res = gFileCatalogDB.setConfig( databaseConfig )
+  # Upper limit of the page size of the paged listDirectory and findFilesByMetadata
+  gMaxPageSize = getServiceOption( serviceInfo, 'MaxPageSize', gMaxPageSize )
+
+  # Periodic consistency check of the incrementally maintained directory usage
+  usageCheckPeriod = getServiceOption( serviceInfo, 'DirectoryUsageCheckPeriod', 0 )
+  if usageCheckPeriod > 0:
+    gThreadScheduler.addPeriodicTask( usageCheckPeriod, checkDirectoryUsage )
 
   gMonitor.registerActivity( "AddFile", "Amount of addFile calls",
                                "FileCatalogHandler", "calls/min", gMonitor.OP_SUM )
@@ -103,6 +116,17 @@ def initializeFileCatalogHandler( serviceInfo ):
 
   return res
 
+def checkDirectoryUsage():
+  """ Report the directory usage counters not matching the file and replica tables """
+  result = gFileCatalogDB.checkDirectoryUsage()
+  if not result['OK']:
+    gLogger.error( "Failed to check the directory usage", result['Message'] )
+    return
+  gLogger.info( "Directory usage check: %d counters, %d inconsistent" % ( result['Checked'], len( result['Value'] ) ) )
+  for dirID, seID, size, files, expSize, expFiles in result['Value']:
+    gLogger.warn( "Inconsistent directory usage", "DirID %s SEID %s: %s bytes %s files, expected %s bytes %s files" % \
+                  ( dirID, seID, size, files, expSize, expFiles ) )
+
 class FileCatalogHandler( RequestHandler ):
   """
   ..class:: FileCatalogHandler
@@ -353,6 +377,17 @@ class FileCatalogHandler( RequestHandler ):
     gMonitor.addMark( 'ListDirectory', 1 )
     return gFileCatalogDB.listDirectory( lfns, self.getRemoteCredentials(), verbose = verbose )
 
+  types_listDirectoryPage = [ StringTypes, BooleanType, [ IntType, LongType ], [ IntType, LongType ] ]
+  def export_listDirectoryPage( self, path, verbose, token, pageSize ):
+    """ List at most pageSize files of the supplied directory, starting from the token
+        returned with the previous page ( 0 for the first page ). The returned 'NextToken'
+        is 0 once the listing is complete
+    """
+    gMonitor.addMark( 'ListDirectory', 1 )
+    pageSize = max( 1, min( pageSize, gMaxPageSize ) )
+    return gFileCatalogDB.listDirectoryPage( path, self.getRemoteCredentials(), verbose = verbose,
+                                             lastFileID = token, maxItems = pageSize )
+
   types_isDirectory = [ [ ListType, DictType ] + list( StringTypes ) ]
   def export_isDirectory( self, lfns ):
     """ Determine whether supplied path is a directory """
@@ -383,12 +418,26 @@ class FileCatalogHandler( RequestHandler ):
     """ Get the number of registered directories, files and replicas in various tables """
     return gFileCatalogDB.getCatalogCounters( self.getRemoteCredentials() )
 
+  types_getDirectoryCacheStats = []
+  def export_getDirectoryCacheStats( self ):
+    """ Get the hits, misses and size of the directory lookup cache """
+    return gFileCatalogDB.getDirectoryCacheStats( self.getRemoteCredentials() )
+
   types_rebuildDirectoryUsage = []
   @staticmethod
   def export_rebuildDirectoryUsage():
     """ Rebuild DirectoryUsage table from scratch """
     return gFileCatalogDB.rebuildDirectoryUsage()
 
+  types_checkDirectoryUsage = [ BooleanType ]
+  @staticmethod
+  def export_checkDirectoryUsage( repair ):
+    """ Check the DirectoryUsage table against the files and replicas, fix it if repair is set """
+    result = gFileCatalogDB.checkDirectoryUsage( repair = repair )
+    if not result['OK']:
+      return result
+    return S_OK( { 'Checked' : result['Checked'], 'Inconsistent' : result['Value'] } )
+
   types_repairCatalog = []
   def export_repairCatalog( self ):
     """ Repair the catalog inconsistencies """
@@ -480,6 +529,19 @@ class FileCatalogHandler( RequestHandler ):
     """
     return gFileCatalogDB.fmeta.findFilesByMetadata( metaDict, path, self.getRemoteCredentials() )
 
+  types_findFilesByMetadataPage = [ DictType, StringTypes, [ IntType, LongType ], [ IntType, LongType ] ]
+  def export_findFilesByMetadataPage( self, metaDict, path, token, pageSize ):
+    """ Find at most pageSize files satisfying the given metadata set, starting from the token
+        returned with the previous page ( 0 for the first page ). The returned 'NextToken'
+        is 0 once all the files are found
+    """
+    pageSize = max( 1, min( pageSize, gMaxPageSize ) )
+    result = gFileCatalogDB.fmeta.findFilesByMetadataPage( metaDict, path, self.getRemoteCredentials(),
+                                                           lastFileID = token, maxItems = pageSize )
+    if not result['OK']:
+      return result
+    return S_OK( { 'LFNs' : result['Value'], 'NextToken' : result['NextToken'] } )
+
   types_getReplicasByMetadata = [ DictType, StringTypes, BooleanType ]
   def export_getReplicasByMetadata( self, metaDict, path = '/', allStatus = False ):
     """ Find all the files satisfying the given metadata set
@@ -648,3 +710,21 @@ class FileCatalogHandler( RequestHandler ):
     """ Get lfns in the given dataset
     """
     return gFileCatalogDB.datasetManager.getDatasetFiles( datasetName, self.getRemoteCredentials() )
+
+  types_materializeDataset = [ StringTypes ]
+  def export_materializeDataset( self, datasetName ):
+    """ Store the files of the dynamic dataset and keep them up to date incrementally
+    """
+    return gFileCatalogDB.datasetManager.materializeDataset( datasetName, self.getRemoteCredentials() )
+
+  types_refreshDataset = [ StringTypes ]
+  def export_refreshDataset( self, datasetName, full = False ):
+    """ Update the stored files of the materialized dataset, evaluating the whole query if full is set
+    """
+    return gFileCatalogDB.datasetManager.refreshDataset( datasetName, self.getRemoteCredentials(), full = full )
+
+  types_getDatasetChanges = [ StringTypes, [ IntType, LongType ] ]
+  def export_getDatasetChanges( self, datasetName, version ):
+    """ Get the lfns added to and removed from the materialized dataset since the given version
+    """
+    return gFileCatalogDB.datasetManager.getDatasetChanges( datasetName, version, self.getRemoteCredentials() )
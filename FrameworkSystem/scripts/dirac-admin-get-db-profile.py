@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL$
+# File :    dirac-admin-get-db-profile
+########################################################################
+"""
+  Print the profile of the database statements executed by DIRAC services
+"""
+__RCSID__ = "$Id$"
+import DIRAC
+from DIRAC.Core.Base import Script
+
+sortBy = 'Total'
+limit = 20
+width = 100
+reset = False
+
+Script.registerSwitch( "s:", "sort=", "Sort by Total, Count, Mean, P50, P99, Max or Rows (default Total)" )
+Script.registerSwitch( "n:", "limit=", "Number of statements to print per service (default 20, 0 for all)" )
+Script.registerSwitch( "w:", "width=", "Maximum width of the statement fingerprints (default 100)" )
+Script.registerSwitch( "r", "reset", "Reset the profile of the services after printing it" )
+Script.setUsageMessage( '\n'.join( [ __doc__.split( '\n' )[1],
+                                     'Usage:',
+                                     '  %s [option|cfgfile] ... Service ...' % Script.scriptName,
+                                     'Arguments:',
+                                     '  Service:  Name of the service, as System/Component (e.g. WorkloadManagement/JobMonitoring)' ] ) )
+Script.parseCommandLine( ignoreErrors = False )
+for switch in Script.getUnprocessedSwitches():
+  if switch[0] in ( 's', 'sort' ):
+    sortBy = switch[1]
+  elif switch[0] in ( 'n', 'limit' ):
+    limit = int( switch[1] )
+  elif switch[0] in ( 'w', 'width' ):
+    width = int( switch[1] )
+  elif switch[0] in ( 'r', 'reset' ):
+    reset = True
+
+args = Script.getPositionalArgs()
+if not args:
+  Script.showHelp()
+  DIRAC.exit( 1 )
+
+from DIRAC.Core.DISET.RPCClient import RPCClient
+
+fields = ( 'Count', 'Total', 'Mean', 'P50', 'P99', 'Max', 'Rows' )
+exitCode = 0
+for service in args:
+  rpcClient = RPCClient( service )
+  result = rpcClient.getDBProfile( sortBy, limit )
+  if not result['OK']:
+    print "ERROR: %s: %s" % ( service, result['Message'] )
+    exitCode = 2
+    continue
+  print "%s: %d statements" % ( service, len( result['Value'] ) )
+  print "%8s %10s %9s %9s %9s %9s %10s  %s" % ( fields + ( 'DB / Component / Statement', ) )
+  for record in result['Value']:
+    fingerprint = record['Fingerprint']
+    if width and len( fingerprint ) > width:
+      fingerprint = fingerprint[:width - 3] + '...'
+    print "%8d %10.3f %9.4f %9.4f %9.4f %9.4f %10d  %s %s" % ( tuple( [ record[field] for field in fields ] ) +
+                                                              ( record['DB'], record['Component'] ) )
+    print "%s  %s" % ( ' ' * 72, fingerprint )
+  if reset:
+    result = rpcClient.resetDBProfile()
+    if not result['OK']:
+      print "ERROR: %s: %s" % ( service, result['Message'] )
+      exitCode = 2
+  print
+
+DIRAC.exit( exitCode )
@@ -17,11 +17,13 @@ import random
 import datetime
 
 # # from DIRAC
-from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC import S_OK, S_ERROR, gLogger, gConfig
 from DIRAC.RequestManagementSystem.Client.Request import Request
 from DIRAC.RequestManagementSystem.Client.Operation import Operation
 from DIRAC.RequestManagementSystem.Client.File import File
 from DIRAC.ConfigurationSystem.Client.Utilities import getDBParameters
+from DIRAC.ConfigurationSystem.Client.PathFinder import getDatabaseSection
+from DIRAC.Core.Utilities.MySQL import MySQL, ReadReplica
 
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import relationship, backref, sessionmaker, joinedload_all, mapper
@@ -160,6 +162,10 @@ class RequestDB( object ):
     self.dbUser = dbParameters[ 'User' ]
     self.dbPass = dbParameters[ 'Password' ]
     self.dbName = dbParameters[ 'DBName' ]
+    self.dbReplicas = dbParameters.get( 'Replicas', [] )
+    cs_path = getDatabaseSection( fullname )
+    self.replicaMaxLag = gConfig.getValue( '%s/ReplicaMaxLag' % cs_path, 30 )
+    self.replicaCheckPeriod = gConfig.getValue( '%s/ReplicaCheckPeriod' % cs_path, 60 )
 
 
   def __init__( self, systemInstance = 'Default' ):
@@ -182,6 +188,27 @@ class RequestDB( object ):
 
     self.DBSession = sessionmaker( bind = self.engine )
 
+    # Read replicas for the web summaries, with their lag checked like the MySQL class does
+    self.readReplicas = []
+    for host, port in self.dbReplicas:
+      connectionPool = MySQL.ConnectionPool( str( host ), self.dbUser, self.dbPass, int( port ),
+                                             retryDelay = 0, connectTimeout = 5 )
+      replica = ReadReplica( connectionPool, host, port, self.replicaMaxLag, self.replicaCheckPeriod )
+      engine = create_engine( 'mysql://%s:%s@%s:%s/%s' % ( self.dbUser, self.dbPass, host, port, self.dbName ),
+                              echo = runDebug )
+      self.readReplicas.append( ( replica, sessionmaker( bind = engine ) ) )
+
+  def __getReadSession( self ):
+    """ Get a session on an available read replica, or on the primary if there is none,
+        as ( replica, session ), replica being None for the primary
+    """
+    available = [ ( replica, replicaSession ) for replica, replicaSession in self.readReplicas
+                  if replica.isAvailable( self.dbName ) ]
+    if not available:
+      return None, self.DBSession()
+    replica, replicaSession = random.choice( available )
+    return replica, replicaSession()
+
 
   def createTables( self, toCreate = None, force = False ):
     """ create tables """
@@ -562,7 +589,8 @@ class RequestDB( object ):
 
     resultDict = {}
 
-    session = self.DBSession()
+    # The web summary can be a few seconds old, it is read from a replica if there is one
+    replica, session = self.__getReadSession()
 
     try:
       summaryQuery = session.query( Request.RequestID, Request.RequestName,
@@ -605,6 +633,11 @@ class RequestDB( object ):
         
         return S_OK( resultDict )
       except Exception, e:
+        if replica:
+          # Try again without this replica
+          replica.setUnavailable( str( e ) )
+          session.close()
+          return self.getRequestSummaryWeb( selectDict, sortList, startItem, maxItems )
         return S_ERROR( 'Error getting the webSummary %s' % e )
 
       nRequests = len( requestLists )
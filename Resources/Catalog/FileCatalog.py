@@ -2,14 +2,34 @@
     It ensures that all operations are performed on the desired catalogs.
 """
 
-import types, re
+import types, re, threading
 
 from DIRAC  import gLogger, gConfig, S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations    import Operations
 from DIRAC.Core.Security.ProxyInfo                          import getVOfromProxyGroup
+from DIRAC.Core.DISET.ThreadConfig                          import ThreadConfig
+from DIRAC.Core.Utilities.ThreadPool                        import ThreadPool
 from DIRAC.Resources.Utilities                              import checkArgumentFormat
 from DIRAC.Resources.Catalog.FileCatalogFactory             import FileCatalogFactory
 from DIRAC.ConfigurationSystem.Client.Helpers.Resources     import Resources
+from DIRAC.Resources.Catalog.ReplicaCache                   import getReplicaCache
+
+# Threads shared by the FileCatalog objects of the process to call several catalogs at once
+gCatalogThreadPool = None
+gCatalogThreadPoolLock = threading.Lock()
+
+def getCatalogThreadPool( numThreads ):
+  """ Get the thread pool of the process for the concurrent catalog calls, created
+      with numThreads threads by the first call
+  """
+  global gCatalogThreadPool
+  gCatalogThreadPoolLock.acquire()
+  try:
+    if gCatalogThreadPool is None:
+      gCatalogThreadPool = ThreadPool( numThreads, numThreads )
+    return gCatalogThreadPool
+  finally:
+    gCatalogThreadPoolLock.release()
 
 class FileCatalog( object ):
 
@@ -35,9 +55,16 @@ class FileCatalog( object ):
 
   write_methods += write_meta_methods
 
+  # Write methods after which the cached replicas of the LFNs are no longer valid
+  replica_write_methods = ['addFile', 'addReplica', 'removeReplica', 'removeFile', 'setReplicaStatus',
+                           'setReplicaHost', 'setReplicaProblematic']
+
   def __init__( self, catalogs = None, vo = None ):
     """ Default constructor
     """
+    self.replicaCache = getReplicaCache()
+    # Number of catalogs called at the same time, 1 calls them one after the other
+    self.maxParallelCalls = 1
     self.valid = True
     self.timeout = 180
     self.readCatalogs = []
@@ -47,6 +74,7 @@ class FileCatalog( object ):
     if self.vo:
       self.opHelper = Operations( vo = self.vo )
       self.reHelper = Resources( vo = self.vo ) 
+      self.maxParallelCalls = self.opHelper.getValue( '/Services/Catalogs/MaxParallelCalls', 1 )
       
       if catalogs is None:
         catalogList = []
@@ -79,6 +107,13 @@ class FileCatalog( object ):
   def getWriteCatalogs( self ):
     return self.writeCatalogs
 
+  def getReplicaCacheStats( self ):
+    """ Get the hits, misses and size of the replica cache of the process
+    """
+    if not self.replicaCache:
+      return S_ERROR( "Replica cache is not enabled" )
+    return S_OK( self.replicaCache.getStats() )
+
   def getMasterCatalogNames( self ):
     """ Returns the list of names of the Master catalogs """
 
@@ -98,6 +133,22 @@ class FileCatalog( object ):
   def w_execute( self, *parms, **kws ):
     """ Write method executor.
     """
+    if not self.replicaCache or not self.call in FileCatalog.replica_write_methods:
+      return self.__writeToCatalogs( *parms, **kws )
+    res = checkArgumentFormat( parms[0] )
+    if not res['OK']:
+      return res
+    lfns = res['Value'].keys()
+    # Before, so that the reads in progress don't keep the old replicas, and after for the reads done meanwhile
+    self.replicaCache.invalidate( lfns )
+    try:
+      return self.__writeToCatalogs( *parms, **kws )
+    finally:
+      self.replicaCache.invalidate( lfns )
+
+  def __writeToCatalogs( self, *parms, **kws ):
+    """ Execute the write method on the write catalogs
+    """
     successful = {}
     failed = {}
     failedCatalogs = []
@@ -109,39 +160,58 @@ class FileCatalog( object ):
     allLfns = fileInfo.keys()
     parms1 = parms[1:]
     lfnsFlag = False
+    catalogCalls = []
     for catalogName, oCatalog, master in self.writeCatalogs:
 
       # Skip if metadata related method on pure File Catalog
       if self.call in FileCatalog.write_meta_methods and not catalogName in self.metaCatalogs:
         continue
+      catalogCalls.append( ( catalogName, getattr( oCatalog, self.call ), master ) )
+
+    if self.maxParallelCalls > 1:
+      # The master catalogs go first one by one, the files they fail are not sent to the others
+      callBatches = [ [ call ] for call in catalogCalls if call[2] ]
+      otherCalls = [ call for call in catalogCalls if not call[2] ]
+      if otherCalls:
+        callBatches.append( otherCalls )
+    else:
+      callBatches = [ [ call ] for call in catalogCalls ]
+
+    for callBatch in callBatches:
+      calls = []
+      for _catalogName, method, _master in callBatch:
+        if self.call in FileCatalog.write_meta_methods:
+          calls.append( ( method, parms, kws ) )
+        elif len( callBatch ) > 1:
+          # Each thread gets its own copy of the files to write
+          calls.append( ( method, ( dict( fileInfo ), ) + parms1, kws ) )
+        else:
+          calls.append( ( method, ( fileInfo, ) + parms1, kws ) )
+      results = self.__callCatalogs( calls )
 
-      method = getattr( oCatalog, self.call )
-      if self.call in FileCatalog.write_meta_methods:
-        res = method( *parms, **kws )
-      else:
-        res = method( fileInfo, *parms1, **kws )
-
-      if not res['OK']:
-        if master:
-          # If this is the master catalog and it fails we dont want to continue with the other catalogs
-          gLogger.error( "FileCatalog.w_execute: Failed to execute call on master catalog",
-                         "%s on %s: %s" % ( self.call, catalogName, res['Message'] ) )
-          return res
+      # The results are merged in the order of the catalogs whatever the order they came in
+      for ( catalogName, _method, master ), res in zip( callBatch, results ):
+        if not res['OK']:
+          if master:
+            # If this is the master catalog and it fails we dont want to continue with the other catalogs
+            gLogger.error( "FileCatalog.w_execute: Failed to execute call on master catalog",
+                           "%s on %s: %s" % ( self.call, catalogName, res['Message'] ) )
+            return res
+          else:
+            # Otherwise we keep the failed catalogs so we can update their state later
+            failedCatalogs.append( ( catalogName, res['Message'] ) )
         else:
-          # Otherwise we keep the failed catalogs so we can update their state later
-          failedCatalogs.append( ( catalogName, res['Message'] ) )
-      else:
-        if 'Failed' in res['Value']:
-          lfnsFlag = True
-          for lfn, message in res['Value']['Failed'].items():
-            # Save the error message for the failed operations
-            failed.setdefault( lfn, {} )[catalogName] = message
-            if master:
-              # If this is the master catalog then we should not attempt the operation on other catalogs
-              fileInfo.pop( lfn, None )
-          for lfn, result in res['Value']['Successful'].items():
-            # Save the result return for each file for the successful operations
-            successful.setdefault( lfn, {} )[catalogName] = result
+          if 'Failed' in res['Value']:
+            lfnsFlag = True
+            for lfn, message in res['Value']['Failed'].items():
+              # Save the error message for the failed operations
+              failed.setdefault( lfn, {} )[catalogName] = message
+              if master:
+                # If this is the master catalog then we should not attempt the operation on other catalogs
+                fileInfo.pop( lfn, None )
+            for lfn, result in res['Value']['Successful'].items():
+              # Save the result return for each file for the successful operations
+              successful.setdefault( lfn, {} )[catalogName] = result
     # This recovers the states of the files that completely failed i.e. when S_ERROR is returned by a catalog
     if lfnsFlag:
       for catalogName, errorMessage in failedCatalogs:
@@ -157,28 +227,118 @@ class FileCatalog( object ):
     """
     successful = {}
     failed = {}
+    cached = {}
+    cacheReplicas = False
+    if self.call == 'getReplicas' and self.replicaCache and parms:
+      res = checkArgumentFormat( parms[0] )
+      if res['OK']:
+        cacheReplicas = True
+        allStatus = parms[1] if len( parms ) > 1 else kws.get( 'allStatus', False )
+        lfns = res['Value'].keys()
+        cacheGeneration = self.replicaCache.getGeneration()
+        cached = self.replicaCache.get( lfns, allStatus )
+        if cached:
+          missingLfns = [ lfn for lfn in lfns if lfn not in cached ]
+          if not missingLfns:
+            return S_OK( {'Failed':failed, 'Successful':cached} )
+          parms = ( missingLfns, ) + parms[1:]
+
+    calls = []
     for catalogName, oCatalog, _master in self.readCatalogs:
 
       # Skip if metadata related method on pure File Catalog
       if self.call in FileCatalog.ro_meta_methods and not catalogName in self.metaCatalogs:
         continue
+      calls.append( ( getattr( oCatalog, self.call ), parms, kws ) )
 
-      method = getattr( oCatalog, self.call )
-      res = method( *parms, **kws )
-      if res['OK']:
-        if 'Successful' in res['Value']:
-          for key, item in res['Value']['Successful'].items():
-            successful.setdefault( key, item )
-            failed.pop( key, None )
-          for key, item in res['Value']['Failed'].items():
-            if key not in successful:
-              failed[key] = item
-        else:
-          return res
+    if self.maxParallelCalls > 1:
+      callBatches = [ calls ]
+    else:
+      callBatches = [ [ call ] for call in calls ]
+
+    for callBatch in callBatches:
+      # The results are merged in the order of the catalogs, the first one giving a file wins
+      for res in self.__callCatalogs( callBatch ):
+        if res['OK']:
+          if 'Successful' in res['Value']:
+            for key, item in res['Value']['Successful'].items():
+              successful.setdefault( key, item )
+              failed.pop( key, None )
+            for key, item in res['Value']['Failed'].items():
+              if key not in successful:
+                failed[key] = item
+          else:
+            return res
     if not successful and not failed:
-      return S_ERROR( "Failed to perform %s from any catalog" % self.call )
+      errorMessage = "Failed to perform %s from any catalog" % self.call
+      if not cached:
+        return S_ERROR( errorMessage )
+      # The cached replicas are still returned, the other files fail
+      failed = dict( [ ( lfn, errorMessage ) for lfn in parms[0] ] )
+    if cacheReplicas:
+      self.replicaCache.add( successful, allStatus, generation = cacheGeneration )
+      successful.update( cached )
     return S_OK( {'Failed':failed, 'Successful':successful} )
 
+  def __callCatalogs( self, calls ):
+    """ Execute the ( method, parms, kws ) calls and return their results in the same order.
+        Several calls are done concurrently by the calling thread and at most maxParallelCalls - 1
+        threads of the catalog thread pool
+    """
+    if len( calls ) == 1:
+      method, parms, kws = calls[0]
+      return [ method( *parms, **kws ) ]
+    if self.maxParallelCalls <= 1:
+      return [ self.__callCatalog( method, parms, kws ) for method, parms, kws in calls ]
+
+    results = [ None ] * len( calls )
+    pendingCalls = range( len( calls ) )
+    doneCalls = [ 0 ]
+    condition = threading.Condition()
+    # The pool threads act with the identity delegated to this one, if any
+    threadConfig = ThreadConfig().dump()
+
+    def callWorker( loadConfig = True ):
+      if loadConfig:
+        ThreadConfig().load( threadConfig )
+      while True:
+        condition.acquire()
+        try:
+          if not pendingCalls:
+            return
+          callIndex = pendingCalls.pop( 0 )
+        finally:
+          condition.release()
+        method, parms, kws = calls[callIndex]
+        results[callIndex] = self.__callCatalog( method, parms, kws )
+        condition.acquire()
+        try:
+          doneCalls[0] += 1
+          condition.notify()
+        finally:
+          condition.release()
+
+    threadPool = getCatalogThreadPool( self.maxParallelCalls - 1 )
+    for _i in range( min( self.maxParallelCalls, len( calls ) ) - 1 ):
+      threadPool.generateJobAndQueueIt( callWorker )
+    # The calling thread takes calls too, so they are all done even if the pool is busy.
+    # Only the calls taken by a pool thread are waited for
+    callWorker( loadConfig = False )
+    condition.acquire()
+    try:
+      while doneCalls[0] < len( calls ):
+        condition.wait()
+    finally:
+      condition.release()
+    return results
+
+  def __callCatalog( self, method, parms, kws ):
+    try:
+      return method( *parms, **kws )
+    except Exception, x:
+      gLogger.exception( "FileCatalog: exception while calling the catalog", self.call )
+      return S_ERROR( "Exception while calling the catalog: %s" % str( x ) )
+
   ###########################################################################################
   #
   # Below is the method for obtaining the objects instantiated for a provided catalogue configuration
@@ -5,10 +5,11 @@
 
 __RCSID__ = "$Id$"
 
-from types import ListType, DictType
+from types import ListType, DictType, StringTypes
 import os
 from DIRAC import S_OK, S_ERROR
 from DIRAC.Core.Base.Client import Client
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getVOMSAttributeForGroup, getDNForUsername
 
 class FileCatalogClient(Client):
@@ -38,22 +39,39 @@ class FileCatalogClient(Client):
         self.available = True
     return S_OK(self.available)
     
-  def getReplicas(self, lfns, allStatus=False, rpc='', url='', timeout=120):
-    """ Get the replicas of the given files
+  def getReplicas(self, lfns, allStatus=False, rpc='', url='', timeout=120, chunkSize=1000):
+    """ Get the replicas of the given files, asking the service for chunkSize files at a time
     """
+    lfnDict = { 'Successful' : {}, 'Failed' : {}, 'SEPrefixes' : {} }
+    for result in self.iterReplicas( lfns, allStatus, rpc=rpc, url=url, timeout=timeout, chunkSize=chunkSize ):
+      if not result['OK']:
+        return result
+      for key in lfnDict:
+        lfnDict[key].update( result['Value'].get( key, {} ) )
+    return S_OK( lfnDict )
+
+  def iterReplicas(self, lfns, allStatus=False, rpc='', url='', timeout=120, chunkSize=1000):
+    """ Generator of the replicas of the given files: yields the result of getReplicas
+        for chunkSize files at a time, stops after the first error
+    """
+    if type( lfns ) in StringTypes:
+      lfns = [ lfns ]
     rpcClient = self._getRPC(rpc=rpc, url=url, timeout=timeout)
-    result = rpcClient.getReplicas(lfns, allStatus)
-    if not result['OK']:
-      return result
-    
-    lfnDict = result['Value']
-    seDict = result['Value'].get( 'SEPrefixes', {} )
-    for lfn in lfnDict['Successful']:
-      for se in lfnDict['Successful'][lfn]:
-        if not lfnDict['Successful'][lfn][se] and se in seDict:
-          lfnDict['Successful'][lfn][se] = seDict[se] + lfn
-      
-    return S_OK( lfnDict )  
+    for lfnChunk in breakListIntoChunks( lfns, chunkSize ):
+      if type( lfns ) == DictType:
+        lfnChunk = dict( [ ( lfn, lfns[lfn] ) for lfn in lfnChunk ] )
+      result = rpcClient.getReplicas(lfnChunk, allStatus)
+      if not result['OK']:
+        yield result
+        return
+
+      lfnDict = result['Value']
+      seDict = result['Value'].get( 'SEPrefixes', {} )
+      for lfn in lfnDict['Successful']:
+        for se in lfnDict['Successful'][lfn]:
+          if not lfnDict['Successful'][lfn][se] and se in seDict:
+            lfnDict['Successful'][lfn][se] = seDict[se] + lfn
+      yield S_OK( lfnDict )
 
 
   def setReplicaProblematic( self, lfns, revert = False ):
@@ -143,6 +161,31 @@ class FileCatalogClient(Client):
           entryDict[lfn] = detailsDict
     return result      
 
+  def iterDirectory(self, path, verbose=False, rpc='', url='', timeout=120, pageSize=1000):
+    """ Generator of the given directory's contents: yields one dictionary with the
+        'Files', 'SubDirs', 'Links' and 'Datasets' keys per page of at most pageSize files,
+        subdirectories and datasets come with the first page. Stops after the first error
+    """
+    rpcClient = self._getRPC(rpc=rpc, url=url, timeout=timeout)
+    token = 0
+    while True:
+      result = rpcClient.listDirectoryPage(path, verbose, token, pageSize)
+      if not result['OK']:
+        yield result
+        return
+      pathDict = result['Value']
+      token = pathDict.pop( 'NextToken' )
+      # Force returned directory entries to be LFNs
+      for entryType in ['Files', 'SubDirs', 'Links']:
+        entryDict = pathDict[entryType]
+        for fname in entryDict.keys():
+          detailsDict = entryDict.pop( fname )
+          lfn = os.path.join( path, os.path.basename( fname ) )
+          entryDict[lfn] = detailsDict
+      yield S_OK( pathDict )
+      if not token:
+        return
+
   def getDirectoryMetadata( self, lfns, rpc='', url='', timeout=120):
     ''' Get standard directory metadata
     '''
@@ -208,6 +251,22 @@ class FileCatalogClient(Client):
     else:
       return S_ERROR( 'Illegal return value type %s' % type( result['Value'] ) ) 
        
+  def iterFilesByMetadata(self, metaDict, path='/', rpc='', url='', timeout=120, pageSize=1000):
+    """ Generator of the files satisfying the meta data query in the given path: yields
+        lists of at most pageSize LFNs. Stops after the first error
+    """
+    rpcClient = self._getRPC(rpc=rpc, url=url, timeout=timeout)
+    token = 0
+    while True:
+      result = rpcClient.findFilesByMetadataPage(metaDict, path, token, pageSize)
+      if not result['OK']:
+        yield result
+        return
+      token = result['Value']['NextToken']
+      yield S_OK( result['Value']['LFNs'] )
+      if not token:
+        return
+
   def getFileUserMetadata(self, path, rpc='', url='', timeout=120):
     """Get the meta data attached to a file, but also to 
     the its corresponding directory
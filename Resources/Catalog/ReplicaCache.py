@@ -0,0 +1,191 @@
+########################################################################
+# $HeadURL$
+########################################################################
+""" Client side cache of the replicas returned by the file catalogs. It is shared by all the
+    FileCatalog objects of the process and is disabled unless the local configuration asks for it:
+
+      /LocalSite/Catalogs/ReplicaCache/CacheTime  seconds an LFN is kept, 0 (default) disables the cache
+      /LocalSite/Catalogs/ReplicaCache/MaxSize    maximum number of LFNs kept in memory, 10000 by default
+      /LocalSite/Catalogs/ReplicaCache/ShelfFile  optional file keeping the cache between process restarts
+
+    Only the changes done through the FileCatalog of this process invalidate the cached replicas.
+    The expired LFNs are purged from the shelf when it is opened and then every CacheTime seconds
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import shelve
+import threading
+
+from DIRAC import gLogger, gConfig
+
+class ReplicaCache:
+  """ Bounded LRU cache of the replicas of LFNs, with an expiry time per LFN.
+      Entries are kept per LFN as { allStatus : ( expiry time, replicas ) }
+  """
+
+  def __init__( self, cacheTime, maxSize = 10000, shelfFile = '' ):
+    self.cacheTime = cacheTime
+    self.maxSize = max( 1, maxSize )
+    self.__lock = threading.Lock()
+    # lfn -> [ { allStatus : ( expiry, replicas ) }, last use ]
+    self.__data = {}
+    self.__tick = 0
+    # Incremented by each invalidation, results read before it are not stored
+    self.__generation = 0
+    self.__hits = 0
+    self.__misses = 0
+    self.__shelf = None
+    self.__lastPurge = 0
+    if shelfFile:
+      try:
+        self.__shelf = shelve.open( shelfFile )
+      except Exception, x:
+        gLogger.warn( "ReplicaCache: failed to open the shelf file, keeping replicas in memory only",
+                      "%s: %s" % ( shelfFile, str( x ) ) )
+      else:
+        self.__purgeShelf()
+
+  def getGeneration( self ):
+    return self.__generation
+
+  def get( self, lfns, allStatus = False ):
+    """ Get the valid cached replicas of the given lfns as { lfn : replicas }
+    """
+    now = time.time()
+    replicas = {}
+    self.__lock.acquire()
+    try:
+      for lfn in lfns:
+        entry = self.__data.get( lfn )
+        if entry is None and self.__shelf is not None:
+          entry = self.__loadFromShelf( lfn )
+        cached = entry and entry[0].get( allStatus )
+        if not cached or cached[0] < now:
+          self.__misses += 1
+          continue
+        self.__hits += 1
+        self.__tick += 1
+        entry[1] = self.__tick
+        replicas[lfn] = dict( cached[1] )
+    finally:
+      self.__lock.release()
+    return replicas
+
+  def add( self, replicas, allStatus = False, generation = None ):
+    """ Keep the given { lfn : replicas }. If the generation is given, the replicas are only
+        kept if nothing was invalidated since it was taken, as they could be outdated
+    """
+    expiry = time.time() + self.cacheTime
+    self.__lock.acquire()
+    try:
+      if generation is not None and generation != self.__generation:
+        return
+      for lfn, lfnReplicas in replicas.items():
+        self.__tick += 1
+        entry = self.__data.setdefault( lfn, [ {}, self.__tick ] )
+        entry[0][allStatus] = ( expiry, dict( lfnReplicas ) )
+        entry[1] = self.__tick
+        if self.__shelf is not None:
+          self.__shelf[self.__shelfKey( lfn )] = entry[0]
+      if len( self.__data ) > self.maxSize:
+        self.__prune()
+      if self.__shelf is not None:
+        if time.time() - self.__lastPurge > self.cacheTime:
+          self.__purgeShelf()
+        self.__shelf.sync()
+    finally:
+      self.__lock.release()
+
+  def invalidate( self, lfns ):
+    """ Forget the replicas of the given lfns
+    """
+    self.__lock.acquire()
+    try:
+      self.__generation += 1
+      for lfn in lfns:
+        self.__data.pop( lfn, None )
+        if self.__shelf is not None:
+          self.__shelf.pop( self.__shelfKey( lfn ), None )
+      if self.__shelf is not None:
+        self.__shelf.sync()
+    finally:
+      self.__lock.release()
+
+  def getStats( self ):
+    """ Get the hits, misses and size of the cache
+    """
+    self.__lock.acquire()
+    try:
+      return { 'Hits' : self.__hits,
+               'Misses' : self.__misses,
+               'Size' : len( self.__data ),
+               'MaxSize' : self.maxSize,
+               'CacheTime' : self.cacheTime }
+    finally:
+      self.__lock.release()
+
+  def __prune( self ):
+    """ Drop the least recently used entries down to 90% of the size in one go,
+        so the sort is not done on every insertion. The shelf keeps them until they expire
+    """
+    entries = sorted( self.__data.items(), key = lambda item: item[1][1] )
+    for lfn, _entry in entries[ : len( entries ) - self.maxSize * 9 / 10 ]:
+      del self.__data[ lfn ]
+
+  def __purgeShelf( self ):
+    """ Drop from the shelf the LFNs whose replicas have all expired
+    """
+    now = time.time()
+    self.__lastPurge = now
+    try:
+      expired = [ key for key, statusDict in self.__shelf.iteritems()
+                  if max( [ cached[0] for cached in statusDict.values() ] + [ 0 ] ) < now ]
+      for key in expired:
+        del self.__shelf[key]
+      self.__shelf.sync()
+    except Exception, x:
+      gLogger.warn( "ReplicaCache: failed to purge the shelf file", str( x ) )
+      return
+    if expired:
+      gLogger.verbose( "ReplicaCache: %d expired LFNs purged from the shelf file" % len( expired ) )
+
+  def __shelfKey( self, lfn ):
+    if isinstance( lfn, unicode ):
+      return lfn.encode( 'utf-8' )
+    return lfn
+
+  def __loadFromShelf( self, lfn ):
+    try:
+      statusDict = self.__shelf.get( self.__shelfKey( lfn ) )
+    except Exception:
+      return None
+    if not statusDict:
+      return None
+    self.__tick += 1
+    entry = [ statusDict, self.__tick ]
+    self.__data[lfn] = entry
+    if len( self.__data ) > self.maxSize:
+      self.__prune()
+    return entry
+
+gReplicaCache = None
+gReplicaCacheLock = threading.Lock()
+
+def getReplicaCache():
+  """ Get the replica cache of the process, None if it is not enabled in the local configuration
+  """
+  global gReplicaCache
+  gReplicaCacheLock.acquire()
+  try:
+    if gReplicaCache is None:
+      cacheTime = gConfig.getValue( '/LocalSite/Catalogs/ReplicaCache/CacheTime', 0 )
+      if cacheTime <= 0:
+        return None
+      gReplicaCache = ReplicaCache( cacheTime,
+                                    gConfig.getValue( '/LocalSite/Catalogs/ReplicaCache/MaxSize', 10000 ),
+                                    gConfig.getValue( '/LocalSite/Catalogs/ReplicaCache/ShelfFile', '' ) )
+    return gReplicaCache
+  finally:
+    gReplicaCacheLock.release()
@@ -0,0 +1,114 @@
+########################################################################
+# $HeadURL $
+# File: TestReplicaCache.py
+########################################################################
+
+""" :mod: TestReplicaCache
+    ======================
+
+    .. module: TestReplicaCache
+    :synopsis: test cases for the client side replica cache
+
+    test cases for ReplicaCache: expiry, LRU bound, invalidation and the
+    generation check of the replicas read before an invalidation, and for
+    the cached replicas returned by FileCatalog.getReplicas
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import time
+import shelve
+import tempfile
+import unittest
+## SUT
+from DIRAC.Resources.Catalog.ReplicaCache import ReplicaCache
+from DIRAC.Resources.Catalog.FileCatalog import FileCatalog
+from DIRAC import S_ERROR
+
+class FailingCatalog( object ):
+  """ read catalog failing all the calls """
+
+  def getReplicas( self, lfns, allStatus = False ):
+    return S_ERROR( "Catalog is down" )
+
+########################################################################
+class ReplicaCacheTestCase( unittest.TestCase ):
+  """
+  .. class:: ReplicaCacheTestCase
+
+  """
+
+  def testGetAndExpire( self ):
+    """ cached replicas are served per allStatus until they expire """
+    cache = ReplicaCache( 1 )
+    cache.add( { '/a' : { 'SE1' : 'pfn1' } } )
+    self.assertEqual( cache.get( [ '/a', '/b' ] ), { '/a' : { 'SE1' : 'pfn1' } } )
+    self.assertEqual( cache.get( [ '/a' ], allStatus = True ), {} )
+    stats = cache.getStats()
+    self.assertEqual( ( stats['Hits'], stats['Misses'], stats['Size'] ), ( 1, 2, 1 ) )
+    time.sleep( 1.1 )
+    self.assertEqual( cache.get( [ '/a' ] ), {} )
+
+  def testBoundAndInvalidate( self ):
+    """ least recently used lfns go first, invalidation drops the lfns and newer results """
+    cache = ReplicaCache( 60, maxSize = 10 )
+    for i in range( 10 ):
+      cache.add( { '/f%d' % i : { 'SE' : i } } )
+    cache.get( [ '/f0' ] )
+    cache.add( { '/f10' : { 'SE' : 10 } } )
+    self.assertEqual( cache.getStats()['Size'], 9 )
+    self.assertEqual( cache.get( [ '/f0', '/f1' ] ).keys(), [ '/f0' ] )
+    generation = cache.getGeneration()
+    cache.invalidate( [ '/f0' ] )
+    self.assertEqual( cache.get( [ '/f0' ] ), {} )
+    cache.add( { '/f0' : { 'SE' : 0 } }, generation = generation )
+    self.assertEqual( cache.get( [ '/f0' ] ), {} )
+
+  def testShelf( self ):
+    """ replicas kept in the shelf are found by a new cache """
+    shelfFile = os.path.join( tempfile.mkdtemp(), 'replicas' )
+    cache = ReplicaCache( 60, shelfFile = shelfFile )
+    cache.add( { '/a' : { 'SE1' : 'pfn1' }, '/b' : { 'SE2' : 'pfn2' } } )
+    cache.invalidate( [ '/b' ] )
+    del cache
+    cache = ReplicaCache( 60, shelfFile = shelfFile )
+    self.assertEqual( cache.get( [ '/a', '/b' ] ), { '/a' : { 'SE1' : 'pfn1' } } )
+
+  def testShelfPurge( self ):
+    """ expired lfns are dropped from the shelf when it is opened """
+    shelfFile = os.path.join( tempfile.mkdtemp(), 'replicas' )
+    cache = ReplicaCache( 1, shelfFile = shelfFile )
+    cache.add( { '/a' : { 'SE1' : 'pfn1' } } )
+    del cache
+    time.sleep( 1.1 )
+    cache = ReplicaCache( 60, shelfFile = shelfFile )
+    cache.add( { '/b' : { 'SE2' : 'pfn2' } } )
+    del cache
+    shelf = shelve.open( shelfFile )
+    self.assertEqual( shelf.keys(), [ '/b' ] )
+    shelf.close()
+
+  def testCatalogFailure( self ):
+    """ the files not in the cache fail when no catalog answers """
+    cache = ReplicaCache( 60 )
+    cache.add( { '/a' : { 'SE1' : 'pfn1' } } )
+    fileCatalog = FileCatalog.__new__( FileCatalog )
+    fileCatalog.replicaCache = cache
+    fileCatalog.maxParallelCalls = 1
+    fileCatalog.readCatalogs = [ ( 'FailingCatalog', FailingCatalog(), True ) ]
+    fileCatalog.metaCatalogs = []
+    result = fileCatalog.getReplicas( [ '/a', '/b' ] )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( result['Value']['Successful'], { '/a' : { 'SE1' : 'pfn1' } } )
+    self.assertEqual( result['Value']['Failed'].keys(), [ '/b' ] )
+    self.assertFalse( fileCatalog.getReplicas( [ '/b' ] )['OK'] )
+    fileCatalog.replicaCache = None
+    self.assertFalse( fileCatalog.getReplicas( [ '/a', '/b' ] )['OK'] )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( ReplicaCacheTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
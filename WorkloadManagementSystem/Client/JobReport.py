@@ -97,10 +97,9 @@ class JobReport( object ):
 
     return S_OK()
 
-  def sendStoredStatusInfo( self ):
-    """ Send the job status information stored in the internal cache
+  def __getStoredStatusDict( self ):
+    """ Build the status dictionary out of the internal cache
     """
-
     statusDict = {}
     for status, minor, dtime in self.jobStatusInfo:
       statusDict[dtime] = { 'Status': status,
@@ -112,6 +111,22 @@ class JobReport( object ):
                             'MinorStatus': '',
                             'ApplicationStatus': appStatus,
                             'Source': self.source }
+    return statusDict
+
+  def __getStoredParameters( self ):
+    """ Build the parameter list out of the internal cache
+    """
+    parameters = []
+    for pname, value in self.jobParameters.items():
+      pvalue, _timeStamp = value
+      parameters.append( ( pname, pvalue ) )
+    return parameters
+
+  def sendStoredStatusInfo( self ):
+    """ Send the job status information stored in the internal cache
+    """
+
+    statusDict = self.__getStoredStatusDict()
 
     if statusDict:
       jobMonitor = RPCClient( 'WorkloadManagement/JobStateUpdate', timeout = 60 )
@@ -129,11 +144,7 @@ class JobReport( object ):
     """ Send the job parameters stored in the internal cache
     """
 
-    parameters = []
-    paramDict = {}
-    for pname, value in self.jobParameters.items():
-      pvalue, _timeStamp = value
-      parameters.append( ( pname, pvalue ) )
+    parameters = self.__getStoredParameters()
 
     if parameters:
       jobMonitor = RPCClient( 'WorkloadManagement/JobStateUpdate', timeout = 60 )
@@ -153,13 +164,32 @@ class JobReport( object ):
     """ Send all the accumulated information
     """
 
-    success = True
-    result = self.sendStoredStatusInfo()
-    if not result['OK']:
-      success = False
-    result = self.sendStoredJobParameters()
-    if not result['OK']:
-      success = False
+    statusDict = self.__getStoredStatusDict()
+    parameters = self.__getStoredParameters()
+    if not statusDict or not parameters:
+      # Nothing to gain from a batch
+      success = True
+      result = self.sendStoredStatusInfo()
+      if not result['OK']:
+        success = False
+      result = self.sendStoredJobParameters()
+      if not result['OK']:
+        success = False
+    else:
+      # Send both in a single round trip
+      batch = RPCClient( 'WorkloadManagement/JobStateUpdate', timeout = 60 ).batch()
+      batch.setJobStatusBulk( self.jobID, statusDict )
+      batch.setJobParameters( self.jobID, parameters )
+      result = batch.execute()
+      success = result['OK']
+      if success:
+        statusResult, parResult = result['Value']
+        if statusResult['OK']:
+          self.jobStatusInfo = []
+          self.appStatusInfo = []
+        if parResult['OK']:
+          self.jobParameters = {}
+        success = statusResult['OK'] and parResult['OK']
 
     if success:
       return S_OK()
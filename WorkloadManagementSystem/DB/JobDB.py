@@ -20,6 +20,7 @@
 
     setJobAttribute()
     setJobAttributes()
+    setJobAttributesBulk()
     setJobParameter()
     setJobParameters()
     setJobJDL()
@@ -49,6 +50,7 @@ from DIRAC                                                       import S_OK, S_
 from DIRAC.ConfigurationSystem.Client.Config                     import gConfig
 from DIRAC.ConfigurationSystem.Client.Helpers                    import Registry
 from DIRAC.Core.Base.DB                                          import DB
+from DIRAC.Core.Utilities.MySQL                                  import readOnlySafe
 from DIRAC.ConfigurationSystem.Client.Helpers.Resources          import getSites
 from DIRAC.ResourceStatusSystem.Client.SiteStatus                import SiteStatus
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest  import JobManifest
@@ -481,12 +483,10 @@ class JobDB( DB ):
     else:
       attrNames = ','.join( [ str( x ) for x in self.jobAttributeNames ] )
       attr_tmp_list = self.jobAttributeNames
-    jobList = ','.join( [str( x ) for x in jobIDList] )
-
     # FIXME: need to check if the attributes are in the list of job Attributes
 
-    cmd = 'SELECT JobID,%s FROM Jobs WHERE JobID in ( %s )' % ( attrNames, jobList )
-    res = self._query( cmd )
+    cmd = 'SELECT JobID,%s FROM Jobs WHERE JobID in ( %%s )' % attrNames
+    res = self._query( cmd, params = [ [ int( x ) for x in jobIDList ] ] )
     if not res['OK']:
       return res
     try:
@@ -627,24 +627,12 @@ class JobDB( DB ):
         If parameterList is empty - all the parameters are returned.
     """
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    e_jobID = ret['Value']
-
     self.log.debug( 'JobDB.getParameters: Getting Parameters for job %s' % jobID )
 
     resultDict = {}
     if paramList:
-      paramNameList = []
-      for x in paramList:
-        ret = self._escapeString( x )
-        if not ret['OK']:
-          return ret
-        paramNameList.append( ret['Value'] )
-      paramNames = ','.join( paramNameList )
-      cmd = "SELECT Name, Value from JobParameters WHERE JobID=%s and Name in (%s)" % ( e_jobID, paramNames )
-      result = self._query( cmd )
+      cmd = "SELECT Name, Value from JobParameters WHERE JobID=%s and Name in (%s)"
+      result = self._query( cmd, params = [ str( jobID ), [ str( x ) for x in paramList ] ] )
       if result['OK']:
         if result['Value']:
           for name, value in result['Value']:
@@ -976,27 +964,19 @@ class JobDB( DB ):
         The LastUpdate time stamp is refreshed if explicitly requested
     """
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    jobID = ret['Value']
-
-    ret = self._escapeString( attrValue )
-    if not ret['OK']:
-      return ret
-    value = ret['Value']
-
     # FIXME: need to check the validity of attrName
 
     if update:
-      cmd = "UPDATE Jobs SET %s=%s,LastUpdateTime=UTC_TIMESTAMP() WHERE JobID=%s" % ( attrName, value, jobID )
+      cmd = "UPDATE Jobs SET %s=%%s,LastUpdateTime=UTC_TIMESTAMP() WHERE JobID=%%s" % attrName
     else:
-      cmd = "UPDATE Jobs SET %s=%s WHERE JobID=%s" % ( attrName, value, jobID )
+      cmd = "UPDATE Jobs SET %s=%%s WHERE JobID=%%s" % attrName
+    params = [ str( attrValue ), str( jobID ) ]
 
     if myDate:
-      cmd += ' AND LastUpdateTime < %s' % myDate
+      cmd += ' AND LastUpdateTime < %s'
+      params.append( myDate )
 
-    res = self._update( cmd )
+    res = self._update( cmd, params = params )
     if res['OK']:
       return res
     else:
@@ -1008,38 +988,66 @@ class JobDB( DB ):
         The LastUpdate time stamp is refreshed if explicitely requested
     """
 
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    jobID = ret['Value']
-
     if len( attrNames ) != len( attrValues ):
       return S_ERROR( 'JobDB.setAttributes: incompatible Argument length' )
 
     # FIXME: Need to check the validity of attrNames
-    attr = []
-    for i in range( len( attrNames ) ):
-      ret = self._escapeString( attrValues[i] )
-      if not ret['OK']:
-        return ret
-      value = ret['Value']
-      attr.append( "%s=%s" % ( attrNames[i], value ) )
+    attr = [ "%s=%%s" % attrName for attrName in attrNames ]
+    params = [ str( attrValue ) for attrValue in attrValues ]
     if update:
       attr.append( "LastUpdateTime=UTC_TIMESTAMP()" )
     if len( attr ) == 0:
       return S_ERROR( 'JobDB.setAttributes: Nothing to do' )
 
-    cmd = 'UPDATE Jobs SET %s WHERE JobID=%s' % ( ', '.join( attr ), jobID )
+    cmd = 'UPDATE Jobs SET %s WHERE JobID=%%s' % ', '.join( attr )
+    params.append( str( jobID ) )
 
     if myDate:
-      cmd += ' AND LastUpdateTime < %s' % myDate
+      cmd += ' AND LastUpdateTime < %s'
+      params.append( myDate )
 
-    res = self._update( cmd )
+    res = self._update( cmd, params = params )
     if res['OK']:
       return res
     else:
       return S_ERROR( 'JobDB.setAttributes: failed to set attribute' )
 
+#############################################################################
+  def setJobAttributesBulk( self, attrDict, update = False ):
+    """ Set attribute values for many jobs with a single statement. attrDict is
+        { jobID : { attrName : attrValue } }, the jobs need not set the same attributes.
+        The LastUpdate time stamp of all the jobs is refreshed if explicitely requested
+    """
+    if not attrDict:
+      return S_OK()
+
+    jobIDs = [ int( jobID ) for jobID in attrDict ]
+    cases = {}
+    for jobID, jobAttrDict in attrDict.items():
+      for attrName, attrValue in jobAttrDict.items():
+        cases.setdefault( attrName, [] ).append( ( int( jobID ), str( attrValue ) ) )
+
+    # FIXME: Need to check the validity of attrNames
+    attr = []
+    params = []
+    for attrName, attrCases in cases.items():
+      attr.append( '%s=CASE JobID %s ELSE %s END' % ( attrName, ' '.join( [ 'WHEN %s THEN %s' ] * len( attrCases ) ),
+                                                     attrName ) )
+      for jobID, attrValue in attrCases:
+        params += [ jobID, attrValue ]
+    if update:
+      attr.append( "LastUpdateTime=UTC_TIMESTAMP()" )
+    if not attr:
+      return S_OK()
+
+    cmd = 'UPDATE Jobs SET %s WHERE JobID IN (%%s)' % ', '.join( attr )
+    params.append( jobIDs )
+    res = self._update( cmd, params = params )
+    if res['OK']:
+      return res
+    else:
+      return S_ERROR( 'JobDB.setJobAttributesBulk: failed to set attributes' )
+
 #############################################################################
   def setJobStatus( self, jobID, status = '', minor = '', application = '', appCounter = None ):
     """ Set status of the job specified by its jobID
@@ -1118,17 +1126,8 @@ class JobDB( DB ):
     """ Set a parameter specified by name,value pair for the job JobID
     """
 
-    ret = self._escapeString( key )
-    if not ret['OK']:
-      return ret
-    e_key = ret['Value']
-    ret = self._escapeString( value )
-    if not ret['OK']:
-      return ret
-    e_value = ret['Value']
-
-    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES (%d,%s,%s)' % ( int( jobID ), e_key, e_value )
-    result = self._update( cmd )
+    cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES (%s,%s,%s)'
+    result = self._update( cmd, params = [ int( jobID ), str( key ), str( value ) ] )
     if not result['OK']:
       result = S_ERROR( 'JobDB.setJobParameter: operation failed.' )
 
@@ -1143,19 +1142,13 @@ class JobDB( DB ):
       return S_OK()
 
     insertValueList = []
+    params = []
     for name, value in parameters:
-      ret = self._escapeString( name )
-      if not ret['OK']:
-        return ret
-      e_name = ret['Value']
-      ret = self._escapeString( value )
-      if not ret['OK']:
-        return ret
-      e_value = ret['Value']
-      insertValueList.append( '(%s,%s,%s)' % ( jobID, e_name, e_value ) )
+      insertValueList.append( '(%s,%s,%s)' )
+      params += [ int( jobID ), str( name ), str( value ) ]
 
     cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( insertValueList )
-    result = self._update( cmd )
+    result = self._update( cmd, params = params )
     if not result['OK']:
       return S_ERROR( 'JobDB.setJobParameters: operation failed.' )
 
@@ -1824,6 +1817,7 @@ class JobDB( DB ):
     return S_OK( siteDict )
 
 #################################################################################
+  @readOnlySafe
   def getSiteSummaryWeb( self, selectDict, sortList, startItem, maxItems ):
     """ Get the summary of jobs in a given status on all the sites in the standard Web form
     """
@@ -2087,13 +2081,8 @@ class JobDB( DB ):
     """
 
     # Set the time stamp first
-    ret = self._escapeString( jobID )
-    if not ret['OK']:
-      return ret
-    e_jobID = ret['Value']
-
-    req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status='Running' WHERE JobID=%s" % e_jobID
-    result = self._update( req )
+    req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status='Running' WHERE JobID=%s"
+    result = self._update( req, params = [ int( jobID ) ] )
     if not result['OK']:
       return S_ERROR( 'Failed to set the heart beat time: ' + result['Message'] )
 
@@ -2108,25 +2097,80 @@ class JobDB( DB ):
     # Add dynamic data to the job heart beat log
     # start = time.time()
     valueList = []
+    params = []
     for key, value in dynamicDataDict.items():
-      result = self._escapeString( key )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + key )
-        continue
-      e_key = result['Value']
-      result = self._escapeString( value )
-      if not result['OK']:
-        self.log.warn( 'Failed to escape string ' + value )
-        continue
-      e_value = result['Value']
-      valueList.append( "( %s, %s,%s,UTC_TIMESTAMP())" % ( e_jobID, e_key, e_value ) )
+      valueList.append( "( %s, %s,%s,UTC_TIMESTAMP())" )
+      params += [ int( jobID ), str( key ), str( value ) ]
 
     if valueList:
 
       valueString = ','.join( valueList )
       req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES "
       req += valueString
-      result = self._update( req )
+      result = self._update( req, params = params )
+      if not result['OK']:
+        ok = False
+        self.log.warn( result['Message'] )
+
+    if ok:
+      return S_OK()
+    else:
+      return S_ERROR( 'Failed to store some or all the parameters' )
+
+#####################################################################################
+  def setHeartBeatDataBulk( self, heartBeatDict ):
+    """ Add the heart beat data of many jobs to the database with one statement per table.
+        heartBeatDict is { jobID : { 'HeartBeatTime' : time of the last heart beat,
+                                     'SetRunning' : whether the job status is set to Running,
+                                     'StaticData' : { name : value },
+                                     'DynamicData' : [ ( name, value, heart beat time ) ] } }
+    """
+    if not heartBeatDict:
+      return S_OK()
+
+    timeParams = []
+    runningIDs = []
+    paramValueList = []
+    paramParams = []
+    valueList = []
+    valueParams = []
+    for jobID, heartBeat in heartBeatDict.items():
+      jobID = int( jobID )
+      timeParams += [ jobID, str( heartBeat['HeartBeatTime'] ) ]
+      if heartBeat['SetRunning']:
+        runningIDs.append( jobID )
+
+      for key, value in heartBeat['StaticData'].items():
+        paramValueList.append( '(%s,%s,%s)' )
+        paramParams += [ jobID, str( key ), str( value ) ]
+
+      for key, value, heartBeatTime in heartBeat['DynamicData']:
+        valueList.append( "( %s, %s,%s,%s)" )
+        valueParams += [ jobID, str( key ), str( value ), str( heartBeatTime ) ]
+
+    attr = [ 'HeartBeatTime=CASE JobID %s END' % ' '.join( [ 'WHEN %s THEN %s' ] * len( heartBeatDict ) ) ]
+    params = timeParams
+    if runningIDs:
+      attr.append( "Status=IF(JobID IN (%s),'Running',Status)" )
+      params.append( runningIDs )
+    req = "UPDATE Jobs SET %s WHERE JobID IN (%%s)" % ', '.join( attr )
+    params.append( [ int( jobID ) for jobID in heartBeatDict ] )
+    result = self._update( req, params = params )
+    if not result['OK']:
+      return S_ERROR( 'Failed to set the heart beat time: ' + result['Message'] )
+
+    ok = True
+    if paramValueList:
+      req = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( paramValueList )
+      result = self._update( req, params = paramParams )
+      if not result['OK']:
+        ok = False
+        self.log.warn( result['Message'] )
+
+    if valueList:
+      req = "INSERT INTO HeartBeatLoggingInfo (JobID,Name,Value,HeartBeatTime) VALUES "
+      req += ','.join( valueList )
+      result = self._update( req, params = valueParams )
       if not result['OK']:
         ok = False
         self.log.warn( result['Message'] )
@@ -2240,6 +2284,7 @@ class JobDB( DB ):
     return result
 
 #####################################################################################
+  @readOnlySafe
   def getSummarySnapshot( self, requestedFields = False ):
     """ Get the summary snapshot for a given combination
     """
@@ -2,8 +2,10 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()
+    getLastStatusTimes()
 """
 
 import time
@@ -78,6 +80,39 @@ class JobLoggingDB( DB ):
     event = 'status/minor/app=%s/%s/%s' % ( status, minor, application )
     self.gLogger.info( "Adding record for job " + str( jobID ) + ": '" + event + "' from " + source )
 
+    _date, time_order = self.__getStatusTime( date )
+
+    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
+           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
+
+    return self._update( cmd )
+
+#############################################################################
+  def addLoggingRecords( self, records ):
+    """ Add many entries to the JobLoggingDB table in one go. The records are
+        ( jobID, status, minor, application, date, source ) tuples with the
+        same meaning as the addLoggingRecord arguments
+    """
+    if not records:
+      return S_OK()
+    self.gLogger.info( "Adding %d logging records" % len( records ) )
+
+    valueList = []
+    params = []
+    for jobID, status, minor, application, date, source in records:
+      _date, time_order = self.__getStatusTime( date )
+      valueList.append( "(%s,%s,%s,%s,%s,%s,%s)" )
+      params += [ int( jobID ), str( status ), str( minor ), str( application ),
+                  str( _date ), time_order, str( source ) ]
+
+    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES %s" % ','.join( valueList )
+    return self._update( cmd, params = params )
+
+  def __getStatusTime( self, date ):
+    """ Get the UTC datetime and the StatusTimeOrder of a logging record from its date
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -104,12 +139,7 @@ class JobLoggingDB( DB ):
         _date = Time.dateTime()
         epoc = time.mktime( _date.timetuple() ) - MAGIC_EPOC_NUMBER
         time_order = round( epoc, 3 )
-
-    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
-
-    return self._update( cmd )
+    return _date, time_order
 
 #############################################################################
   def getJobLoggingInfo( self, jobID ):
@@ -188,3 +218,20 @@ class JobLoggingDB( DB ):
       result['LastTime'] = "Unknown"
 
     return S_OK( result )
+
+#############################################################################
+  def getLastStatusTimes( self, jobIDs ):
+    """ Get the time stamp of the last status transition of each of the given jobs
+        return a {jobID:timestamp} dictionary, jobs without logging records are not in it
+    """
+    if not jobIDs:
+      return S_OK( {} )
+    cmd = 'SELECT JobID,MAX(StatusTimeOrder) FROM LoggingInfo WHERE JobID IN (%s) GROUP BY JobID' % \
+          ','.join( [ str( int( jobID ) ) for jobID in jobIDs ] )
+    resCmd = self._query( cmd )
+    if not resCmd['OK']:
+      return resCmd
+    result = {}
+    for jobID, etime in resCmd['Value']:
+      result[int( jobID )] = str( etime + MAGIC_EPOC_NUMBER )
+    return S_OK( result )
@@ -3,11 +3,14 @@
 
 __RCSID__ = "ebed3a8 (2012-07-06 20:33:11 +0200) Adri Casajs <adria@ecm.ub.es>"
 
+import time
 import types
 import random
+import threading
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List
 from DIRAC.Core.Utilities.DictCache import DictCache
@@ -41,6 +44,9 @@ class TaskQueueDB( DB ):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    self.__tqIndex = False
+    self.__tqIndexLock = threading.Lock()
+    self.__tqIndexLastSync = 0
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
@@ -218,6 +224,14 @@ class TaskQueueDB( DB ):
           return S_ERROR( "PilotType %s is invalid" % pilotType )
     return S_OK( tqDefDict )
 
+  def __applyLegacyMatchFields( self, tqMatchDict ):
+    # Confine the LHCbPlatform legacy option here, use Platform everywhere else
+    # until the LHCbPlatform is no more used in the TaskQueueDB
+    if 'LHCbPlatform' in tqMatchDict and not "Platform" in tqMatchDict:
+      tqMatchDict['Platform'] = tqMatchDict['LHCbPlatform']
+    if 'SystemConfig' in tqMatchDict and not "Platform" in tqMatchDict:
+      tqMatchDict['Platform'] = tqMatchDict['SystemConfig']
+
   def _checkMatchDefinition( self, tqMatchDict ):
     """
     Check a task queue match dict is valid
@@ -239,12 +253,7 @@ class TaskQueueDB( DB ):
           return self._escapeString( value )
         return S_OK( value )
 
-    # Confine the LHCbPlatform legacy option here, use Platform everywhere else
-    # until the LHCbPlatform is no more used in the TaskQueueDB
-    if 'LHCbPlatform' in tqMatchDict and not "Platform" in tqMatchDict:
-      tqMatchDict['Platform'] = tqMatchDict['LHCbPlatform']
-    if 'SystemConfig' in tqMatchDict and not "Platform" in tqMatchDict:
-      tqMatchDict['Platform'] = tqMatchDict['SystemConfig']
+    self.__applyLegacyMatchFields( tqMatchDict )
 
     for field in self.__singleValueDefFields:
       if field not in tqMatchDict:
@@ -416,11 +425,12 @@ class TaskQueueDB( DB ):
         return S_ERROR( "Can't insert job: %s" % result[ 'Message' ] )
       connObj = result[ 'Value' ]
     if checkTQExists:
-      result = self._query( "SELECT tqId FROM `tq_TaskQueues` WHERE TQId = %s" % tqId, conn = connObj )
+      result = self._query( "SELECT tqId FROM `tq_TaskQueues` WHERE TQId = %s", conn = connObj, params = [ tqId ] )
       if not result[ 'OK' ] or len ( result[ 'Value' ] ) == 0:
         return S_OK( "Can't find task queue with id %s: %s" % ( tqId, result[ 'Message' ] ) )
     hackedPriority = self.__hackJobPriority( jobPriority )
-    result = self._update( "INSERT INTO tq_Jobs ( TQId, JobId, Priority, RealPriority ) VALUES ( %s, %s, %s, %f ) ON DUPLICATE KEY UPDATE TQId = %s, Priority = %s, RealPriority = %f" % ( tqId, jobId, jobPriority, hackedPriority, tqId, jobPriority, hackedPriority ), conn = connObj )
+    result = self._update( "INSERT INTO tq_Jobs ( TQId, JobId, Priority, RealPriority ) VALUES ( %s, %s, %s, %s ) ON DUPLICATE KEY UPDATE TQId = VALUES( TQId ), Priority = VALUES( Priority ), RealPriority = VALUES( RealPriority )",
+                           conn = connObj, params = [ tqId, jobId, jobPriority, float( hackedPriority ) ] )
     if not result[ 'OK' ]:
       return result
     return S_OK()
@@ -500,23 +510,46 @@ class TaskQueueDB( DB ):
     """
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
+    #The in memory index works with the values as they are
+    rawMatchDict = dict( tqMatchDict )
+    self.__applyLegacyMatchFields( rawMatchDict )
     self.log.info( "Starting match for requirements", self.__strDict( tqMatchDict ) )
     retVal = self._checkMatchDefinition( tqMatchDict )
     if not retVal[ 'OK' ]:
       self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
       return retVal
+    if 'JobID' not in tqMatchDict:
+      retVal = self.__getTQIndex( numJobsPerTry )
+      if not retVal[ 'OK' ]:
+        return retVal
+      tqIndex = retVal[ 'Value' ]
+      if tqIndex:
+        retVal = tqIndex.matchAndGetJob( rawMatchDict, numQueuesPerTry = numQueuesPerTry,
+                                         negativeCond = negativeCond, maxRetries = self.__maxMatchRetry )
+        if not retVal[ 'OK' ]:
+          return retVal
+        matchData = retVal[ 'Value' ]
+        matchData[ 'tqMatch' ] = tqMatchDict
+        if matchData[ 'matchFound' ]:
+          self.log.info( "Extracted job %s from TQ %s" % ( matchData[ 'jobId' ], matchData[ 'taskQueueId' ] ) )
+        else:
+          self.log.info( "No TQ matches requirements" )
+        return S_OK( matchData )
     retVal = self._getConnection()
     if not retVal[ 'OK' ]:
       return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
     connObj = retVal[ 'Value' ]
     preJobSQL = "SELECT `tq_Jobs`.JobId, `tq_Jobs`.TQId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
     prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
-    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
+    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s"
+    jobParams = []
+    if 'JobID' in tqMatchDict:
+      preJobSQL = "%s AND `tq_Jobs`.JobId = %%s " % preJobSQL
+      jobParams = [ tqMatchDict['JobID'] ]
     for _ in range( self.__maxMatchRetry ):
       if 'JobID' in tqMatchDict:
         # A certain JobID is required by the resource, so all TQ are to be considered
         retVal = self.matchAndGetTaskQueue( tqMatchDict, numQueuesToGet = 0, skipMatchDictDef = True, connObj = connObj )
-        preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
       else:
         retVal = self.matchAndGetTaskQueue( tqMatchDict,
                                             numQueuesToGet = numQueuesPerTry,
@@ -531,13 +564,14 @@ class TaskQueueDB( DB ):
         return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
       for tqId, tqOwnerDN, tqOwnerGroup in tqList:
         self.log.info( "Trying to extract jobs from TQ %s" % tqId )
-        retVal = self._query( prioSQL % tqId, conn = connObj )
+        retVal = self._query( prioSQL, conn = connObj, params = [ tqId ] )
         if not retVal[ 'OK' ]:
           return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
         if len( retVal[ 'Value' ] ) == 0:
           continue
         prio = retVal[ 'Value' ][0][0]
-        retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
+        retVal = self._query( "%s %s" % ( preJobSQL, postJobSQL ), conn = connObj,
+                              params = [ tqId, prio ] + jobParams + [ int( numJobsPerTry ) ] )
         if not retVal[ 'OK' ]:
           return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
         jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
@@ -560,6 +594,91 @@ class TaskQueueDB( DB ):
     self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
     return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
 
+  def __getTQIndex( self, numJobsPerLoad = 50 ):
+    """
+    Get the in memory TQ index if enabled, synchronizing it with the DB if it's too old
+    """
+    if not self.__getCSOption( "InMemoryMatching", False ):
+      self.__tqIndex = False
+      return S_OK( False )
+    refreshPeriod = self.__getCSOption( "InMemoryMatchingRefresh", 10 )
+    if self.__tqIndex and time.time() - self.__tqIndexLastSync < refreshPeriod:
+      return S_OK( self.__tqIndex )
+    #Only one thread has to sync, the rest can keep using the index meanwhile
+    if not self.__tqIndexLock.acquire( False ):
+      if self.__tqIndex:
+        return S_OK( self.__tqIndex )
+      self.__tqIndexLock.acquire()
+    try:
+      if self.__tqIndex and time.time() - self.__tqIndexLastSync < refreshPeriod:
+        return S_OK( self.__tqIndex )
+      tqIndex = self.__tqIndex
+      if not tqIndex:
+        tqIndex = TaskQueueIndex( self.__multiValueDefFields, self.__loadJobsForTQIndex,
+                                  self.__extractJobForTQIndex, numJobsPerLoad = numJobsPerLoad )
+      result = self.__syncTQIndex( tqIndex )
+      if not result[ 'OK' ]:
+        self.log.error( "Could not sync the TQ index", result[ 'Message' ] )
+        return result
+      self.__tqIndex = tqIndex
+      self.__tqIndexLastSync = time.time()
+      return S_OK( tqIndex )
+    finally:
+      self.__tqIndexLock.release()
+
+  def __syncTQIndex( self, tqIndex ):
+    """
+    Load the priorities of all the TQs and the definitions of the new ones
+    """
+    sqlFields = [ 'TQId', 'Priority', 'Enabled' ] + list( self.__singleValueDefFields )
+    result = self._query( "SELECT %s FROM `tq_TaskQueues`" % ", ".join( sqlFields ) )
+    if not result[ 'OK' ]:
+      return result
+    knownTQs = set( tqIndex.getTaskQueueIds() )
+    tqPriorities = {}
+    newTQDefs = {}
+    for row in result[ 'Value' ]:
+      tqId = row[0]
+      tqPriorities[ tqId ] = row[1]
+      #New TQs are enabled once all their definition has been inserted
+      if tqId not in knownTQs and row[2] >= 1:
+        newTQDefs[ tqId ] = dict( zip( sqlFields, row ) )
+    newTQIds = sorted( newTQDefs )
+    for field in self.__multiValueDefFields:
+      for iPos in range( 0, len( newTQIds ), 1000 ):
+        tqList = ", ".join( [ str( tqId ) for tqId in newTQIds[ iPos : iPos + 1000 ] ] )
+        result = self._query( "SELECT TQId, Value FROM `tq_TQTo%s` WHERE TQId in ( %s )" % ( field, tqList ) )
+        if not result[ 'OK' ]:
+          return result
+        for tqId, value in result[ 'Value' ]:
+          newTQDefs[ tqId ].setdefault( field, [] ).append( value )
+    tqIndex.syncTaskQueues( tqPriorities, newTQDefs )
+    if newTQDefs:
+      self.log.info( "Added %s TQs to the TQ index, %s indexed" % ( len( newTQDefs ), tqIndex.getNumTaskQueues() ) )
+    return S_OK()
+
+  def __loadJobsForTQIndex( self, tqId, numJobs ):
+    result = self._query( "SELECT JobId FROM `tq_Jobs` WHERE TQId = %s ORDER BY RAND() / RealPriority ASC LIMIT %s",
+                          params = [ tqId, int( numJobs ) ] )
+    if not result[ 'OK' ]:
+      return S_ERROR( "Can't retrieve jobs for TQ %s: %s" % ( tqId, result[ 'Message' ] ) )
+    if not result[ 'Value' ]:
+      gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
+      self.__deleteTQWithDelay.add( tqId, 300, ( tqId, False, False ) )
+    return S_OK( [ row[0] for row in result[ 'Value' ] ] )
+
+  def __extractJobForTQIndex( self, jobId, tqId ):
+    """
+    Take the job out of the TQ. Only one matcher can succeed
+    """
+    result = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s AND TQId = %s", params = [ jobId, tqId ] )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ] == 0:
+      return S_OK( False )
+    self.__deleteTQWithDelay.add( tqId, 300, ( tqId, False, False ) )
+    return S_OK( True )
+
   def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, skipMatchDictDef = False,
                                   negativeCond = {}, connObj = False ):
     """
@@ -754,7 +873,8 @@ class TaskQueueDB( DB ):
       if not retVal[ 'OK' ]:
         return S_ERROR( "Can't delete job: %s" % retVal[ 'Message' ] )
       connObj = retVal[ 'Value' ]
-    retVal = self._query( "SELECT t.TQId, t.OwnerDN, t.OwnerGroup FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE j.JobId = %s AND t.TQId = j.TQId" % jobId, conn = connObj )
+    retVal = self._query( "SELECT t.TQId, t.OwnerDN, t.OwnerGroup FROM `tq_TaskQueues` t, `tq_Jobs` j WHERE j.JobId = %s AND t.TQId = j.TQId",
+                          conn = connObj, params = [ jobId ] )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not get job from task queue %s: %s" % ( jobId, retVal[ 'Message' ] ) )
     data = retVal[ 'Value' ]
@@ -762,9 +882,11 @@ class TaskQueueDB( DB ):
       return S_OK( False )
     tqId, tqOwnerDN, tqOwnerGroup = data[0]
     self.log.info( "Deleting job %s" % jobId )
-    retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s" % jobId, conn = connObj )
+    retVal = self._update( "DELETE FROM `tq_Jobs` WHERE JobId = %s", conn = connObj, params = [ jobId ] )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete job from task queue %s: %s" % ( jobId, retVal[ 'Message' ] ) )
+    if self.__tqIndex:
+      self.__tqIndex.forgetJob( jobId )
     if retVal['Value'] == 0:
       #No job deleted
       return S_OK( False )
@@ -772,6 +894,18 @@ class TaskQueueDB( DB ):
     self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
     return S_OK( True )
 
+  def reinsertJob( self, jobId, tqId, jobPriority ):
+    """
+    Put back in its task queue a job that was matched but could not be assigned
+    Return S_OK() / S_ERROR
+    """
+    retVal = self._query( "SELECT TQId FROM `tq_TaskQueues` WHERE TQId = %s", params = [ tqId ] )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Could not reinsert job %s in TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] ) )
+    if not retVal[ 'Value' ]:
+      return S_ERROR( "Could not reinsert job %s: TQ %s does not exist" % ( jobId, tqId ) )
+    return self.__insertJobInTaskQueue( jobId, tqId, int( jobPriority ), checkTQExists = False )
+
   def getTaskQueueForJob( self, jobId, connObj = False ):
     """
     Return TaskQueue for a given Job
@@ -783,7 +917,7 @@ class TaskQueueDB( DB ):
         return S_ERROR( "Can't get TQ for job: %s" % retVal[ 'Message' ] )
       connObj = retVal[ 'Value' ]
 
-    retVal = self._query( 'SELECT TQId FROM `tq_Jobs` WHERE JobId = %s ' % jobId, conn = connObj )
+    retVal = self._query( 'SELECT TQId FROM `tq_Jobs` WHERE JobId = %s ', conn = connObj, params = [ jobId ] )
 
     if not retVal[ 'OK' ]:
       return retVal
@@ -803,8 +937,8 @@ class TaskQueueDB( DB ):
         return S_ERROR( "Can't get TQs for a job list: %s" % retVal[ 'Message' ] )
       connObj = retVal[ 'Value' ]
 
-    jobString = ','.join( [ str( x ) for x in jobIDs ] )
-    retVal = self._query( 'SELECT JobId,TQId FROM `tq_Jobs` WHERE JobId in (%s) ' % jobString, conn = connObj )
+    retVal = self._query( 'SELECT JobId,TQId FROM `tq_Jobs` WHERE JobId in (%s) ', conn = connObj,
+                          params = [ [ int( x ) for x in jobIDs ] ] )
 
     if not retVal[ 'OK' ]:
       return retVal
@@ -819,7 +953,7 @@ class TaskQueueDB( DB ):
     return S_OK( resultDict )
 
   def __getOwnerForTaskQueue( self, tqId, connObj = False ):
-    retVal = self._query( "SELECT OwnerDN, OwnerGroup from `tq_TaskQueues` WHERE TQId=%s" % tqId, conn = connObj )
+    retVal = self._query( "SELECT OwnerDN, OwnerGroup from `tq_TaskQueues` WHERE TQId=%s", conn = connObj, params = [ tqId ] )
     if not retVal[ 'OK' ]:
       return retVal
     data = retVal[ 'Value' ]
@@ -855,15 +989,17 @@ class TaskQueueDB( DB ):
       if not data:
         return S_OK( False )
       tqOwnerDN, tqOwnerGroup = data
-    sqlCmd = "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND `tq_TaskQueues`.TQId = %s" % tqId
+    sqlCmd = "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND `tq_TaskQueues`.TQId = %s"
     sqlCmd = "%s AND `tq_TaskQueues`.TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )" % sqlCmd
-    retVal = self._update( sqlCmd, conn = connObj )
+    retVal = self._update( sqlCmd, conn = connObj, params = [ tqId ] )
     if not retVal[ 'OK' ]:
       return S_ERROR( "Could not delete task queue %s: %s" % ( tqId, retVal[ 'Message' ] ) )
     delTQ = retVal[ 'Value' ]
     if delTQ > 0:
+      if self.__tqIndex:
+        self.__tqIndex.removeTaskQueue( tqId )
       for mvField in self.__multiValueDefFields:
-        retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
+        retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %%s" % mvField, conn = connObj, params = [ tqId ] )
         if not retVal[ 'OK' ]:
           return retVal
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
@@ -902,6 +1038,8 @@ class TaskQueueDB( DB ):
       retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( field, tqId ), conn = connObj )
       if not retVal[ 'OK' ]:
         return retVal
+    if self.__tqIndex:
+      self.__tqIndex.removeTaskQueue( tqId )
     if delTQ > 0:
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
       return S_OK( True )
@@ -1146,6 +1284,9 @@ class TaskQueueDB( DB ):
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
       self._update( updateSQL, conn = connObj )
+      if self.__tqIndex:
+        for tqId in prioDict[ prio ]:
+          self.__tqIndex.setTaskQueuePriority( tqId, prio )
     return S_OK()
 
   def getGroupShares( self ):
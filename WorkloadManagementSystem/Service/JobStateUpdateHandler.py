@@ -16,25 +16,49 @@ __RCSID__ = "$Id$"
 from types import StringType, IntType, LongType, ListType, DictType
 # from types import *
 import time
-from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private.JobStateUpdateBuffer import JobStateUpdateBuffer, getStatusUpdate, \
+                                                                       JOB_FINAL_STATES
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
-
-JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+# Write-behind buffer of the status and heart beat updates, None if they are written directly
+updateBuffer = None
 
 def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global updateBuffer
   jobDB = JobDB()
   logDB = JobLoggingDB()
+
+  writeBehindPeriod = getServiceOption( serviceInfo, 'WriteBehindPeriod', 0 )
+  if writeBehindPeriod > 0:
+    updateBuffer = JobStateUpdateBuffer( jobDB, logDB,
+                                         maxJobs = getServiceOption( serviceInfo, 'WriteBehindMaxJobs', 5000 ),
+                                         spillFile = getServiceOption( serviceInfo, 'WriteBehindSpillFile', '' ) )
+    result = updateBuffer.initialize()
+    if not result['OK']:
+      return result
+    gThreadScheduler.addPeriodicTask( writeBehindPeriod, flushUpdateBuffer )
   return S_OK()
 
+def flushUpdateBuffer( jobIDs = None ):
+  """ Write the buffered updates, of the given jobs only if any
+  """
+  if not updateBuffer:
+    return S_OK()
+  result = updateBuffer.flush( jobIDs )
+  if not result['OK']:
+    gLogger.error( "Failed to write the buffered job updates", result['Message'] )
+  return result
+
 class JobStateUpdateHandler( RequestHandler ):
 
   ###########################################################################
@@ -98,6 +122,10 @@ class JobStateUpdateHandler( RequestHandler ):
 
   def __setJobStatus( self, jobID, status, minorStatus, source, datetime ):
     """ update the job status. """
+    # The buffered updates of the job are older than this one
+    if updateBuffer and updateBuffer.hasPending( jobID ):
+      flushUpdateBuffer( [ jobID ] )
+
     result = jobDB.setJobStatus( jobID, status, minorStatus )
     if not result['OK']:
       return result
@@ -128,17 +156,14 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set various status fields for job specified by its JobId.
         Set only the last status in the JobDB, updating all the status
         logging information in the JobLoggingDB. The statusDict has datetime
-        as a key and status information dictionary as values
+        as a key and status information dictionary as values.
+        With the write-behind buffer the update is only queued, unknown jobs are
+        dropped when it is written
     """
 
-    status = ""
-    minor = ""
-    application = ""
-    appCounter = ""
-    endDate = ''
-    startDate = ''
-    startFlag = ''
     jobID = int( jobID )
+    if updateBuffer:
+      return updateBuffer.addStatus( jobID, statusDict )
 
     result = jobDB.getJobAttributes( jobID, ['Status'] )
     if not result['OK']:
@@ -148,11 +173,8 @@ class JobStateUpdateHandler( RequestHandler ):
       # if there is no matching Job it returns an empty dictionary
       return S_ERROR( 'No Matching Job' )
 
-    new_status = result['Value']['Status']
-    if new_status == "Stalled":
-      status = 'Running'
-
     # Get the latest WN time stamps of status updates
+    currentStatus = result['Value']['Status']
     result = logDB.getWMSTimeStamps( int( jobID ) )
     if not result['OK']:
       return result
@@ -160,41 +182,8 @@ class JobStateUpdateHandler( RequestHandler ):
     from DIRAC import Time
     lastTime = Time.toString( Time.fromEpoch( lastTime ) )
 
-    # Get the last status values
-    dates = sorted( statusDict )
-    # We should only update the status if its time stamp is more recent than the last update
-    for date in [date for date in dates if date >= lastTime]:
-      sDict = statusDict[date]
-      if sDict['Status']:
-        status = sDict['Status']
-        if status in JOB_FINAL_STATES:
-          endDate = date
-        if status == "Running":
-          startFlag = 'Running'
-      if sDict['MinorStatus']:
-        minor = sDict['MinorStatus']
-        if minor == "Application" and startFlag == 'Running':
-          startDate = date
-      if sDict['ApplicationStatus']:
-        application = sDict['ApplicationStatus']
-      counter = sDict.get( 'ApplicationCounter' )
-      if counter:
-        appCounter = counter
-    attrNames = []
-    attrValues = []
-    if status:
-      attrNames.append( 'Status' )
-      attrValues.append( status )
-    if minor:
-      attrNames.append( 'MinorStatus' )
-      attrValues.append( minor )
-    if application:
-      attrNames.append( 'ApplicationStatus' )
-      attrValues.append( application )
-    if appCounter:
-      attrNames.append( 'ApplicationCounter' )
-      attrValues.append( appCounter )
-    result = jobDB.setJobAttributes( jobID, attrNames, attrValues, update = True )
+    attrDict, startDate, endDate, loggingRecords = getStatusUpdate( jobID, currentStatus, lastTime, statusDict )
+    result = jobDB.setJobAttributes( jobID, attrDict.keys(), attrDict.values(), update = True )
     if not result['OK']:
       return result
 
@@ -204,26 +193,7 @@ class JobStateUpdateHandler( RequestHandler ):
       result = jobDB.setStartExecTime( jobID, startDate )
 
     # Update the JobLoggingDB records
-    for date in dates:
-      sDict = statusDict[date]
-      status = sDict['Status']
-      if not status:
-        status = 'idem'
-      minor = sDict['MinorStatus']
-      if not minor:
-        minor = 'idem'
-      application = sDict['ApplicationStatus']
-      if not application:
-        application = 'idem'
-      else:
-        status = "Running"
-        minor = "Application"
-      source = sDict['Source']
-      result = logDB.addLoggingRecord( jobID, status, minor, application, date, source )
-      if not result['OK']:
-        return result
-
-    return S_OK()
+    return logDB.addLoggingRecords( loggingRecords )
 
   ###########################################################################
   types_setJobSite = [[StringType, IntType, LongType], StringType]
@@ -255,6 +225,9 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set the application status for job specified by its JobId.
     """
 
+    if updateBuffer and updateBuffer.hasPending( jobID ):
+      flushUpdateBuffer( [ int( jobID ) ] )
+
     result = jobDB.getJobAttributes( int( jobID ), ['Status', 'MinorStatus'] )
     if not result['OK']:
       return result
@@ -316,7 +289,10 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Send a heart beat sign of life for a job jobID
     """
 
-    result = jobDB.setHeartBeatData( int( jobID ), staticData, dynamicData )
+    if updateBuffer:
+      result = updateBuffer.addHeartBeat( int( jobID ), staticData, dynamicData )
+    else:
+      result = jobDB.setHeartBeatData( int( jobID ), staticData, dynamicData )
     if not result['OK']:
       gLogger.warn( 'Failed to set the heart beat data for job %d ' % int( jobID ) )
 
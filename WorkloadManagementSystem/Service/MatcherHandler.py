@@ -10,13 +10,13 @@ It also provides an XMLRPC interface to the Matcher
 __RCSID__ = "$Id$"
 
 import time
-from   types import StringType, DictType, StringTypes
+from   types import StringType, DictType, StringTypes, IntType, LongType
 import threading
 
 from DIRAC.ConfigurationSystem.Client.Helpers          import Registry, Operations
 from DIRAC.Core.DISET.RequestHandler                   import RequestHandler
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight         import ClassAd
-from DIRAC                                             import gLogger, S_OK, S_ERROR
+from DIRAC                                             import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.DB.JobDB           import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB    import JobLoggingDB
 from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB     import TaskQueueDB
@@ -35,6 +35,7 @@ gJobDB = False
 gJobLoggingDB = False
 gTaskQueueDB = False
 gPilotAgentsDB = False
+gSiteStatus = False
 
 def initializeMatcherHandler( serviceInfo ):
   """  Matcher Service initialization
@@ -44,6 +45,7 @@ def initializeMatcherHandler( serviceInfo ):
   global gJobLoggingDB
   global gTaskQueueDB
   global gPilotAgentsDB
+  global gSiteStatus
 
   # Create JobDB object and initialize its tables.
   gJobDB = JobDB( checkTables = True )
@@ -55,6 +57,7 @@ def initializeMatcherHandler( serviceInfo ):
   gPilotAgentsDB = PilotAgentsDB( checkTables = True )
   
   gTaskQueueDB   = TaskQueueDB()
+  gSiteStatus    = SiteStatus()
 
   gMonitor.registerActivity( 'matchTime', "Job matching time",
                              'Matching', "secs" , gMonitor.OP_MEAN, 300 )
@@ -64,6 +67,12 @@ def initializeMatcherHandler( serviceInfo ):
                              'Matching', "matches" , gMonitor.OP_RATE, 300 )
   gMonitor.registerActivity( 'numTQs', "Number of Task Queues",
                              'Matching', "tqsk queues" , gMonitor.OP_MEAN, 300 )
+  gMonitor.registerActivity( 'cacheHitRatio', "Matching data cache hit ratio",
+                             'Matching', "%" , gMonitor.OP_MEAN, 300 )
+  gMonitor.registerActivity( 'matchTimeSaved', "Time saved by the cache per match",
+                             'Matching', "secs" , gMonitor.OP_MEAN, 300 )
+
+  gConfig.addListenerToNewVersionEvent( clearCSCaches )
 
   gTaskQueueDB.recalculateTQSharesForAll()
   gThreadScheduler.addPeriodicTask( 120, gTaskQueueDB.recalculateTQSharesForAll )
@@ -81,9 +90,67 @@ def sendNumTaskQueues():
     gLogger.error( "Cannot get the number of task queues", result[ 'Message' ] )
 
 
+class MatchingCache:
+  """ Time bounded cache of the data needed to match, shared by all the requests.
+      Keeps how long it took to get each value to know the time saved by the hits
+  """
+
+  def __init__( self ):
+    self.__cache = DictCache()
+    self.__loadTime = {}
+    self.__hits = 0
+    self.__misses = 0
+
+  def get( self, cKey, lifeTime, loadFunction, *args ):
+    """ Get the value from the cache or load it with loadFunction( *args ) -> S_OK( value )
+        Returns S_OK( ( value, timeSaved ) )
+    """
+    value = self.__cache.get( cKey )
+    if value is not None:
+      self.__hits += 1
+      gMonitor.addMark( 'cacheHitRatio', 100 )
+      return S_OK( ( value, self.__loadTime.get( cKey, 0 ) ) )
+    startTime = time.time()
+    result = loadFunction( *args )
+    if not result[ 'OK' ]:
+      return result
+    self.__misses += 1
+    gMonitor.addMark( 'cacheHitRatio', 0 )
+    self.__loadTime[ cKey ] = time.time() - startTime
+    self.__cache.add( cKey, lifeTime, result[ 'Value' ] )
+    return S_OK( ( result[ 'Value' ], 0 ) )
+
+  def peek( self, cKey ):
+    """ Get the cached value if any, without loading it
+    """
+    return self.__cache.get( cKey )
+
+  def invalidate( self, cKey = None ):
+    """ Drop one key or everything
+    """
+    if cKey is None:
+      self.__cache.purgeAll()
+    else:
+      self.__cache.delete( cKey )
+
+  def getStats( self ):
+    return { 'Hits' : self.__hits, 'Misses' : self.__misses }
+
+#CS limits, JobDB running counters and site mask
+gCSDataCache = MatchingCache()
+gCounterCache = MatchingCache()
+gSiteMaskCache = MatchingCache()
+
+def clearCSCaches( _eventName, _params ):
+  """ A new CS version may change the limits
+  """
+  gCSDataCache.invalidate()
+  Limiter.clearConditions()
+  return S_OK()
+
+
 class Limiter:
 
-  __csDictCache = DictCache()
   __condCache = DictCache()
   __delayMem = {}
 
@@ -93,6 +160,26 @@ class Limiter:
     self.__runningLimitSection = "JobScheduling/RunningLimit"
     self.__matchingDelaySection = "JobScheduling/MatchingDelay"
     self.__opsHelper = opsHelper
+    self.__timeSaved = 0
+
+  @classmethod
+  def clearConditions( cls ):
+    cls.__condCache.purgeAll()
+
+  def getTimeSaved( self ):
+    """ Time saved by the cached data since the last call
+    """
+    timeSaved = self.__timeSaved
+    self.__timeSaved = 0
+    return timeSaved
+
+  def __getCached( self, cache, cKey, lifeTime, loadFunction, *args ):
+    result = cache.get( cKey, lifeTime, loadFunction, *args )
+    if not result[ 'OK' ]:
+      return result
+    value, timeSaved = result[ 'Value' ]
+    self.__timeSaved += timeSaved
+    return S_OK( value )
 
   def checkJobLimit( self ):
     return self.__opsHelper.getValue( "JobScheduling/CheckJobLimits", True )
@@ -181,10 +268,9 @@ class Limiter:
     """ Extract limiting information from the CS in the form:
         { 'JobType' : { 'Merge' : 20, 'MCGen' : 1000 } }
     """
-    stuffDict = Limiter.__csDictCache.get( section )
-    if stuffDict:
-      return S_OK( stuffDict )
+    return self.__getCached( gCSDataCache, section, 300, self.__loadCSData, section )
 
+  def __loadCSData( self, section ):
     result = self.__opsHelper.getSections( section )
     if not result['OK']:
       return result
@@ -203,7 +289,6 @@ class Limiter:
         return S_ERROR( errMsg )
       stuffDict[ attName ] = attLimits
 
-    Limiter.__csDictCache.add( section, 300, stuffDict )
     return S_OK( stuffDict )
 
   def __getRunningCondition( self, siteName ):
@@ -223,15 +308,11 @@ class Limiter:
       if attName not in gJobDB.jobAttributeNames:
         gLogger.error( "Attribute %s does not exist. Check the job limits" % attName )
         continue
-      cK = "Running:%s:%s" % ( siteName, attName )
-      data = self.__condCache.get( cK )
-      if not data:
-        result = gJobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
-        if not result[ 'OK' ]:
-          return result
-        data = result[ 'Value' ]
-        data = dict( [ ( k[0][ attName ], k[1] )  for k in data ] )
-        self.__condCache.add( cK, 10, data )
+      result = self.__getCached( gCounterCache, ( siteName, attName ), 10,
+                                 self.__loadRunningCounters, siteName, attName )
+      if not result[ 'OK' ]:
+        return result
+      data = result[ 'Value' ]
       for attValue in limitsDict[ attName ]:
         limit = limitsDict[ attName ][ attValue ]
         running = data.get( attValue, 0 )
@@ -244,6 +325,23 @@ class Limiter:
     #negCond is something like : {'JobType': ['Merge']}
     return S_OK( negCond )
 
+  def __loadRunningCounters( self, siteName, attName ):
+    result = gJobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( dict( [ ( k[0][ attName ], k[1] )  for k in result[ 'Value' ] ] ) )
+
+  def invalidateRunningCounters( self, siteName ):
+    """ The state of a job of the site changed behind the counters
+    """
+    result = self.__extractCSData( "%s/%s" % ( self.__runningLimitSection, siteName ) )
+    if not result[ 'OK' ]:
+      return result
+    for attName in result[ 'Value' ]:
+      gCounterCache.invalidate( ( siteName, attName ) )
+    Limiter.__condCache.delete( "GLOBAL" )
+    return S_OK()
+
   def updateDelayCounters( self, siteName, jid ):
     #Get the info from the CS
     siteSection = "%s/%s" % ( self.__matchingDelaySection, siteName )
@@ -279,6 +377,31 @@ class Limiter:
         delayCounter.add( ( attName, attValue ), delayTime )
     return S_OK()
 
+  def updateRunningCounters( self, siteName, jid ):
+    """ Count a job just matched in the cached running counters of the site,
+        so the limits hold until the counters are refreshed from the JobDB
+    """
+    siteSection = "%s/%s" % ( self.__runningLimitSection, siteName )
+    result = self.__extractCSData( siteSection )
+    if not result['OK']:
+      return result
+    limitsDict = result[ 'Value' ]
+    attNames = [ attName for attName in limitsDict if attName in gJobDB.jobAttributeNames ]
+    if not attNames:
+      return S_OK()
+    result = gJobDB.getJobAttributes( jid, attNames )
+    if not result[ 'OK' ]:
+      return result
+    atts = result[ 'Value' ]
+    for attName in atts:
+      data = gCounterCache.peek( ( siteName, attName ) )
+      if data is not None:
+        attValue = atts[ attName ]
+        data[ attValue ] = data.get( attValue, 0 ) + 1
+    #The global conditions have to include the new job too
+    Limiter.__condCache.delete( "GLOBAL" )
+    return S_OK()
+
   def __getDelayCondition( self, siteName ):
     """ Get extra conditions allowing matching delay
     """
@@ -306,7 +429,7 @@ class MatcherHandler( RequestHandler ):
   def initialize( self ):
     self.__opsHelper = self.__getOpsHelper()
     self.__limiter = Limiter( self.__opsHelper )
-    self.__siteStatus = SiteStatus()
+    self.__timeSaved = 0
 
   def __getOpsHelper( self, setup = False, vo = False ):
     if not setup:
@@ -372,8 +495,65 @@ class MatcherHandler( RequestHandler ):
     """ Main job selection function to find the highest priority job
         matching the resource capacity
     """
+    result = self.selectJobs( resourceDescription, 1 )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( result[ 'Value' ][0] )
 
+  def selectJobs( self, resourceDescription, numJobs ):
+    """ Find up to numJobs jobs matching the resource capacity. The checks of the
+        resource are done once, the limits are evaluated again for each job
+    """
     startTime = time.time()
+    result = self.__prepareResource( resourceDescription )
+    if not result[ 'OK' ]:
+      return result
+    resourceDict = result[ 'Value' ]
+    siteName = resourceDict[ 'Site' ]
+    pilotReference = resourceDict.get( 'PilotReference', '' )
+
+    jobs = []
+    while len( jobs ) < numJobs:
+      negativeCond = self.__limiter.getNegativeCondForSite( siteName )
+      result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
+
+      if DEBUG:
+        print result
+
+      if not result['OK']:
+        if jobs:
+          break
+        return result
+      matchData = result['Value']
+      if not matchData['matchFound']:
+        break
+
+      result = self.__assignJob( matchData['jobId'], siteName, pilotReference )
+      if not result[ 'OK' ]:
+        #The job is already out of the TQ, put it back if it can still run
+        if result.get( 'Requeue' ):
+          self.__requeueJob( matchData['jobId'], matchData['taskQueueId'] )
+        if not jobs:
+          return result
+        #Do not keep taking jobs out of the TQs while the DBs are failing
+        gLogger.warn( "Could not assign matched job", result[ 'Message' ] )
+        break
+      resultDict = result[ 'Value' ]
+      resultDict['PilotInfoReportedFlag'] = resourceDict.get( 'PilotInfoReportedFlag', False )
+      jobs.append( resultDict )
+
+    gMonitor.addMark( "matchTimeSaved", self.__timeSaved + self.__limiter.getTimeSaved() )
+    if not jobs:
+      return S_ERROR( 'No match found' )
+
+    matchTime = time.time() - startTime
+    gLogger.info( "Match time: [%s] for %s jobs" % ( str( matchTime ), len( jobs ) ) )
+    gMonitor.addMark( "matchTime", matchTime )
+    return S_OK( jobs )
+
+  def __prepareResource( self, resourceDescription ):
+    """ Check the pilot and build the resource dict to match with
+    """
     resourceDict = self.__processResourceDescription( resourceDescription )
 
     credDict = self.getRemoteCredentials()
@@ -442,20 +622,22 @@ class MatcherHandler( RequestHandler ):
                                               destination = gridCE,
                                               benchmark = benchmark )
       if result['OK']:
-        pilotInfoReported = True                                        
-    
+        pilotInfoReported = True
+    resourceDict[ 'PilotInfoReportedFlag' ] = pilotInfoReported
+
     #Check the site mask
     if not 'Site' in resourceDict:
       return S_ERROR( 'Missing Site Name in Resource JDL' )
 
     # Get common site mask and check the agent site
-    result = self.__siteStatus.getUsableSites( 'ComputingAccess' )
+    result = gSiteMaskCache.get( 'ComputingAccess', 30, gSiteStatus.getUsableSites, 'ComputingAccess' )
     if not result['OK']:
       return S_ERROR( 'Internal error: can not get site mask' )
-    usableSites = result['Value']
+    usableSites, timeSaved = result['Value']
+    self.__timeSaved = timeSaved
 
     siteName = resourceDict['Site']
-    if siteName not in maskList:
+    if siteName not in usableSites:
       
       # if 'GridCE' not in resourceDict:
       #  return S_ERROR( 'Site not in mask and GridCE not specified' )
@@ -471,26 +653,33 @@ class MatcherHandler( RequestHandler ):
     for key in resourceDict:
       gLogger.verbose( "%s : %s" % ( key.rjust( 20 ), resourceDict[ key ] ) )
 
-    negativeCond = self.__limiter.getNegativeCondForSite( siteName )
-    result = gTaskQueueDB.matchAndGetJob( resourceDict, negativeCond = negativeCond )
-
-    if DEBUG:
-      print result
+    return S_OK( resourceDict )
 
-    if not result['OK']:
-      return result
-    result = result['Value']
-    if not result['matchFound']:
-      return S_ERROR( 'No match found' )
+  def __requeueJob( self, jobID, tqID ):
+    """ Put back in its TQ a matched job that is still Waiting
+    """
+    jobPriority = 1
+    result = gJobDB.getJobAttributes( jobID, [ 'UserPriority' ] )
+    if result[ 'OK' ] and result[ 'Value' ].get( 'UserPriority' ) is not None:
+      jobPriority = result[ 'Value' ][ 'UserPriority' ]
+    result = gTaskQueueDB.reinsertJob( jobID, tqID, jobPriority )
+    if not result[ 'OK' ]:
+      gLogger.error( "Could not put back the job in its TQ", "%s: %s" % ( jobID, result[ 'Message' ] ) )
+    return result
 
-    jobID = result['jobId']
+  def __assignJob( self, jobID, siteName, pilotReference ):
+    """ Set the matched job as Matched and get what the pilot needs to run it
+    """
     resAtt = gJobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup', 'Status'] )
     if not resAtt['OK']:
-      return S_ERROR( 'Could not retrieve job attributes' )
+      result = S_ERROR( 'Could not retrieve job attributes' )
+      result[ 'Requeue' ] = True
+      return result
     if not resAtt['Value']:
       return S_ERROR( 'No attributes returned for job' )
     if not resAtt['Value']['Status'] == 'Waiting':
       gLogger.error( 'Job matched by the TQ is not in Waiting state', str( jobID ) )
+      self.__limiter.invalidateRunningCounters( siteName )
       result = gTaskQueueDB.deleteJob( jobID )
       if not result[ 'OK' ]:
         return result
@@ -499,6 +688,10 @@ class MatcherHandler( RequestHandler ):
     attNames = ['Status','MinorStatus','ApplicationStatus','Site']
     attValues = ['Matched','Assigned','Unknown',siteName]
     result = gJobDB.setJobAttributes( jobID, attNames, attValues )
+    if not result['OK']:
+      result = S_ERROR( 'Could not set the job as Matched: %s' % result['Message'] )
+      result[ 'Requeue' ] = True
+      return result
     # result = gJobDB.setJobStatus( jobID, status = 'Matched', minor = 'Assigned' )
     result = gJobLoggingDB.addLoggingRecord( jobID,
                                              status = 'Matched',
@@ -513,10 +706,6 @@ class MatcherHandler( RequestHandler ):
     resultDict['JDL'] = result['Value']
     resultDict['JobID'] = jobID
 
-    matchTime = time.time() - startTime
-    gLogger.info( "Match time: [%s]" % str( matchTime ) )
-    gMonitor.addMark( "matchTime", matchTime )
-
     # Get some extra stuff into the response returned
     resOpt = gJobDB.getJobOptParameters( jobID )
     if resOpt['OK']:
@@ -530,6 +719,8 @@ class MatcherHandler( RequestHandler ):
 
     if self.__opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
       self.__limiter.updateDelayCounters( siteName, jobID )
+    if self.__limiter.checkJobLimit():
+      self.__limiter.updateRunningCounters( siteName, jobID )
 
     # Report pilot-job association
     if pilotReference:
@@ -538,7 +729,6 @@ class MatcherHandler( RequestHandler ):
 
     resultDict['DN'] = resAtt['Value']['OwnerDN']
     resultDict['Group'] = resAtt['Value']['OwnerGroup']
-    resultDict['PilotInfoReportedFlag'] = pilotInfoReported
     return S_OK( resultDict )
 
 ##############################################################################
@@ -554,6 +744,22 @@ class MatcherHandler( RequestHandler ):
       gMonitor.addMark( "matchesOK" )
     return result
 
+##############################################################################
+  types_requestJobs = [ [StringType, DictType], [IntType, LongType] ]
+  def export_requestJobs( self, resourceDescription, numJobs ):
+    """ Serve up to numJobs jobs to an agent running several jobs in parallel,
+        like the PoolComputingElement does. Returns the list of the matched jobs
+        with the same information requestJob returns for one
+    """
+    if numJobs < 1:
+      return S_ERROR( "The number of jobs has to be positive" )
+    maxJobs = self.__opsHelper.getValue( "JobScheduling/MaxJobsPerRequest", 64 )
+    result = self.selectJobs( resourceDescription, min( numJobs, maxJobs ) )
+    gMonitor.addMark( "matchesDone" )
+    if result[ 'OK' ]:
+      gMonitor.addMark( "matchesOK", len( result[ 'Value' ] ) )
+    return result
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
@@ -0,0 +1,393 @@
+""" Write-behind buffer of the job status and heart beat updates received by the
+    JobStateUpdate service
+
+    The updates are coalesced per job in memory and written periodically with a few
+    multi row statements instead of several statements per call. Within a job the most
+    recent information wins: status entries are ordered by their date as in
+    setJobStatusBulk, static heart beat data by the time they were received, and a heart
+    beat only sets the job Running if it was received after the last status update.
+
+    Each accepted update is also appended to a spill file (one JSON record per line) that is
+    replayed when the service starts, so the pending updates survive a crash. The updates
+    are written at least once: a crash in the middle of a flush can write some of them twice.
+
+    If the databases can not be read the updates are kept for the next flush. If writing
+    a batch fails, its jobs are written one by one and the updates of a job that still fails
+    are dropped and logged, so that one bad update does not block all the others.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import json
+import threading
+from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities import Time
+
+JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+
+def getStatusUpdate( jobID, currentStatus, lastTime, statusDict ):
+  """ Evaluate what a setJobStatusBulk call does to a job given its current status and the
+      time of its last status transition. The statusDict has datetime as a key and status
+      information dictionary as values. Only the entries more recent than lastTime change
+      the job attributes, all of them are logged.
+
+      :return: ( attrDict, startDate, endDate, loggingRecords ) with the { name : value }
+               attributes to set, the StartExecTime and EndExecTime to set if not empty and
+               the records for JobLoggingDB.addLoggingRecords
+  """
+  status = ""
+  minor = ""
+  application = ""
+  appCounter = ""
+  endDate = ''
+  startDate = ''
+  startFlag = ''
+
+  if currentStatus == "Stalled":
+    status = 'Running'
+
+  # Get the last status values
+  dates = sorted( statusDict )
+  # We should only update the status if its time stamp is more recent than the last update
+  for date in [date for date in dates if date >= lastTime]:
+    sDict = statusDict[date]
+    if sDict['Status']:
+      status = sDict['Status']
+      if status in JOB_FINAL_STATES:
+        endDate = date
+      if status == "Running":
+        startFlag = 'Running'
+    if sDict['MinorStatus']:
+      minor = sDict['MinorStatus']
+      if minor == "Application" and startFlag == 'Running':
+        startDate = date
+    if sDict['ApplicationStatus']:
+      application = sDict['ApplicationStatus']
+    counter = sDict.get( 'ApplicationCounter' )
+    if counter:
+      appCounter = counter
+  attrDict = {}
+  if status:
+    attrDict['Status'] = status
+  if minor:
+    attrDict['MinorStatus'] = minor
+  if application:
+    attrDict['ApplicationStatus'] = application
+  if appCounter:
+    attrDict['ApplicationCounter'] = appCounter
+
+  loggingRecords = []
+  for date in dates:
+    sDict = statusDict[date]
+    status = sDict['Status']
+    if not status:
+      status = 'idem'
+    minor = sDict['MinorStatus']
+    if not minor:
+      minor = 'idem'
+    application = sDict['ApplicationStatus']
+    if not application:
+      application = 'idem'
+    else:
+      status = "Running"
+      minor = "Application"
+    loggingRecords.append( ( jobID, status, minor, application, date, sDict['Source'] ) )
+
+  return attrDict, startDate, endDate, loggingRecords
+
+class JobStateUpdateBuffer:
+  """ Pending status and heart beat updates of the jobs, kept per job as
+      { 'StatusDict' : merged setJobStatusBulk status dictionaries,
+        'StatusTime' : time the last status update was received,
+        'HeartBeatTime' : time the last heart beat was received,
+        'StaticData' : merged heart beat static data,
+        'DynamicData' : { ( name, time received ) : value } }
+  """
+
+  def __init__( self, jobDB, logDB, maxJobs = 0, spillFile = '' ):
+    self.jobDB = jobDB
+    self.logDB = logDB
+    self.maxJobs = maxJobs
+    self.spillFile = spillFile
+    self.log = gLogger.getSubLogger( 'JobStateUpdateBuffer' )
+    # Protects the pending updates and the spill file
+    self.__lock = threading.Lock()
+    # Only one flush at a time, so the batches are written in order
+    self.__flushLock = threading.Lock()
+    self.__jobs = {}
+    self.__spill = None
+
+  def initialize( self ):
+    """ Load the updates left in the spill files by the previous run of the service
+    """
+    if not self.spillFile:
+      return S_OK( 0 )
+    self.__lock.acquire()
+    try:
+      for fileName in ( '%s.flushing' % self.spillFile, self.spillFile ):
+        if not os.path.exists( fileName ):
+          continue
+        for line in open( fileName ):
+          try:
+            record = json.loads( line )
+          except ValueError:
+            # The last line can be truncated by a crash
+            self.log.warn( "Skipping an unreadable record of the spill file", fileName )
+            continue
+          self.__merge( record )
+      result = self.__rewriteSpill()
+      if not result['OK']:
+        return result
+      flushingFile = '%s.flushing' % self.spillFile
+      if os.path.exists( flushingFile ):
+        os.unlink( flushingFile )
+      if self.__jobs:
+        self.log.info( "Loaded pending updates from the spill file", "for %d jobs" % len( self.__jobs ) )
+      return S_OK( len( self.__jobs ) )
+    finally:
+      self.__lock.release()
+
+  def addStatus( self, jobID, statusDict ):
+    """ Buffer a setJobStatusBulk call
+    """
+    return self.__add( { 'Type' : 'Status', 'JobID' : int( jobID ), 'Time' : Time.toString(),
+                         'StatusDict' : statusDict } )
+
+  def addHeartBeat( self, jobID, staticData, dynamicData ):
+    """ Buffer a sendHeartBeat call
+    """
+    receiveTime = Time.toString()
+    return self.__add( { 'Type' : 'HeartBeat', 'JobID' : int( jobID ), 'Time' : receiveTime,
+                         'StaticData' : staticData,
+                         'DynamicData' : [ ( name, value, receiveTime ) for name, value in dynamicData.items() ] } )
+
+  def hasPending( self, jobID ):
+    return int( jobID ) in self.__jobs
+
+  def getNumberOfJobs( self ):
+    return len( self.__jobs )
+
+  def __add( self, record ):
+    self.__lock.acquire()
+    try:
+      self.__merge( record )
+      if self.spillFile:
+        try:
+          if self.__spill is None:
+            self.__spill = open( self.spillFile, 'a' )
+          self.__spill.write( json.dumps( record ) + '\n' )
+          self.__spill.flush()
+        except IOError, x:
+          self.log.error( "Failed to write to the spill file", "%s: %s" % ( self.spillFile, str( x ) ) )
+      numberOfJobs = len( self.__jobs )
+    finally:
+      self.__lock.release()
+    if self.maxJobs and numberOfJobs >= self.maxJobs:
+      result = self.flush()
+      if not result['OK']:
+        self.log.error( "Failed to flush the pending job updates", result['Message'] )
+    return S_OK()
+
+  def __merge( self, record ):
+    """ Merge a status or heart beat record into the pending updates of its job
+    """
+    entry = self.__jobs.setdefault( int( record['JobID'] ), { 'StatusDict' : {},
+                                                             'StatusTime' : '',
+                                                             'HeartBeatTime' : '',
+                                                             'StaticData' : {},
+                                                             'DynamicData' : {} } )
+    if record['Type'] == 'Status':
+      entry['StatusDict'].update( record['StatusDict'] )
+      entry['StatusTime'] = max( entry['StatusTime'], record['Time'] )
+    else:
+      if record['Time'] >= entry['HeartBeatTime']:
+        entry['StaticData'].update( record['StaticData'] )
+        entry['HeartBeatTime'] = record['Time']
+      else:
+        for name, value in record['StaticData'].items():
+          entry['StaticData'].setdefault( name, value )
+      for name, value, receiveTime in record['DynamicData']:
+        entry['DynamicData'][( name, receiveTime )] = value
+
+  def __getRecords( self, jobID, entry ):
+    """ Records that recreate the pending updates of a job when merged
+    """
+    records = []
+    if entry['StatusTime']:
+      records.append( { 'Type' : 'Status', 'JobID' : jobID, 'Time' : entry['StatusTime'],
+                        'StatusDict' : entry['StatusDict'] } )
+    if entry['HeartBeatTime']:
+      records.append( { 'Type' : 'HeartBeat', 'JobID' : jobID, 'Time' : entry['HeartBeatTime'],
+                        'StaticData' : entry['StaticData'],
+                        'DynamicData' : [ ( name, value, receiveTime )
+                                          for ( name, receiveTime ), value in entry['DynamicData'].items() ] } )
+    return records
+
+  def __rewriteSpill( self ):
+    """ Replace the spill file by the current pending updates
+    """
+    if not self.spillFile:
+      return S_OK()
+    if self.__spill is not None:
+      self.__spill.close()
+      self.__spill = None
+    try:
+      newSpill = open( '%s.new' % self.spillFile, 'w' )
+      for jobID, entry in self.__jobs.items():
+        for record in self.__getRecords( jobID, entry ):
+          newSpill.write( json.dumps( record ) + '\n' )
+      newSpill.flush()
+      os.fsync( newSpill.fileno() )
+      newSpill.close()
+      os.rename( '%s.new' % self.spillFile, self.spillFile )
+    except ( IOError, OSError ), x:
+      return S_ERROR( "Failed to rewrite the spill file %s: %s" % ( self.spillFile, str( x ) ) )
+    return S_OK()
+
+  def flush( self, jobIDs = None ):
+    """ Write the pending updates of the given jobs, of all of them by default.
+        On failure they are kept to be written by the next flush
+    """
+    self.__flushLock.acquire()
+    try:
+      self.__lock.acquire()
+      try:
+        if jobIDs is None:
+          batch = self.__jobs
+          self.__jobs = {}
+        else:
+          batch = {}
+          for jobID in jobIDs:
+            if int( jobID ) in self.__jobs:
+              batch[int( jobID )] = self.__jobs.pop( int( jobID ) )
+        if not batch:
+          return S_OK( 0 )
+        # The spill file moves aside until the batch is written, the new one only gets the rest
+        if self.spillFile and os.path.exists( self.spillFile ):
+          if self.__spill is not None:
+            self.__spill.close()
+            self.__spill = None
+          os.rename( self.spillFile, '%s.flushing' % self.spillFile )
+          result = self.__rewriteSpill()
+          if not result['OK']:
+            self.log.error( result['Message'] )
+      finally:
+        self.__lock.release()
+
+      result, kept = self.__writeJobs( batch )
+
+      self.__lock.acquire()
+      try:
+        if kept:
+          # Put the jobs back, the updates received meanwhile are more recent
+          pending = self.__jobs
+          self.__jobs = kept
+          for jobID, entry in pending.items():
+            for record in self.__getRecords( jobID, entry ):
+              self.__merge( record )
+          spillResult = self.__rewriteSpill()
+          if not spillResult['OK']:
+            self.log.error( spillResult['Message'] )
+            return result
+        if self.spillFile and os.path.exists( '%s.flushing' % self.spillFile ):
+          os.unlink( '%s.flushing' % self.spillFile )
+      finally:
+        self.__lock.release()
+      if not result['OK']:
+        return result
+      return S_OK( len( batch ) - len( kept ) )
+    finally:
+      self.__flushLock.release()
+
+  def __writeJobs( self, batch ):
+    """ Write a batch, then job by job if it fails. The jobs that could not be written because
+        the databases could not be read are returned to be kept, the others are dropped
+    """
+    # The jobs unknown to the JobDB are removed from the batch
+    result = self.__writeBatch( batch )
+    if result['OK']:
+      return result, {}
+    if result.get( 'NothingWritten' ):
+      return result, batch
+    jobIDs = batch.keys()
+    self.log.warn( "Failed to write the updates of %d jobs, writing them one by one" % len( jobIDs ),
+                   result['Message'] )
+    failed = 0
+    for i, jobID in enumerate( jobIDs ):
+      jobResult = self.__writeBatch( { jobID : batch[jobID] } )
+      if jobResult['OK']:
+        continue
+      if jobResult.get( 'NothingWritten' ):
+        # The databases are not available any more, keep the rest for the next flush
+        return jobResult, dict( [ ( remainingID, batch[remainingID] ) for remainingID in jobIDs[i:] ] )
+      failed += 1
+      self.log.error( "Dropping the pending updates of job %s" % jobID,
+                      "%s: %s" % ( jobResult['Message'], json.dumps( self.__getRecords( jobID, batch[jobID] ) ) ) )
+    if failed:
+      return S_ERROR( "Dropped the pending updates of %d jobs" % failed ), {}
+    return S_OK(), {}
+
+  def __writeBatch( self, batch ):
+    """ Write the updates of a batch of jobs with one statement per table and kind of update.
+        The error has NothingWritten set if it happened before anything was written
+    """
+    jobIDs = batch.keys()
+    result = self.jobDB.getAttributesForJobList( jobIDs, ['Status'] )
+    if not result['OK']:
+      result['NothingWritten'] = True
+      return result
+    jobStatus = result['Value']
+    for jobID in jobIDs:
+      if jobID not in jobStatus:
+        self.log.warn( "Dropping the pending updates of a job not in the JobDB", jobID )
+        del batch[jobID]
+
+    statusJobIDs = [ jobID for jobID in batch if batch[jobID]['StatusDict'] ]
+    result = self.logDB.getLastStatusTimes( statusJobIDs )
+    if not result['OK']:
+      result['NothingWritten'] = True
+      return result
+    lastTimes = result['Value']
+
+    attrDict = {}
+    startDates = {}
+    endDates = {}
+    loggingRecords = []
+    for jobID in statusJobIDs:
+      lastTime = ''
+      if jobID in lastTimes:
+        lastTime = Time.toString( Time.fromEpoch( float( lastTimes[jobID] ) ) )
+      jobAttrDict, startDate, endDate, jobRecords = getStatusUpdate( jobID, jobStatus[jobID]['Status'], lastTime,
+                                                                    batch[jobID]['StatusDict'] )
+      attrDict[jobID] = jobAttrDict
+      if startDate:
+        startDates[jobID] = startDate
+      if endDate:
+        endDates[jobID] = endDate
+      loggingRecords += jobRecords
+
+    result = self.jobDB.setJobAttributesBulk( attrDict, update = True )
+    if not result['OK']:
+      return result
+    for jobID, endDate in endDates.items():
+      self.jobDB.setEndExecTime( jobID, endDate )
+    for jobID, startDate in startDates.items():
+      self.jobDB.setStartExecTime( jobID, startDate )
+    result = self.logDB.addLoggingRecords( loggingRecords )
+    if not result['OK']:
+      return result
+
+    heartBeatDict = {}
+    for jobID, entry in batch.items():
+      if not entry['HeartBeatTime']:
+        continue
+      heartBeatDict[jobID] = { 'HeartBeatTime' : entry['HeartBeatTime'],
+                               'SetRunning' : entry['HeartBeatTime'] > entry['StatusTime'],
+                               'StaticData' : entry['StaticData'],
+                               'DynamicData' : [ ( name, value, receiveTime )
+                                                 for ( name, receiveTime ), value in entry['DynamicData'].items() ] }
+    result = self.jobDB.setHeartBeatDataBulk( heartBeatDict )
+    if not result['OK']:
+      self.log.warn( 'Failed to set the heart beat data', result['Message'] )
+    return S_OK()
@@ -0,0 +1,413 @@
+""" In memory index of the task queues used to match resources without going through the
+    multi join match query of the TaskQueueDB
+
+    Task queues are indexed by the values of their match fields. Matching a resource
+    intersects the sets of task queues allowed by each field and then checks the
+    conditions that can't be indexed (owners, banning, tags). The index also keeps for
+    each task queue a list of candidate jobs loaded from the DB, so taking a job only
+    needs the DB for the atomic extraction.
+
+    The conditions are the same ones the TaskQueueDB applies in SQL.
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import heapq
+import random
+import threading
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Security import Properties, CS
+
+#Match field -> task queue definition field
+MULTI_VALUE_MATCH_FIELDS = { 'GridCE' : 'GridCEs',
+                             'Site' : 'Sites',
+                             'GridMiddleware' : 'GridMiddlewares',
+                             'Platform' : 'Platforms',
+                             'PilotType' : 'PilotTypes',
+                             'SubmitPool' : 'SubmitPools',
+                             'JobType' : 'JobTypes',
+                             'Tag' : 'Tags' }
+TAG_MATCH_FIELDS = ( 'Tag', )
+STRICT_REQUIRE_MATCH_FIELDS = ( 'SubmitPool', 'Platform', 'PilotType', 'Tag' )
+SINGLE_VALUE_FIELDS = ( 'OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime' )
+
+def _toList( value ):
+  if type( value ) in ( list, tuple ):
+    return list( value )
+  return [ value ]
+
+class TaskQueueIndex:
+
+  def __init__( self, multiValueDefFields, jobLoader, jobExtractor, numJobsPerLoad = 50, emptyTQRetry = 30 ):
+    """
+    :param jobLoader: function( tqId, numJobs ) -> S_OK( [ jobId, ... ] ) in priority order
+    :param jobExtractor: function( jobId, tqId ) -> S_OK( True ) if the job has been taken out of the TQ
+    """
+    self.__multiValueDefFields = tuple( multiValueDefFields )
+    self.__jobLoader = jobLoader
+    self.__jobExtractor = jobExtractor
+    self.__numJobsPerLoad = numJobsPerLoad
+    self.__emptyTQRetry = emptyTQRetry
+    self.__lock = threading.Lock()
+    self.__tqs = {}
+    self.__bySetup = {}
+    self.__byCPUTime = {}
+    self.__byValue = dict( [ ( field, {} ) for field in self.__multiValueDefFields ] )
+    self.__withoutValues = dict( [ ( field, set() ) for field in self.__multiValueDefFields ] )
+    #tqId -> list of candidate jobs, next one at the end
+    self.__candidateJobs = {}
+    self.__jobToTQ = {}
+    #tqId -> time it was found empty
+    self.__emptyTQs = {}
+    self.__jobSharingGroups = {}
+
+  #
+  # Index maintenance
+  #
+
+  def getTaskQueueIds( self ):
+    return self.__tqs.keys()
+
+  def getNumTaskQueues( self ):
+    return len( self.__tqs )
+
+  def getNumCandidateJobs( self ):
+    return len( self.__jobToTQ )
+
+  def setTaskQueue( self, tqId, tqDef ):
+    """
+    Add or replace a task queue. tqDef has the single value fields, Priority and
+    the multi value fields that are defined for the task queue
+    """
+    self.__lock.acquire()
+    try:
+      if tqId in self.__tqs:
+        self.__unindex( tqId )
+      self.__index( tqId, tqDef )
+    finally:
+      self.__lock.release()
+
+  def removeTaskQueue( self, tqId ):
+    self.__lock.acquire()
+    try:
+      if tqId in self.__tqs:
+        self.__unindex( tqId )
+    finally:
+      self.__lock.release()
+
+  def setTaskQueuePriority( self, tqId, priority ):
+    tqData = self.__tqs.get( tqId )
+    if tqData:
+      tqData[ 'Priority' ] = priority
+
+  def syncTaskQueues( self, tqPriorities, newTQDefs ):
+    """
+    Bring the index in sync with the DB.
+    :param tqPriorities: dict tqId -> priority of all the task queues in the DB
+    :param newTQDefs: dict tqId -> definition of the task queues not yet in the index
+    """
+    self.__lock.acquire()
+    try:
+      for tqId in list( self.__tqs ):
+        if tqId not in tqPriorities:
+          self.__unindex( tqId )
+      for tqId in newTQDefs:
+        if tqId in self.__tqs:
+          self.__unindex( tqId )
+        self.__index( tqId, newTQDefs[ tqId ] )
+      for tqId in tqPriorities:
+        if tqId in self.__tqs:
+          self.__tqs[ tqId ][ 'Priority' ] = tqPriorities[ tqId ]
+      #New jobs may have arrived to the TQs that were empty
+      self.__emptyTQs = {}
+      self.__jobSharingGroups = {}
+    finally:
+      self.__lock.release()
+
+  def forgetJob( self, jobId ):
+    """
+    The job is no longer waiting in a task queue
+    """
+    self.__lock.acquire()
+    try:
+      tqId = self.__jobToTQ.pop( jobId, None )
+      if tqId is not None:
+        try:
+          self.__candidateJobs[ tqId ].remove( jobId )
+        except ( KeyError, ValueError ):
+          pass
+    finally:
+      self.__lock.release()
+
+  def __index( self, tqId, tqDef ):
+    tqData = { 'Priority' : float( tqDef.get( 'Priority', 1 ) ) }
+    for field in SINGLE_VALUE_FIELDS:
+      tqData[ field ] = tqDef[ field ]
+    tqData[ 'CPUTime' ] = long( tqData[ 'CPUTime' ] )
+    for field in self.__multiValueDefFields:
+      values = frozenset( [ value for value in tqDef.get( field, [] ) if value.strip() ] )
+      tqData[ field ] = values
+      if not values:
+        self.__withoutValues[ field ].add( tqId )
+      fieldIndex = self.__byValue[ field ]
+      for value in values:
+        fieldIndex.setdefault( value, set() ).add( tqId )
+    self.__bySetup.setdefault( tqData[ 'Setup' ], set() ).add( tqId )
+    self.__byCPUTime.setdefault( tqData[ 'CPUTime' ], set() ).add( tqId )
+    self.__tqs[ tqId ] = tqData
+
+  def __discardFromIndex( self, fieldIndex, key, tqId ):
+    tqSet = fieldIndex.get( key )
+    if tqSet is None:
+      return
+    tqSet.discard( tqId )
+    if not tqSet:
+      del( fieldIndex[ key ] )
+
+  def __unindex( self, tqId ):
+    tqData = self.__tqs.pop( tqId )
+    for field in self.__multiValueDefFields:
+      self.__withoutValues[ field ].discard( tqId )
+      for value in tqData[ field ]:
+        self.__discardFromIndex( self.__byValue[ field ], value, tqId )
+    self.__discardFromIndex( self.__bySetup, tqData[ 'Setup' ], tqId )
+    self.__discardFromIndex( self.__byCPUTime, tqData[ 'CPUTime' ], tqId )
+    for jobId in self.__candidateJobs.pop( tqId, [] ):
+      self.__jobToTQ.pop( jobId, None )
+    self.__emptyTQs.pop( tqId, None )
+
+  #
+  # Matching
+  #
+
+  def __hasJobSharing( self, group ):
+    if group not in self.__jobSharingGroups:
+      self.__jobSharingGroups[ group ] = Properties.JOB_SHARING in CS.getPropertiesForGroup( group )
+    return self.__jobSharingGroups[ group ]
+
+  def __getOwnerCheck( self, tqMatchDict ):
+    """
+    Build a function that checks the owner of a TQ, or None if any owner is good
+    """
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      sharingGroups = set()
+      pairs = set()
+      for group in _toList( tqMatchDict[ 'OwnerGroup' ] ):
+        if self.__hasJobSharing( group ):
+          sharingGroups.add( group )
+        else:
+          for dn in _toList( tqMatchDict[ 'OwnerDN' ] ):
+            pairs.add( ( dn, group ) )
+      return lambda tqData: tqData[ 'OwnerGroup' ] in sharingGroups or \
+                            ( tqData[ 'OwnerDN' ], tqData[ 'OwnerGroup' ] ) in pairs
+    checks = []
+    for field in ( 'OwnerGroup', 'OwnerDN' ):
+      if field in tqMatchDict:
+        checks.append( ( field, set( _toList( tqMatchDict[ field ] ) ) ) )
+    if not checks:
+      return None
+    return lambda tqData: not [ True for field, values in checks if tqData[ field ] not in values ]
+
+  def __checkNegativeDict( self, tqData, negativeCond ):
+    """
+    not ( cond1 and cond2 ) = ( not cond1 or not cond 2 )
+    """
+    for field in negativeCond:
+      if field in MULTI_VALUE_MATCH_FIELDS:
+        tqValues = tqData.get( MULTI_VALUE_MATCH_FIELDS[ field ], frozenset() )
+        if not [ True for value in _toList( negativeCond[ field ] ) if value in tqValues ]:
+          return True
+      elif field in SINGLE_VALUE_FIELDS:
+        for value in _toList( negativeCond[ field ] ):
+          if str( value ) != str( tqData[ field ] ):
+            return True
+    return False
+
+  def __checkNegativeCond( self, tqData, negativeCond ):
+    if type( negativeCond ) in ( list, tuple ):
+      for condDict in negativeCond:
+        if self.__checkNegativeDict( tqData, condDict ):
+          return True
+      return False
+    return self.__checkNegativeDict( tqData, negativeCond )
+
+  def __findMatchingTaskQueues( self, tqMatchDict, negativeCond ):
+    #Each condition is the union of some index sets. They are not merged to avoid copying big sets
+    conditions = []
+    #Mandatory single value fields
+    conditions.append( [ self.__bySetup[ setup ] for setup in _toList( tqMatchDict[ 'Setup' ] )
+                         if setup in self.__bySetup ] )
+    maxCPUTime = max( [ long( cpuTime ) for cpuTime in _toList( tqMatchDict[ 'CPUTime' ] ) ] )
+    conditions.append( [ self.__byCPUTime[ cpuTime ] for cpuTime in self.__byCPUTime if cpuTime <= maxCPUTime ] )
+    #TQs without requirements for the field or requiring one of the values
+    checks = []
+    #( field, values ): TQs having all the values in the field are excluded
+    exclusions = []
+    for matchField in MULTI_VALUE_MATCH_FIELDS:
+      field = MULTI_VALUE_MATCH_FIELDS[ matchField ]
+      if field not in self.__byValue:
+        continue
+      if matchField not in tqMatchDict:
+        if matchField in STRICT_REQUIRE_MATCH_FIELDS:
+          conditions.append( [ self.__withoutValues[ field ] ] )
+        continue
+      matchValues = _toList( tqMatchDict[ matchField ] )
+      if not tqMatchDict[ matchField ]:
+        continue
+      if matchField in TAG_MATCH_FIELDS:
+        #All the tags required by the TQ have to be offered
+        if tqMatchDict[ matchField ] != 'Any':
+          checks.append( ( field, frozenset( matchValues ) ) )
+      else:
+        fieldIndex = self.__byValue[ field ]
+        conditions.append( [ self.__withoutValues[ field ] ] +
+                           [ fieldIndex[ value ] for value in matchValues if value in fieldIndex ] )
+        if matchField == 'Site' and 'BannedSites' in self.__byValue:
+          exclusions.append( ( 'BannedSites', matchValues ) )
+    for matchField in MULTI_VALUE_MATCH_FIELDS:
+      bannedField = "Banned%s" % matchField
+      field = MULTI_VALUE_MATCH_FIELDS[ matchField ]
+      if tqMatchDict.get( bannedField ) and field in self.__byValue:
+        exclusions.append( ( field, _toList( tqMatchDict[ bannedField ] ) ) )
+    #Start from the most selective condition and filter with the rest
+    conditions.sort( key = lambda tqSets: sum( [ len( tqSet ) for tqSet in tqSets ] ) )
+    candidates = set()
+    for tqSet in conditions[0]:
+      candidates.update( tqSet )
+    for tqSets in conditions[1:]:
+      if not candidates:
+        break
+      if len( tqSets ) == 1:
+        candidates.intersection_update( tqSets[0] )
+      else:
+        fieldCandidates = set()
+        for tqSet in tqSets:
+          fieldCandidates.update( candidates.intersection( tqSet ) )
+        candidates = fieldCandidates
+    for field, values in exclusions:
+      fieldIndex = self.__byValue[ field ]
+      if [ True for value in values if value not in fieldIndex ]:
+        continue
+      excluded = candidates.intersection( fieldIndex[ values[0] ] )
+      for value in values[1:]:
+        excluded.intersection_update( fieldIndex[ value ] )
+      candidates.difference_update( excluded )
+    ownerCheck = self.__getOwnerCheck( tqMatchDict )
+    if not checks and not ownerCheck and not negativeCond:
+      return candidates
+    matching = []
+    for tqId in candidates:
+      tqData = self.__tqs[ tqId ]
+      if ownerCheck and not ownerCheck( tqData ):
+        continue
+      valid = True
+      for field, values in checks:
+        valid = tqData[ field ] <= values
+        if not valid:
+          break
+      if not valid:
+        continue
+      if negativeCond and not self.__checkNegativeCond( tqData, negativeCond ):
+        continue
+      matching.append( tqId )
+    return matching
+
+  def findMatchingTaskQueues( self, tqMatchDict, negativeCond = {} ):
+    """
+    Get the ids of the TQs that match a resource description (not escaped)
+    """
+    self.__lock.acquire()
+    try:
+      return list( self.__findMatchingTaskQueues( tqMatchDict, negativeCond ) )
+    finally:
+      self.__lock.release()
+
+  def __sortByPriority( self, tqIds, numQueues ):
+    """
+    Random order weighted by priority, like ORDER BY RAND() / Priority
+    """
+    rand = random.random
+    weighted = [ ( rand() / max( self.__tqs[ tqId ][ 'Priority' ], 0.00001 ), tqId ) for tqId in tqIds ]
+    if numQueues:
+      return [ tqId for _, tqId in heapq.nsmallest( numQueues, weighted ) ]
+    weighted.sort()
+    return [ tqId for _, tqId in weighted ]
+
+  def __nextCandidateJob( self, tqId ):
+    """
+    Get the next candidate job of a TQ, loading more from the DB if needed.
+    Returns S_OK( jobId ) or S_OK( None ) if the TQ is empty
+    """
+    self.__lock.acquire()
+    try:
+      candidates = self.__candidateJobs.get( tqId )
+      if candidates:
+        jobId = candidates.pop()
+        self.__jobToTQ.pop( jobId, None )
+        return S_OK( jobId )
+      emptySince = self.__emptyTQs.get( tqId )
+      if emptySince and time.time() - emptySince < self.__emptyTQRetry:
+        return S_OK( None )
+    finally:
+      self.__lock.release()
+    result = self.__jobLoader( tqId, self.__numJobsPerLoad )
+    if not result[ 'OK' ]:
+      return result
+    jobs = list( result[ 'Value' ] )
+    self.__lock.acquire()
+    try:
+      if tqId not in self.__tqs:
+        return S_OK( None )
+      if not jobs:
+        self.__emptyTQs[ tqId ] = time.time()
+        return S_OK( None )
+      self.__emptyTQs.pop( tqId, None )
+      newJobs = []
+      for jobId in jobs:
+        if jobId not in self.__jobToTQ:
+          newJobs.append( jobId )
+          self.__jobToTQ[ jobId ] = tqId
+      #Jobs are popped from the end
+      newJobs.reverse()
+      candidates = self.__candidateJobs.setdefault( tqId, [] )
+      candidates[:0] = newJobs
+      if not candidates:
+        return S_OK( None )
+      jobId = candidates.pop()
+      self.__jobToTQ.pop( jobId, None )
+      return S_OK( jobId )
+    finally:
+      self.__lock.release()
+
+  def matchAndGetJob( self, tqMatchDict, numQueuesPerTry = 10, negativeCond = {}, maxRetries = 3 ):
+    """
+    Find a job for a resource description (not escaped). Returns S_OK( { 'matchFound' : bool,
+    'jobId' : jobId, 'taskQueueId' : tqId } )
+    """
+    triedTQs = set()
+    for _ in range( maxRetries ):
+      self.__lock.acquire()
+      try:
+        tqIds = [ tqId for tqId in self.__findMatchingTaskQueues( tqMatchDict, negativeCond )
+                  if tqId not in triedTQs ]
+        tqIds = self.__sortByPriority( tqIds, numQueuesPerTry )
+      finally:
+        self.__lock.release()
+      if not tqIds:
+        return S_OK( { 'matchFound' : False } )
+      for tqId in tqIds:
+        triedTQs.add( tqId )
+        while True:
+          result = self.__nextCandidateJob( tqId )
+          if not result[ 'OK' ]:
+            return result
+          jobId = result[ 'Value' ]
+          if jobId is None:
+            break
+          result = self.__jobExtractor( jobId, tqId )
+          if not result[ 'OK' ]:
+            return S_ERROR( "Could not take job %s out from the TQ %s: %s" % ( jobId, tqId, result[ 'Message' ] ) )
+          if result[ 'Value' ]:
+            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId } )
+    return S_OK( { 'matchFound' : False } )
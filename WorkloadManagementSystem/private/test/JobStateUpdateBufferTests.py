@@ -0,0 +1,170 @@
+########################################################################
+# $HeadURL $
+# File: JobStateUpdateBufferTests.py
+########################################################################
+
+""" :mod: JobStateUpdateBufferTests
+    ===============================
+
+    .. module: JobStateUpdateBufferTests
+    :synopsis: test cases for the write-behind JobStateUpdateBuffer
+
+    test cases for JobStateUpdateBuffer: coalescing, ordering, spill file replay and failed flushes
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import os
+import time
+import tempfile
+import unittest
+from DIRAC import S_OK, S_ERROR
+## SUT
+from DIRAC.WorkloadManagementSystem.private.JobStateUpdateBuffer import JobStateUpdateBuffer
+
+def statusEntry( status, minor, application = '' ):
+  return { 'Status' : status, 'MinorStatus' : minor, 'ApplicationStatus' : application, 'Source' : 'JobWrapper' }
+
+class FakeJobDB( object ):
+  """ JobDB keeping the job attributes in memory """
+
+  def __init__( self ):
+    self.jobs = { 1 : { 'Status' : 'Stalled' }, 2 : { 'Status' : 'Matched' } }
+    self.heartBeats = {}
+    self.fail = False
+    self.failJobs = []
+
+  def getAttributesForJobList( self, jobIDs, attrList ):
+    if self.fail:
+      return S_ERROR( 'Failed' )
+    return S_OK( dict( [ ( jobID, dict( self.jobs[jobID] ) ) for jobID in jobIDs if jobID in self.jobs ] ) )
+
+  def setJobAttributesBulk( self, attrDict, update = False ):
+    if [ jobID for jobID in attrDict if jobID in self.failJobs ]:
+      return S_ERROR( 'Failed' )
+    for jobID, jobAttrDict in attrDict.items():
+      self.jobs[jobID].update( jobAttrDict )
+    return S_OK()
+
+  def setStartExecTime( self, jobID, startDate ):
+    self.jobs[jobID].setdefault( 'StartExecTime', startDate )
+    return S_OK()
+
+  def setEndExecTime( self, jobID, endDate ):
+    self.jobs[jobID].setdefault( 'EndExecTime', endDate )
+    return S_OK()
+
+  def setHeartBeatDataBulk( self, heartBeatDict ):
+    for jobID, heartBeat in heartBeatDict.items():
+      if heartBeat['SetRunning']:
+        self.jobs[jobID]['Status'] = 'Running'
+      self.heartBeats.setdefault( jobID, [] ).extend( heartBeat['DynamicData'] )
+    return S_OK()
+
+class FakeLogDB( object ):
+  """ JobLoggingDB keeping the logging records in memory """
+
+  def __init__( self ):
+    self.records = []
+
+  def getLastStatusTimes( self, jobIDs ):
+    lastTime = str( time.mktime( time.strptime( '2013-01-01 00:00:00', '%Y-%m-%d %H:%M:%S' ) ) )
+    return S_OK( dict( [ ( jobID, lastTime ) for jobID in jobIDs ] ) )
+
+  def addLoggingRecords( self, records ):
+    self.records += records
+    return S_OK()
+
+########################################################################
+class JobStateUpdateBufferTestCase( unittest.TestCase ):
+  """
+  .. class:: JobStateUpdateBufferTestCase
+
+  """
+
+  def setUp( self ):
+    self.spillFile = tempfile.mktemp( suffix = '.spill' )
+    self.jobDB = FakeJobDB()
+    self.logDB = FakeLogDB()
+
+  def tearDown( self ):
+    for fileName in ( self.spillFile, '%s.flushing' % self.spillFile ):
+      if os.path.exists( fileName ):
+        os.unlink( fileName )
+
+  def newBuffer( self ):
+    updateBuffer = JobStateUpdateBuffer( self.jobDB, self.logDB, spillFile = self.spillFile )
+    self.assertTrue( updateBuffer.initialize()['OK'] )
+    return updateBuffer
+
+  def test01Coalesce( self ):
+    """ status updates are merged per job and ordered by date, unknown jobs are dropped """
+    updateBuffer = self.newBuffer()
+    updateBuffer.addStatus( 1, { '2013-02-01 10:00:00' : statusEntry( 'Running', 'Application' ) } )
+    updateBuffer.addStatus( 1, { '2013-02-01 11:00:00' : statusEntry( 'Done', 'Execution Complete' ),
+                                 '2012-12-31 00:00:00' : statusEntry( 'Received', 'Too old' ) } )
+    updateBuffer.addStatus( 3, { '2013-02-01 11:00:00' : statusEntry( 'Done', 'Execution Complete' ) } )
+    self.assertEqual( updateBuffer.getNumberOfJobs(), 2 )
+    result = updateBuffer.flush()
+    self.assertEqual( result['Value'], 1 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Done' )
+    self.assertEqual( self.jobDB.jobs[1]['MinorStatus'], 'Execution Complete' )
+    self.assertEqual( self.jobDB.jobs[1]['StartExecTime'], '2013-02-01 10:00:00' )
+    self.assertEqual( self.jobDB.jobs[1]['EndExecTime'], '2013-02-01 11:00:00' )
+    self.assertEqual( len( self.logDB.records ), 3 )
+    self.assertEqual( updateBuffer.getNumberOfJobs(), 0 )
+
+  def test02HeartBeatOrder( self ):
+    """ a heart beat only sets the job Running if it came after the last status update """
+    updateBuffer = self.newBuffer()
+    updateBuffer.addHeartBeat( 1, { 'CPU' : 'x' }, { 'Load' : 1.5 } )
+    updateBuffer.addStatus( 2, { '2013-02-01 11:00:00' : statusEntry( 'Done', 'Execution Complete' ) } )
+    # The updates are ordered by the time they are received
+    time.sleep( 0.01 )
+    updateBuffer.addStatus( 1, { '2013-02-01 11:00:00' : statusEntry( 'Done', 'Execution Complete' ) } )
+    updateBuffer.addHeartBeat( 2, {}, { 'Load' : 2.5 } )
+    updateBuffer.flush()
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Done' )
+    self.assertEqual( self.jobDB.jobs[2]['Status'], 'Running' )
+    self.assertEqual( len( self.jobDB.heartBeats[1] ), 1 )
+
+  def test03Spill( self ):
+    """ pending updates are replayed from the spill file and kept if the DB can not be read """
+    updateBuffer = self.newBuffer()
+    updateBuffer.addStatus( 1, { '2013-02-01 11:00:00' : statusEntry( 'Done', 'Execution Complete' ) } )
+    updateBuffer.addHeartBeat( 2, {}, { 'Load' : 2.5 } )
+
+    updateBuffer = self.newBuffer()
+    self.assertEqual( updateBuffer.getNumberOfJobs(), 2 )
+    self.jobDB.fail = True
+    self.assertFalse( updateBuffer.flush()['OK'] )
+    self.assertEqual( updateBuffer.getNumberOfJobs(), 2 )
+    self.assertFalse( os.path.exists( '%s.flushing' % self.spillFile ) )
+
+    self.jobDB.fail = False
+    updateBuffer = self.newBuffer()
+    self.assertEqual( updateBuffer.flush( [ 2 ] )['Value'], 1 )
+    self.assertEqual( updateBuffer.getNumberOfJobs(), 1 )
+    self.assertEqual( len( self.jobDB.heartBeats[2] ), 1 )
+    self.assertEqual( updateBuffer.flush()['Value'], 1 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Done' )
+    self.assertEqual( open( self.spillFile ).read(), '' )
+
+  def test04FailedJob( self ):
+    """ the updates of a job that can not be written are dropped, the others are written """
+    updateBuffer = self.newBuffer()
+    updateBuffer.addStatus( 1, { '2013-02-01 11:00:00' : statusEntry( 'Done', 'Execution Complete' ) } )
+    updateBuffer.addStatus( 2, { '2013-02-01 11:00:00' : statusEntry( 'Failed', "Can't run" ) } )
+    self.jobDB.failJobs = [ 2 ]
+    self.assertFalse( updateBuffer.flush()['OK'] )
+    self.assertEqual( updateBuffer.getNumberOfJobs(), 0 )
+    self.assertEqual( self.jobDB.jobs[1]['Status'], 'Done' )
+    self.assertEqual( self.jobDB.jobs[2]['Status'], 'Matched' )
+    self.assertEqual( open( self.spillFile ).read(), '' )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( JobStateUpdateBufferTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+########################################################################
+# $HeadURL $
+# File: TaskQueueIndexBenchmark.py
+########################################################################
+
+""" :mod: TaskQueueIndexBenchmark
+    =============================
+
+    .. module: TaskQueueIndexBenchmark
+    :synopsis: matching throughput of the in memory TaskQueueIndex
+
+    Fills a TaskQueueIndex with random task queues and waiting jobs kept in memory
+    (the loader and extractor play the role of the tq_Jobs table) and matches random
+    resources against it. As a reference, the same resources are matched by checking
+    every task queue one by one, which is what the SQL match query has to do.
+
+    Usage: python TaskQueueIndexBenchmark.py [taskQueues] [jobs] [matches]
+"""
+
+__RCSID__ = "$Id $"
+
+import sys
+import time
+import random
+from DIRAC.Core.Utilities.ReturnValues import S_OK
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+MULTI_VALUE_FIELDS = ( 'Sites', 'GridCEs', 'GridMiddlewares', 'BannedSites', 'Platforms',
+                       'PilotTypes', 'SubmitPools', 'JobTypes', 'Tags' )
+SITES = [ "LCG.Site%03d.ch" % i for i in range( 200 ) ]
+PLATFORMS = [ "x86_64-slc5", "x86_64-slc6", "x86_64-centos7" ]
+JOB_TYPES = [ "User", "MCSimulation", "Reconstruction", "Merge" ]
+CPU_SEGMENTS = [ 3600, 86400, 172800, 345600 ]
+OWNERS = [ ( "/DN/user%03d" % i, "group%02d" % ( i % 20 ) ) for i in range( 500 ) ]
+
+class JobStore:
+  """ waiting jobs of each TQ, like the tq_Jobs table """
+
+  def __init__( self ):
+    self.jobs = {}
+
+  def loadJobs( self, tqId, numJobs ):
+    return S_OK( self.jobs.get( tqId, [] )[ :numJobs ] )
+
+  def extractJob( self, jobId, tqId ):
+    try:
+      self.jobs[ tqId ].remove( jobId )
+    except ( KeyError, ValueError ):
+      return S_OK( False )
+    return S_OK( True )
+
+def generateTaskQueues( numTQs, numJobs, jobStore ):
+  tqDefs = {}
+  for tqId in range( 1, numTQs + 1 ):
+    ownerDN, ownerGroup = random.choice( OWNERS )
+    tqDef = { 'OwnerDN' : ownerDN, 'OwnerGroup' : ownerGroup, 'Setup' : 'Production',
+              'CPUTime' : random.choice( CPU_SEGMENTS ), 'Priority' : random.randint( 1, 10 ),
+              'JobTypes' : [ random.choice( JOB_TYPES ) ],
+              'Platforms' : random.sample( PLATFORMS, random.randint( 1, 2 ) ) }
+    if random.random() < 0.3:
+      tqDef[ 'Sites' ] = random.sample( SITES, random.randint( 1, 5 ) )
+    if random.random() < 0.1:
+      tqDef[ 'BannedSites' ] = random.sample( SITES, 3 )
+    tqDefs[ tqId ] = tqDef
+    jobStore.jobs[ tqId ] = []
+  for jobId in range( 1, numJobs + 1 ):
+    jobStore.jobs[ random.randint( 1, numTQs ) ].append( jobId )
+  return tqDefs
+
+def generateResources( numResources ):
+  resources = []
+  for i in range( numResources ):
+    resources.append( { 'Setup' : 'Production', 'CPUTime' : random.choice( CPU_SEGMENTS ),
+                        'Site' : random.choice( SITES ), 'Platform' : random.choice( PLATFORMS ),
+                        'JobType' : JOB_TYPES[:2] } )
+  return resources
+
+def scanMatch( tqDefs, resource ):
+  """ check every TQ like the SQL query does """
+  matching = []
+  for tqId in tqDefs:
+    tqDef = tqDefs[ tqId ]
+    if tqDef[ 'Setup' ] != resource[ 'Setup' ] or tqDef[ 'CPUTime' ] > resource[ 'CPUTime' ]:
+      continue
+    if tqDef.get( 'Sites' ) and resource[ 'Site' ] not in tqDef[ 'Sites' ]:
+      continue
+    if resource[ 'Site' ] in tqDef.get( 'BannedSites', () ):
+      continue
+    if resource[ 'Platform' ] not in tqDef[ 'Platforms' ]:
+      continue
+    if not [ True for jobType in resource[ 'JobType' ] if jobType in tqDef[ 'JobTypes' ] ]:
+      continue
+    matching.append( tqId )
+  return matching
+
+if __name__ == "__main__":
+  numTQs = 10000
+  numJobs = 1000000
+  numMatches = 2000
+  if len( sys.argv ) > 1:
+    numTQs = int( sys.argv[1] )
+  if len( sys.argv ) > 2:
+    numJobs = int( sys.argv[2] )
+  if len( sys.argv ) > 3:
+    numMatches = int( sys.argv[3] )
+  random.seed( 1234 )
+  jobStore = JobStore()
+  tqDefs = generateTaskQueues( numTQs, numJobs, jobStore )
+  resources = generateResources( numMatches )
+  print "%s TQs, %s waiting jobs, %s matches" % ( numTQs, numJobs, numMatches )
+
+  start = time.time()
+  tqIndex = TaskQueueIndex( MULTI_VALUE_FIELDS, jobStore.loadJobs, jobStore.extractJob )
+  tqIndex.syncTaskQueues( dict( [ ( tqId, tqDefs[ tqId ][ 'Priority' ] ) for tqId in tqDefs ] ), tqDefs )
+  print "Index built in %.2f s" % ( time.time() - start )
+
+  start = time.time()
+  for resource in resources:
+    scanMatch( tqDefs, resource )
+  elapsed = time.time() - start
+  print "Full scan match:  %8.1f matches/s (%.3f ms per match)" % ( numMatches / elapsed, elapsed * 1000 / numMatches )
+
+  start = time.time()
+  for resource in resources:
+    tqIndex.findMatchingTaskQueues( resource )
+  elapsed = time.time() - start
+  print "Index match:      %8.1f matches/s (%.3f ms per match)" % ( numMatches / elapsed, elapsed * 1000 / numMatches )
+
+  matched = 0
+  start = time.time()
+  for resource in resources:
+    result = tqIndex.matchAndGetJob( resource )
+    if result[ 'OK' ] and result[ 'Value' ][ 'matchFound' ]:
+      matched += 1
+  elapsed = time.time() - start
+  print "Index match+job:  %8.1f matches/s (%.3f ms per match), %s jobs matched" % ( numMatches / elapsed,
+                                                                                    elapsed * 1000 / numMatches,
+                                                                                    matched )
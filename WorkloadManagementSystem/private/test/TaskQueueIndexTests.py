@@ -0,0 +1,89 @@
+########################################################################
+# $HeadURL $
+# File: TaskQueueIndexTests.py
+########################################################################
+
+""" :mod: TaskQueueIndexTests
+    =========================
+
+    .. module: TaskQueueIndexTests
+    :synopsis: test cases for the in memory TaskQueueIndex
+
+    test cases for TaskQueueIndex: match conditions, priorities and job extraction
+"""
+
+__RCSID__ = "$Id $"
+
+## imports
+import unittest
+## SUT
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+MULTI_VALUE_FIELDS = ( 'Sites', 'GridCEs', 'GridMiddlewares', 'BannedSites', 'Platforms',
+                       'PilotTypes', 'SubmitPools', 'JobTypes', 'Tags' )
+
+def tqDef( **kwargs ):
+  tqDict = { 'OwnerDN' : '/DN/user', 'OwnerGroup' : 'user', 'Setup' : 'Test', 'CPUTime' : 86400, 'Priority' : 1 }
+  tqDict.update( kwargs )
+  return tqDict
+
+########################################################################
+class TaskQueueIndexTestCase( unittest.TestCase ):
+  """
+  .. class:: TaskQueueIndexTestCase
+
+  """
+
+  def setUp( self ):
+    self.jobs = { 1 : [ 10, 11 ], 2 : [ 20 ], 3 : [ 30 ], 4 : [ 40 ] }
+    self.extracted = []
+    self.index = TaskQueueIndex( MULTI_VALUE_FIELDS, self.loadJobs, self.extractJob, numJobsPerLoad = 1 )
+    self.index.syncTaskQueues( { 1 : 1, 2 : 1, 3 : 1, 4 : 1 },
+                               { 1 : tqDef( Sites = [ 'LCG.CERN.ch' ] ),
+                                 2 : tqDef( BannedSites = [ 'LCG.CERN.ch' ], Platforms = [ 'x86_64' ] ),
+                                 3 : tqDef( Tags = [ 'GPU' ], CPUTime = 500000 ),
+                                 4 : tqDef( OwnerDN = '/DN/other', Setup = 'Other' ) } )
+
+  def loadJobs( self, tqId, numJobs ):
+    return { 'OK' : True, 'Value' : [ jobId for jobId in self.jobs[ tqId ] if jobId not in self.extracted ][ :numJobs ] }
+
+  def extractJob( self, jobId, tqId ):
+    if jobId in self.extracted:
+      return { 'OK' : True, 'Value' : False }
+    self.extracted.append( jobId )
+    return { 'OK' : True, 'Value' : True }
+
+  def match( self, **kwargs ):
+    matchDict = { 'Setup' : 'Test', 'CPUTime' : 100000 }
+    matchDict.update( kwargs )
+    return sorted( self.index.findMatchingTaskQueues( matchDict ) )
+
+  def testMatch( self ):
+    """ same conditions as the SQL match """
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch' ), [ 1 ] )
+    self.assertEqual( self.match( Site = 'LCG.PIC.es', Platform = 'x86_64' ), [ 2 ] )
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch', Platform = 'x86_64' ), [ 1 ] )
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch', BannedSite = 'LCG.CERN.ch' ), [] )
+    self.assertEqual( self.match( Site = 'LCG.PIC.es', CPUTime = 600000, Tag = [ 'GPU', 'MP' ] ), [ 3 ] )
+    self.assertEqual( self.match( Site = 'LCG.PIC.es', CPUTime = 600000, Tag = 'Any' ), [ 3 ] )
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch', OwnerDN = '/DN/other' ), [] )
+    self.assertEqual( self.match( Setup = 'Other', Site = 'LCG.PIC.es' ), [ 4 ] )
+
+  def testGetJob( self ):
+    """ jobs are extracted once and priorities are kept up to date """
+    self.index.setTaskQueuePriority( 1, 0 )
+    result = self.index.matchAndGetJob( { 'Setup' : 'Test', 'CPUTime' : 100000, 'Site' : 'LCG.CERN.ch' } )
+    self.assertEqual( result[ 'Value' ], { 'matchFound' : True, 'jobId' : 10, 'taskQueueId' : 1 } )
+    #Another matcher took job 11
+    self.extracted.append( 11 )
+    result = self.index.matchAndGetJob( { 'Setup' : 'Test', 'CPUTime' : 100000, 'Site' : 'LCG.CERN.ch' } )
+    self.assertEqual( result[ 'Value' ][ 'matchFound' ], False )
+    self.index.syncTaskQueues( { 2 : 1 }, {} )
+    self.assertEqual( self.index.getTaskQueueIds(), [ 2 ] )
+    self.assertEqual( self.match( Site = 'LCG.CERN.ch' ), [] )
+
+## test execution
+if __name__ == "__main__":
+  TESTLOADER = unittest.TestLoader()
+  SUITE = TESTLOADER.loadTestsFromTestCase( TaskQueueIndexTestCase )
+  unittest.TextTestRunner( verbosity = 3 ).run( SUITE )